@@ -0,0 +1,298 @@
+import sys
+import json
+import time
+import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from candle_store import interval_seconds, parse_time
+from candle_cache import CandleCache, KLINE_LIMIT
+from binance_api import KLINES_WEIGHT
+from journal import JOURNAL
+
+
+
+SPOT_URL = 'https://api.binance.com'
+KLINES_PATH = '/api/v3/klines'
+WORKERS = 8
+RETRY_DELAY = 5
+MAX_DELAY = 60
+
+def windows(start,end,timesetup,limit=KLINE_LIMIT):
+    '''
+    split [start , end) into kline-limit sized windows
+        args:
+            start , end (int) : ms
+            timesetup (str) : '1m' , '5m' , '1h' ....
+        return:
+            list : [(startTime , endTime) , ....] ms , endTime is inclusive like binance
+    '''
+    step = interval_seconds(timesetup)*1000
+    start = -(-start//step)*step
+    size = step*limit
+    return [(t,min(t+size,end)-1) for t in range(start,end,size)]
+def to_ms(value):
+    '''
+    '2023-01-01' , '2023-01-01 08:00:00' ( utc ) , epoch seconds or ms -> ms
+    '''
+    if isinstance(value,str) and not value.isdigit():
+        return parse_time(value)*1000
+    value = int(value)
+    if value < 10**11:
+        return value*1000
+    return value
+class HttpKlines:
+    '''
+    klines over plain HTTP with pooled keep-alive connections , every request goes through the RequestScheduler budget
+        args:
+            base_url (str) : binance spot api , or a local stand-in ( KlineServer.url )
+            scheduler (RequestScheduler) : default REQUESTS , weight headers of responses are read by scheduler.observe
+            pool_size (int) : connections kept open , at least the number of workers
+    '''
+    def __init__(self,base_url=SPOT_URL,scheduler=None,pool_size=WORKERS,timeout=10):
+        import requests
+        from requests.adapters import HTTPAdapter
+        if scheduler == None:
+            from binance_api import REQUESTS
+            scheduler = REQUESTS
+        self.url = base_url.rstrip('/')+KLINES_PATH
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,pool_maxsize=pool_size)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+        self.session.hooks['response'].append(scheduler.observe)
+    def get_klines(self,symbol,interval,startTime,endTime,limit=KLINE_LIMIT):
+        response = self.session.get(self.url,params={'symbol':symbol,'interval':interval,'startTime':startTime,
+                                                     'endTime':endTime,'limit':limit},timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    def __call__(self,symbol,interval,start,end,limit=KLINE_LIMIT):
+        return self.scheduler.call(self.get_klines,symbol,interval,start,end,limit,weight=KLINES_WEIGHT,market='spot')
+class _Job:
+    def __init__(self,symbol,timesetup,cache,spans):
+        self.symbol = symbol
+        self.timesetup = timesetup
+        self.cache = cache
+        self.spans = spans
+        self.next = 0
+        self.written = 0
+        self.done = {}
+        self.failures = {}
+        self.added = 0
+        self.error = None
+    def waiting(self):
+        return self.error == None and self.next < len(self.spans)
+class Backfill:
+    '''
+    Parallel kline backfill into CandleCache
+        plan:
+            the range of every (symbol , timesetup) is split into windows of limit bars ,
+            windows of all keys are fetched on one bounded thread pool ( 2 * workers in flight ) , keys take turns
+        write:
+            windows are appended to the cache in time order as soon as every earlier window is there ,
+            at most ahead windows are fetched past the last written one ( bounded memory )
+        resume:
+            the cache index is saved after every append , a new run starts after the last stored close time
+        errors:
+            a window that still fails after the retries of the RequestScheduler ( or hits its open circuit )
+            is fetched again after RETRY_DELAY * 2 ** n seconds , at most retries times , then the key stops
+        args:
+            fetch (function) : fetch(symbol , interval , start_ms , end_ms , limit) -> klines , default HttpKlines()
+            workers (int) : threads
+            ahead (int) : windows of one key fetched past its last written window , default 4 * workers
+            path (str) : folder of the caches
+        Method:
+            run : backfill every key , return {'<symbol>-<timesetup>':{'bars','windows','error'}}
+    Notice:
+        the cache only grows forward , a start before the first stored bar is not filled
+    '''
+    def __init__(self,fetch=None,workers=WORKERS,ahead=None,path='./history',limit=KLINE_LIMIT,retries=5):
+        if fetch == None:
+            fetch = HttpKlines(pool_size=workers)
+        self.fetch = fetch
+        self.workers = workers
+        self.ahead = ahead or 4*workers
+        self.path = path
+        self.limit = limit
+        self.retries = retries
+    def _fetch(self,job,n,delay=0):
+        if delay > 0:
+            time.sleep(delay)
+        span = job.spans[n]
+        return self.fetch(job.symbol,job.timesetup,span[0],span[1],self.limit)
+    def plan(self,symbol,timesetup,start,end):
+        cache = CandleCache(symbol,timesetup,self.path)
+        if len(cache) > 0:
+            start = max(start,cache.last_close_time+1)
+        return _Job(symbol,timesetup,cache,windows(start,end,timesetup,self.limit))
+    def run(self,symbols,timesetups,start,end=None,now=None):
+        '''
+        args:
+            symbols (list) : ['BNBBUSD','BTCBUSD']
+            timesetups (list) : ['1m','1h']
+            start , end : ms , epoch seconds or '2023-01-01' , end default now
+        '''
+        if now == None:
+            now = int(time.time()*1000)
+        start = to_ms(start)
+        end = now if end == None else min(to_ms(end),now)
+        jobs = [self.plan(symbol,timesetup,start,end) for symbol in symbols for timesetup in timesetups]
+        running = {}
+        began = time.perf_counter()
+        with ThreadPoolExecutor(self.workers) as pool:
+            while True:
+                more = True
+                while more and len(running) < 2*self.workers:
+                    more = False
+                    for job in jobs:
+                        if len(running) >= 2*self.workers:
+                            break
+                        if job.waiting() and job.next-job.written < self.ahead:
+                            running[pool.submit(self._fetch,job,job.next)] = (job,job.next)
+                            job.next += 1
+                            more = True
+                if len(running) == 0:
+                    break
+                finished,_ = wait(list(running),return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job,n = running.pop(future)
+                    try:
+                        job.done[n] = future.result()
+                    except Exception as e:
+                        failures = job.failures.get(n,0)
+                        if job.error == None and failures < self.retries:
+                            job.failures[n] = failures+1
+                            JOURNAL.warning('error',source='backfill',symbol=job.symbol,timesetup=job.timesetup,window=n,error=repr(e))
+                            delay = min(MAX_DELAY,RETRY_DELAY*2**failures)
+                            running[pool.submit(self._fetch,job,n,delay)] = (job,n)
+                        elif job.error == None:
+                            job.error = repr(e)
+                            JOURNAL.error('error',source='backfill',symbol=job.symbol,timesetup=job.timesetup,window=n,error=repr(e))
+                        continue
+                    self._write(job,now)
+        result = {}
+        for job in jobs:
+            result[job.symbol+'-'+job.timesetup] = {'bars':job.added,'windows':job.written,'planned':len(job.spans),'error':job.error}
+            JOURNAL.info('backfill',symbol=job.symbol,timesetup=job.timesetup,bars=job.added,windows=job.written,
+                         planned=len(job.spans),error=job.error)
+        result['seconds'] = time.perf_counter()-began
+        return result
+    def _write(self,job,now):
+        while job.error == None and job.written in job.done:
+            klines = job.done.pop(job.written)
+            if len(klines) > 0:
+                job.added += job.cache.append_klines(klines,now)
+            job.written += 1
+class KlineServer:
+    '''
+    Local HTTP stand-in of GET /api/v3/klines for tests and benchmarks
+        args:
+            candles (dict) : {('BNBBUSD','1m'):CandleData}
+            latency (float) : seconds slept by every request ( round trip of the real api )
+            weight_limit (int) : used weight of the window above it answers 429 with Retry-After ( seconds left in the window )
+            window (float) : seconds of the weight window , 60 like binance , shorter for tests
+        Get:
+            url : base_url for HttpKlines
+            requests (int) : requests served
+    '''
+    def __init__(self,candles,latency=0.0,weight_limit=None,host='127.0.0.1',port=0,window=60):
+        self.candles = candles
+        self.latency = latency
+        self.weight_limit = weight_limit
+        self.seconds = window
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.weight = 0
+        self.window = 0
+        self.lock = threading.Lock()
+        self.text = {}
+        self.server = None
+    @property
+    def url(self):
+        return 'http://'+self.host+':'+str(self.server.server_address[1])
+    def rows(self,symbol,interval):
+        '''
+        json text of every kline , built once so the stand-in answers faster than the client can parse
+        '''
+        key = (symbol,interval)
+        if key not in self.text:
+            c = self.candles[key]
+            sec = interval_seconds(interval)
+            self.text[key] = [json.dumps([t*1000,repr(o),repr(h),repr(l),repr(cl),'0',(t+sec)*1000-1])
+                              for t,o,h,l,cl in zip(c.time.tolist(),c.open.tolist(),c.high.tolist(),c.low.tolist(),c.close.tolist())]
+        return self.text[key]
+    def klines(self,symbol,interval,start,end,limit):
+        '''
+        json body of GET /api/v3/klines
+        '''
+        c = self.candles[(symbol,interval)]
+        i = int(c.time.searchsorted(-(-start//1000)))
+        j = min(int(c.time.searchsorted(end//1000,side='right')),i+limit)
+        return '['+','.join(self.rows(symbol,interval)[i:j])+']'
+    def start(self):
+        from urllib.parse import urlparse, parse_qs
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        stand_in = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != KLINES_PATH:
+                    self.send_error(404)
+                    return
+                q = {k:v[0] for k,v in parse_qs(url.query).items()}
+                with stand_in.lock:
+                    stand_in.requests += 1
+                    now = time.time()
+                    window = int(now//stand_in.seconds)
+                    if window != stand_in.window:
+                        stand_in.window = window
+                        stand_in.weight = 0
+                    stand_in.weight += KLINES_WEIGHT
+                    weight = stand_in.weight
+                    left = (window+1)*stand_in.seconds-now
+                if stand_in.latency > 0:
+                    time.sleep(stand_in.latency)
+                if stand_in.weight_limit != None and weight > stand_in.weight_limit:
+                    body = b'{"code":-1003,"msg":"Too many requests"}'
+                    self.send_response(429)
+                    self.send_header('Retry-After',str(max(1,int(-(-left//1)))))
+                else:
+                    body = (stand_in.klines(q['symbol'],q['interval'],int(q['startTime']),int(q.get('endTime',2**62)),
+                                                      int(q.get('limit',KLINE_LIMIT)))).encode()
+                    self.send_response(200)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(body)))
+                self.send_header('X-MBX-USED-WEIGHT-1M',str(weight))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self,*args):
+                pass
+        self.server = ThreadingHTTPServer((self.host,self.port),Handler)
+        self.server.daemon_threads = True
+        for key in self.candles:
+            self.rows(*key)
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+        return self
+    def stop(self):
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+if __name__ == '__main__':
+    '''
+    python backfill.py BNBBUSD BTCBUSD --timesetup 1m 1h --start 2023-01-01 [--end 2024-01-01] [--workers 8]
+    '''
+    parser = argparse.ArgumentParser(description='parallel kline backfill into ./history/<symbol>-<tf>.bin')
+    parser.add_argument('symbol',nargs='+')
+    parser.add_argument('--timesetup',nargs='+',default=['1m'])
+    parser.add_argument('--start',required=True,help="'2023-01-01' , epoch seconds or ms")
+    parser.add_argument('--end',default=None)
+    parser.add_argument('--workers',type=int,default=WORKERS)
+    parser.add_argument('--url',default=SPOT_URL,help='api base url ( local stand-in for tests )')
+    parser.add_argument('--path',default='./history')
+    args = parser.parse_args()
+    result = Backfill(HttpKlines(args.url,pool_size=args.workers),args.workers,path=args.path).run(args.symbol,args.timesetup,args.start,args.end)
+    json.dump(result,sys.stdout,indent=1)
+    print()
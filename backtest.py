@@ -0,0 +1,164 @@
+import numpy as np
+from candle_store import CandleData, interval_seconds
+
+
+
+FEE = 0.0004
+FUNDING_INTERVAL = 8*3600
+
+def collect_actions(strategy,data_short,data_long,short_period,long_period=None):
+    '''
+    run strategy bar by bar and keep every action , no future bar is shown to the strategy
+        args:
+            strategy (function) : strategy(shortdata,longdata,data_dict)
+            data_short (CandleData)
+            data_long (CandleData or {})
+            short_period (str) : '1m' , '5m' , '1h'
+            long_period (str) : '1h' , '4h' , '1d' or None
+        return:
+            actions (list) : [(position of bar , action) , ....]
+    '''
+    actions = []
+    data_dict = {}
+    long_count = None
+    if long_period != None and len(data_long) > 0:
+        bar_close = data_short.time+interval_seconds(short_period)
+        long_close = data_long.time+interval_seconds(long_period)
+        long_count = np.searchsorted(long_close,bar_close,side='right')
+    # one view of each series moved forward every bar , no view is made inside the loop
+    shortdata = CandleData.view(data_short,0,len(data_short))
+    longdata = data_long
+    if long_count is not None:
+        longdata = CandleData.view(data_long,0,len(data_long))
+        long_count = long_count.tolist()
+    for i in range(len(data_short)):
+        shortdata.advance(i+1)
+        if long_count is not None:
+            longdata.advance(long_count[i])
+        data_dict = strategy(shortdata,longdata,data_dict)
+        if data_dict['action'] != {}:
+            actions.append((i,data_dict['action']))
+    return actions
+def backtest(candles,actions,ratio,balance=1000.0,fee=FEE,funding_rate=0.0,timesetup=None):
+    '''
+    simulate the actions of make_action on candles
+        args:
+            candles (CandleData)
+            actions (list) : [(position of bar , {'method':'open'/'close','position':'long'/'short','stoploss':float}) , ....]
+            ratio (float) : 0.025 , part of balance lost when stoploss is hit ( same as script.ratio )
+            balance (float) : start money
+            fee (float) : taker fee for each side
+            funding_rate (float) : paid by long ( received by short ) every 8 hours
+            timesetup (str) : period of candles '1m' ... '1d' , default the shortest gap between bars
+        return:
+            result (dict) :
+                equity (np.ndarray) : balance + unrealized pnl at close of every bar
+                drawdown (np.ndarray) : equity / highest equity - 1
+                max_drawdown (float)
+                trades (list) : [{'position','entry_time','exit_time','entry','exit','quantity','pnl','fee','funding','reason'} , ....]
+                final (float) : last equity
+    Notice:
+        open fills at close of the action bar ( the mark price make_action reads )
+        STOP_MARKET fills at stoploss when low/high of a later bar touches it , or at open when the bar gaps over it
+        close is ignored when there is no position , open is ignored when the same position is held
+        funding is paid for every funding time ( utc 0 , 8 , 16 ) inside the bars after the entry bar , at the open of the bar
+    '''
+    n = len(candles)
+    if timesetup != None:
+        interval = interval_seconds(timesetup)
+    elif n > 1:
+        interval = int(np.diff(candles.time).min())
+    else:
+        interval = FUNDING_INTERVAL
+    close = candles.close
+    equity = np.full(n,balance,dtype='float64')
+    trades = []
+    cash = balance
+    hold = None
+    for k in range(len(actions)+1):
+        if k < len(actions):
+            i,action = actions[k]
+        else:
+            i,action = n-1,{'method':'close','position':None}
+        if hold != None:
+            exit_i,exit_price,reason = _find_stop(candles,hold,i)
+            if exit_i is None and (action['method'] == 'close' or action['position'] != hold['position']):
+                exit_i,exit_price,reason = i,float(close[i]),'close'
+                if k == len(actions):
+                    reason = 'end'
+            if exit_i is None:
+                continue
+            trade = _close_trade(candles,hold,exit_i,exit_price,reason,fee,funding_rate,interval)
+            trades.append(trade)
+            equity[hold['index']:exit_i] = cash+hold['sign']*hold['quantity']*(close[hold['index']:exit_i]-hold['entry'])-hold['fee']
+            cash += trade['pnl']
+            equity[exit_i:] = cash
+            hold = None
+        if action['method'] == 'open' and k < len(actions):
+            hold = _open_trade(candles,i,action,cash,ratio,fee)
+    drawdown = equity/np.maximum.accumulate(equity)-1
+    return {'equity':equity,'drawdown':drawdown,'max_drawdown':float(drawdown.min()) if n else 0.0,
+            'trades':trades,'final':float(equity[-1]) if n else balance}
+def _open_trade(candles,i,action,cash,ratio,fee):
+    mark = float(candles.close[i])
+    stoploss = float(action['stoploss'])
+    if action['position'] == 'long':
+        sign = 1
+        lossrate = (mark-stoploss)/mark
+    else:
+        sign = -1
+        lossrate = (stoploss-mark)/mark
+    if lossrate <= 0:
+        return None
+    margin = (cash*ratio)/lossrate
+    quantity = (margin*0.999)/mark
+    return {'position':action['position'],'sign':sign,'index':i,'entry':mark,'stoploss':stoploss,
+            'quantity':quantity,'fee':quantity*mark*fee}
+def _find_stop(candles,hold,stop_i):
+    '''
+    first bar after entry ( up to stop_i ) that touches the stoploss
+    '''
+    start = hold['index']+1
+    if start > stop_i:
+        return None,None,None
+    stoploss = hold['stoploss']
+    if hold['sign'] == 1:
+        hit = candles.low[start:stop_i+1] <= stoploss
+    else:
+        hit = candles.high[start:stop_i+1] >= stoploss
+    if not hit.any():
+        return None,None,None
+    j = start+int(hit.argmax())
+    price = float(candles.open[j])
+    if hold['sign'] == 1:
+        price = min(price,stoploss)
+    else:
+        price = max(price,stoploss)
+    return j,price,'stoploss'
+def funding_count(time,interval):
+    '''
+    number of funding times in [time , time+interval) of every bar
+        args:
+            time (np.ndarray int64) : open time of bars , epoch seconds
+            interval (int) : seconds of one bar
+    '''
+    return (time+interval-1)//FUNDING_INTERVAL-(time-1)//FUNDING_INTERVAL
+def _close_trade(candles,hold,exit_i,exit_price,reason,fee,funding_rate,interval):
+    quantity = hold['quantity']
+    exit_fee = quantity*exit_price*fee
+    funding = 0.0
+    if funding_rate != 0:
+        paid = funding_count(candles.time[hold['index']+1:exit_i+1],interval)
+        funding = float(hold['sign']*funding_rate*quantity*(candles.open[hold['index']+1:exit_i+1]*paid).sum())
+    pnl = hold['sign']*quantity*(exit_price-hold['entry'])-hold['fee']-exit_fee-funding
+    return {'position':hold['position'],'entry_time':int(candles.time[hold['index']]),'exit_time':int(candles.time[exit_i]),
+            'entry':hold['entry'],'exit':float(exit_price),'quantity':quantity,'pnl':float(pnl),
+            'fee':hold['fee']+exit_fee,'funding':funding,'reason':reason}
+def summary(result,balance=1000.0):
+    '''
+    print result of backtest
+    '''
+    trades = result['trades']
+    win = len([t for t in trades if t['pnl'] > 0])
+    print('trades =',len(trades),'win =',win,'final =',round(result['final'],4),
+          'return =',round(result['final']/balance-1,4),'max drawdown =',round(result['max_drawdown'],4))
@@ -0,0 +1,387 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import requests
+from candle_store import CandleData, interval_seconds
+from strategy_method import strategy
+from backtest import collect_actions
+
+
+
+START = 1577836800
+BENCHMARKS = ('csv_load','history_strategy','incremental_step','real_mode_loop','import_time','trend_batch','backfill','indicators','metrics')
+IMPORTS = ('main','binance_api','metrics')
+
+def synthetic_candles(bars,timesetup='1m',seed=0,start=START,price=300.0,volatility=0.002,gap_rate=0.0005):
+    '''
+    deterministic random walk candles
+        args:
+            bars (int) : number of bars , up to 10M
+            timesetup (str) : '1m' ... '1d'
+            seed (int) : same seed -> same candles
+            gap_rate (float) : chance of a missing stretch ( exchange down ) after a bar
+        return:
+            CandleData
+    '''
+    rng = np.random.default_rng(seed)
+    sec = interval_seconds(timesetup)
+    steps = np.ones(bars,dtype='int64')
+    gaps = rng.random(bars) < gap_rate
+    steps[gaps] += rng.integers(1,60,gaps.sum())
+    steps[0] = 0
+    time = start+np.cumsum(steps)*sec
+    close = price*np.exp(np.cumsum(rng.normal(0,volatility,bars)))
+    open = np.empty(bars)
+    open[0] = price
+    open[1:] = close[:-1]*np.exp(rng.normal(0,volatility/4,bars-1))
+    wick = np.abs(rng.normal(0,volatility,(2,bars)))
+    high = np.maximum(open,close)*(1+wick[0])
+    low = np.minimum(open,close)*(1-wick[1])
+    return CandleData(time,open,high,low,close)
+def write_csv(candles,path):
+    '''
+    write candles like finlab_crypto history csv ( last row is the not closed bar )
+    '''
+    import pandas as pd
+    last = candles.close[-1:]
+    df = pd.DataFrame({'timestamp':np.append(candles.time,candles.time[-1:]).astype('datetime64[s]'),
+                       'open':np.append(candles.open,last),'high':np.append(candles.high,last),
+                       'low':np.append(candles.low,last),'close':np.append(candles.close,last),'volume':0.0})
+    df.to_csv(path,index=False)
+class MockClient:
+    '''
+    stand-in of binance.Client for the calls of ExchangeSession / getbinancemethod / CandleCache / MarketState
+        args:
+            candles (CandleData) : klines for get_klines and the mark price
+            latency (float) : seconds slept by every call ( round trip time )
+    '''
+    def __init__(self,candles=None,symbol='BNBBUSD',latency=0.0,balance=1000.0):
+        self.session = requests.Session()
+        self.candles = candles
+        self.symbol = symbol
+        self.latency = latency
+        self.balance = balance
+        self.cursor = 0
+        self.calls = 0
+        self.order_id = 0
+        self.open_orders = []
+    def _wait(self):
+        self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+    def _price(self):
+        if self.candles == None or len(self.candles) == 0:
+            return 300.0
+        return float(self.candles.close[min(self.cursor,len(self.candles)-1)])
+    def _order(self,params):
+        self.order_id += 1
+        return {'orderId':self.order_id,'clientOrderId':'bench'+str(self.order_id),'side':params['side'],'type':params['type'],
+                'origQty':str(params.get('quantity',0)),'stopPrice':str(params.get('stopPrice',0)),'status':'NEW'}
+    def get_klines(self,symbol,interval,startTime=None,limit=1000,**kwargs):
+        self._wait()
+        c = self.candles
+        sec = interval_seconds(interval)
+        start = 0
+        if startTime != None:
+            start = int(c.time.searchsorted(-(-startTime//1000)))
+        stop = min(len(c),start+limit)
+        return [[int(c.time[i])*1000,str(c.open[i]),str(c.high[i]),str(c.low[i]),str(c.close[i]),'0',(int(c.time[i])+sec)*1000-1]
+                for i in range(start,stop)]
+    def futures_exchange_info(self):
+        self._wait()
+        return {'symbols':[{'symbol':self.symbol,'quantityPrecision':2,'pricePrecision':2,
+                            'filters':[{'filterType':'PRICE_FILTER','tickSize':'0.01'},
+                                       {'filterType':'LOT_SIZE','stepSize':'0.01','minQty':'0.01'},
+                                       {'filterType':'MIN_NOTIONAL','notional':'5'}]}]}
+    def futures_account(self):
+        self._wait()
+        return {'assets':[{'asset':'BUSD','availableBalance':str(self.balance),'walletBalance':str(self.balance),
+                           'crossWalletBalance':str(self.balance)}],
+                'positions':[{'symbol':self.symbol,'maxNotional':'1000000','entryPrice':'0','positionAmt':'0',
+                              'initialMargin':'0','unrealizedProfit':'0','leverage':'1'}]}
+    def futures_stream_get_listen_key(self):
+        self._wait()
+        return 'listenkey'
+    def futures_stream_keepalive(self,listenKey):
+        self._wait()
+        return {}
+    def futures_mark_price(self,symbol=None):
+        self._wait()
+        return {'symbol':symbol,'markPrice':str(self._price())}
+    def futures_create_order(self,**params):
+        self._wait()
+        return self._order(params)
+    def futures_place_batch_order(self,batchOrders):
+        self._wait()
+        return [self._order(order) for order in batchOrders]
+    def futures_get_open_orders(self,symbol=None):
+        self._wait()
+        return [order for order in self.open_orders if symbol == None or order['symbol'] == symbol]
+    def futures_cancel_all_open_orders(self,symbol):
+        self._wait()
+        return {'code':200,'msg':'done'}
+    def futures_cancel_orders(self,symbol,orderidlist):
+        self._wait()
+        return []
+    def futures_cancel_order(self,symbol,orderId):
+        self._wait()
+        return {}
+def _timed(function,repeat):
+    best = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter()-start
+        if best == None or seconds < best:
+            best = seconds
+    return best,result
+def bench_csv_load(candles,repeat,**kwargs):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder,'BENCH-1m-data.csv')
+        write_csv(candles,path)
+        seconds,data = _timed(lambda:CandleData.from_csv(path),repeat)
+    return {'seconds':seconds,'bars':len(data),'bars_per_sec':len(data)/seconds}
+def bench_history_strategy(candles,repeat,**kwargs):
+    seconds,actions = _timed(lambda:collect_actions(_quiet,candles,{},'1m'),repeat)
+    return {'seconds':seconds,'bars':len(candles),'bars_per_sec':len(candles)/seconds,'actions':len(actions)}
+def bench_trend_batch(candles,repeat,**kwargs):
+    '''
+    trend_kernel.trend_batch ( numba ) on every bar , compile time not included
+    '''
+    from trend_kernel import trend_batch
+    trend_batch(candles.open[:10],candles.high[:10],candles.low[:10],candles.close[:10])
+    seconds,out = _timed(lambda:trend_batch(candles.open,candles.high,candles.low,candles.close),repeat)
+    return {'seconds':seconds,'bars':len(candles),'bars_per_sec':len(candles)/seconds}
+def bench_indicators(candles,repeat,steps=1000,**kwargs):
+    '''
+    indicators.Indicators ( ema , atr , rsi , bollinger ) : extend on every bar , then update for one new bar
+    '''
+    from indicators import Indicators
+    specs = {'ema':('ema',20),'atr':('atr',14),'rsi':('rsi',14),'bb':('bollinger',20,2.0)}
+    Indicators(specs,1).update(CandleData.view(candles,0,100))
+    seconds,out = _timed(lambda:Indicators(specs,1).update(candles),repeat)
+    steps = min(steps,len(candles)-1)
+    best = None
+    for n in range(repeat):
+        live = Indicators(specs).update(CandleData.view(candles,0,len(candles)-steps))
+        start = time.perf_counter()
+        for stop in range(len(candles)-steps+1,len(candles)+1):
+            live.update(CandleData.view(candles,0,stop))
+        step = time.perf_counter()-start
+        if best == None or step < best:
+            best = step
+    return {'seconds':seconds,'bars':len(candles),'bars_per_sec':len(candles)/seconds,'per_bar_us':best/steps*1e6}
+def bench_incremental_step(candles,repeat,steps=1000,**kwargs):
+    '''
+    real mode strategy call after one new bar ( history already processed )
+    '''
+    steps = min(steps,len(candles)-1)
+    best = None
+    for n in range(repeat):
+        data = CandleData.view(candles,0,len(candles)-steps)
+        data_dict = _quiet(data,{},{})
+        start = time.perf_counter()
+        for i in range(len(candles)-steps,len(candles)):
+            data.append(candles.time[i],candles.open[i],candles.high[i],candles.low[i],candles.close[i])
+            data_dict = _quiet(data,{},data_dict)
+        seconds = time.perf_counter()-start
+        if best == None or seconds < best:
+            best = seconds
+    return {'seconds':best,'bars':steps,'per_bar_us':best/steps*1e6}
+def bench_real_mode_loop(candles,repeat,steps=200,latency=0.0,order_every=20,**kwargs):
+    '''
+    kline message -> store -> strategy -> orders on MockClient , like script.on_bar in real mode
+        order_every (int) : when the strategy gives no action , open / close every order_every bars
+                            so the order path is always measured
+    '''
+    import asyncio
+    from binance_api import ExchangeSession, getbinancemethod, RequestScheduler
+    from kline_stream import KlineStream, ReplayServer
+    steps = min(steps,len(candles)-1)
+    warm = len(candles)-steps
+    replay = ReplayServer(candles,'BNBBUSD','1m')
+    lags = []
+    best = None
+    for n in range(repeat):
+        client = MockClient(candles,latency=latency)
+        session = ExchangeSession('','',cache_path=None,scheduler=RequestScheduler(),client=client)
+        api = getbinancemethod('','',session)
+        data = CandleData.view(candles,0,warm)
+        state = {'data_dict':_quiet(data,{},{}),'orders':0}
+        def on_bar(symbol,timesetup,kline):
+            client.cursor = len(data)-1
+            state['data_dict'] = _quiet(data,{},state['data_dict'])
+            action = state['data_dict']['action']
+            if action == {} and order_every > 0 and len(data)%order_every == 0:
+                if state['orders']%2 == 0:
+                    action = {'method':'open','position':'long','stoploss':float(data.close[-1])*0.99}
+                else:
+                    action = {'method':'close','position':'long','stoploss':None}
+            if action != {}:
+                _act(api,symbol,action)
+                state['orders'] += 1
+        stream = KlineStream('BNBBUSD','1m',data,on_bar,clock=lambda:(data.time[-1]+60) if len(data) else 0)
+        async def run():
+            stream.prepare()
+            for i in range(warm,len(candles)):
+                start = time.perf_counter()
+                await stream.handle(json.loads(replay.message(i)))
+                lags.append(time.perf_counter()-start)
+        start = time.perf_counter()
+        asyncio.run(run())
+        seconds = time.perf_counter()-start
+        if best == None or seconds < best:
+            best = seconds
+    lags.sort()
+    return {'seconds':best,'bars':steps,'per_bar_us':best/steps*1e6,'p99_bar_us':lags[int(len(lags)*0.99)]*1e6,
+            'orders':state['orders'],'latency':latency}
+def bench_import_time(candles,repeat,modules=IMPORTS,**kwargs):
+    '''
+    cold start : python -X importtime -c "import main" in a new process , cumulative microseconds of each module
+    '''
+    folder = os.path.dirname(os.path.abspath(__file__))
+    result = {}
+    for module in modules:
+        best = None
+        for n in range(repeat):
+            output = subprocess.run([sys.executable,'-X','importtime','-c','import '+module],capture_output=True,text=True,cwd=folder).stderr
+            for line in output.splitlines():
+                parts = line.split('|')
+                if len(parts) == 3 and parts[2].strip() == module:
+                    us = int(parts[1].split(':')[-1])
+                    if best == None or us < best:
+                        best = us
+        result[module+'_us'] = best
+    result['seconds'] = result[modules[0]+'_us']/1e6
+    return result
+def _serve(columns,timesetup,latency,queue):
+    from backfill import KlineServer
+    server = KlineServer({('BENCH',timesetup):CandleData(*columns)},latency).start()
+    queue.put(server.url)
+    server.server.serve_forever()
+def bench_backfill(candles,repeat,latency=0.0,workers=(1,8),timesetup='1m',**kwargs):
+    '''
+    backfill of every bar from a local HTTP stand-in ( KlineServer in another process ) into a temporary CandleCache
+        seconds : with the most workers , 'workers_<n>' : seconds of each pool size
+    '''
+    import multiprocessing
+    from backfill import Backfill, HttpKlines
+    from binance_api import RequestScheduler
+    queue = multiprocessing.Queue()
+    columns = (candles.time,candles.open,candles.high,candles.low,candles.close)
+    process = multiprocessing.Process(target=_serve,args=(columns,timesetup,latency,queue),daemon=True)
+    process.start()
+    try:
+        url = queue.get(timeout=60)
+        start = int(candles.time[0])
+        end = int(candles.time[-1])+interval_seconds(timesetup)
+        result = {'bars':len(candles),'latency':latency}
+        for n in workers:
+            best = None
+            for r in range(repeat):
+                with tempfile.TemporaryDirectory() as folder:
+                    fill = Backfill(HttpKlines(url,RequestScheduler(),pool_size=n),n,path=folder)
+                    seconds = fill.run(['BENCH'],[timesetup],start,end)['seconds']
+                if best == None or seconds < best:
+                    best = seconds
+            result['workers_'+str(n)] = best
+        result['seconds'] = best
+        result['bars_per_sec'] = len(candles)/best
+        result['speedup'] = result['workers_'+str(workers[0])]/best
+        return result
+    finally:
+        process.terminate()
+def bench_metrics(candles,repeat,calls=200000,**kwargs):
+    '''
+    overhead of one timed block : METRICS.span ( lookup each call ) , a bound METRICS.stage , a METRICS.timed function
+    '''
+    from metrics import Metrics
+    metrics = Metrics()
+    stage = metrics.stage('stage')
+    function = metrics.timed('timed')(lambda:None)
+    def spans():
+        for n in range(calls):
+            with metrics.span('span'):
+                pass
+    def stages():
+        for n in range(calls):
+            with stage:
+                pass
+    def timed():
+        for n in range(calls):
+            function()
+    result = {}
+    for name,loop in (('span',spans),('stage',stages),('timed',timed)):
+        seconds,out = _timed(loop,repeat)
+        result[name+'_us'] = seconds/calls*1e6
+    result['seconds'] = result['stage_us']*calls/1e6
+    return result
+def _quiet(shortdata,longdata,data_dict):
+    return strategy(shortdata,longdata,data_dict,verbose=False)
+def _act(api,symbol,action):
+    api.prepare(symbol)
+    if action['method'] == 'open':
+        mark = api.get_future_mark_price(symbol)
+        lossrate = abs(mark-action['stoploss'])/mark
+        margin = api.get_total_money('BUSD')*0.025/max(lossrate,1e-6)
+        api.open_position(action['position'],symbol,api.get_future_purchase_quantity(symbol,margin),action['stoploss'])
+    else:
+        api.close_position(action['position'],symbol)
+def run(bars=100000,timesetup='1m',repeat=3,seed=0,latency=0.0,only=None):
+    '''
+    run benchmarks on synthetic candles
+        args:
+            bars (int) : number of synthetic bars
+            only (list) : names in BENCHMARKS , default all
+        return:
+            dict : {'commit','python','machine','bars','timesetup','results':{name:{'seconds',...}}}
+    '''
+    candles = synthetic_candles(bars,timesetup,seed)
+    results = {}
+    for name in only or BENCHMARKS:
+        results[name] = globals()['bench_'+name](candles,repeat,latency=latency)
+        print(name,json.dumps(results[name]))
+    return {'commit':_commit(),'python':platform.python_version(),'machine':platform.machine(),'processor':platform.processor(),
+            'bars':bars,'timesetup':timesetup,'seed':seed,'repeat':repeat,'time':int(time.time()),'results':results}
+def compare(old,new):
+    '''
+    print new / old seconds of every benchmark ( below 1 is faster )
+    '''
+    print('benchmark','old(s)','new(s)','ratio')
+    for name,row in new['results'].items():
+        if name in old.get('results',{}):
+            before = old['results'][name]['seconds']
+            print(name,round(before,6),round(row['seconds'],6),round(row['seconds']/before,3))
+def _commit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark data load , strategy and real mode loop on synthetic candles')
+    parser.add_argument('--bars',type=int,default=100000)
+    parser.add_argument('--timesetup',default='1m')
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--latency',type=float,default=0.0,help='seconds of every mock exchange call')
+    parser.add_argument('--only',nargs='*',choices=BENCHMARKS)
+    parser.add_argument('--output',help='write results json here')
+    parser.add_argument('--compare',help='results json of an older run')
+    args = parser.parse_args()
+    result = run(args.bars,args.timesetup,args.repeat,args.seed,args.latency,args.only)
+    if args.output != None:
+        with open(args.output,'w') as f:
+            json.dump(result,f,indent=1)
+    else:
+        json.dump(result,sys.stdout,indent=1)
+        print()
+    if args.compare != None:
+        with open(args.compare,'r') as f:
+            compare(json.load(f),result)
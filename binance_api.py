@@ -1,12 +1,23 @@
-import binance
+import os
+import json
+import math
+import decimal
+import inspect
+import random
+import functools
+import threading
 import time
-import finlab_crypto
-import pandas as pd
-from datetime import datetime as dt2
-import datetime
+from concurrent.futures import ThreadPoolExecutor
+from candle_store import CandleData
+from candle_cache import CandleCache
+from metrics import METRICS
+from journal import JOURNAL
 
 
 
+KLINES_WEIGHT = 2
+
+
         
 def containsNumber(value):
     '''
@@ -21,7 +32,255 @@ def containsNumber(value):
             return True
     return False
 
-finlab_crypto.setup()
+def _errors():
+    '''
+    ( BinanceAPIException , network errors ) , python-binance / requests are imported only when a call failed
+    '''
+    import requests
+    from binance.exceptions import BinanceAPIException, BinanceRequestException
+    return BinanceAPIException,(requests.exceptions.RequestException,BinanceRequestException)
+def _status(e):
+    '''
+    (status code , headers) of a failed response ( BinanceAPIException , requests HTTPError ) , (None , {}) for other errors
+    '''
+    response = getattr(e,'response',None)
+    status = getattr(e,'status_code',None)
+    if status == None and response != None:
+        status = response.status_code
+    headers = {} if response == None else response.headers
+    return status,headers
+_FINLAB = None
+def _finlab():
+    '''
+    finlab_crypto is imported and set up on the first download , not when binance_api is imported
+    '''
+    global _FINLAB
+    if _FINLAB is None:
+        import finlab_crypto
+        finlab_crypto.setup()
+        _FINLAB = finlab_crypto
+    return _FINLAB
+_CRAWL_CLIENT = []
+def _crawl_client():
+    '''
+    binance.Client of the finlab crawler , every page paced by REQUESTS
+    '''
+    if len(_CRAWL_CLIENT) == 0:
+        import binance
+        _CRAWL_CLIENT.append(REQUESTS.paced(binance.Client()))
+    return _CRAWL_CLIENT[0]
+class CircuitOpenError(Exception):
+    '''
+    raised by RequestScheduler.call while the circuit breaker is open
+    '''
+class RequestScheduler:
+    '''
+    Central scheduler for every binance REST call
+        budget:
+            used request weight ( for 'futures' and 'spot' ) and order count of the current minute ,
+            updated from X-MBX-USED-WEIGHT-1M / X-MBX-ORDER-COUNT-1M of every response ( observe )
+        priority:
+            kind 'order' calls go before 'data' calls when the budget is short
+        retry:
+            429 / 418 wait Retry-After , network errors and 5xx wait jittered exponential backoff ,
+            at most retries times , other api errors are raised at once
+            ( BinanceAPIException and requests HTTPError of raise_for_status are read the same way )
+        circuit breaker:
+            after breaker_failures failed calls in a row ( network errors , 5xx ) or a 418 every call raises CircuitOpenError
+            until breaker_cooldown seconds passed , then one call is let through to test
+    '''
+    def __init__(self,weight_limit=None,order_limit=1200,safety=0.9,retries=5,base_delay=0.5,max_delay=30,
+                 breaker_failures=5,breaker_cooldown=60,clock=time.time,sleep=time.sleep):
+        if weight_limit == None:
+            weight_limit = {'futures':2400,'spot':6000}
+        self.weight_limit = {market:limit*safety for market,limit in weight_limit.items()}
+        self.order_limit = order_limit*safety
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Condition()
+        self.window = 0
+        self.used_weight = {market:0 for market in self.weight_limit}
+        self.order_count = 0
+        self.blocked_until = 0
+        self.orders_waiting = 0
+        self.failures = 0
+        self.open_until = 0
+        self.stats = {'calls':0,'retries':0,'rate_limited':0,'waits':0,'breaker_trips':0}
+    def attach(self,client):
+        '''
+        read weight headers of every response of client
+        '''
+        client.session.hooks['response'].append(self.observe)
+        return client
+    def observe(self,response,*args,**kwargs):
+        headers = response.headers
+        market = 'spot'
+        if '/fapi/' in response.url:
+            market = 'futures'
+        with self.lock:
+            self._roll()
+            for name in ('X-MBX-USED-WEIGHT-1M','X-MBX-USED-WEIGHT'):
+                if name in headers:
+                    self.used_weight[market] = int(headers[name])
+                    break
+            if 'X-MBX-ORDER-COUNT-1M' in headers:
+                self.order_count = int(headers['X-MBX-ORDER-COUNT-1M'])
+            if response.status_code in (418,429):
+                self.stats['rate_limited'] += 1
+                self.blocked_until = max(self.blocked_until,self.clock()+self._retry_after(headers))
+                if response.status_code == 418:
+                    self._trip(self.blocked_until)
+    def _retry_after(self,headers):
+        try:
+            return float(headers.get('Retry-After',60))
+        except (TypeError,ValueError):
+            return 60.0
+    def _roll(self):
+        window = int(self.clock()//60)
+        if window != self.window:
+            self.window = window
+            for market in self.used_weight:
+                self.used_weight[market] = 0
+            self.order_count = 0
+    def _trip(self,until=None):
+        if until == None:
+            until = self.clock()+self.breaker_cooldown
+        if self.clock() >= self.open_until:
+            self.stats['breaker_trips'] += 1
+        self.open_until = max(self.open_until,until)
+    def _acquire(self,weight,kind,market,orders=1):
+        with self.lock:
+            if self.clock() < self.open_until:
+                raise CircuitOpenError('circuit open for '+str(round(self.open_until-self.clock(),1))+'s')
+            if kind == 'order':
+                self.orders_waiting += 1
+            start = None
+            try:
+                while True:
+                    self._roll()
+                    now = self.clock()
+                    ready = now >= self.blocked_until and self.used_weight[market]+weight <= self.weight_limit[market]
+                    if kind == 'order':
+                        ready = ready and self.order_count+orders <= self.order_limit
+                    else:
+                        ready = ready and self.orders_waiting == 0
+                    if ready:
+                        self.used_weight[market] += weight
+                        if kind == 'order':
+                            self.order_count += orders
+                        if start != None:
+                            METRICS.observe('rate_wait',self.clock()-start)
+                        return
+                    if start == None:
+                        start = now
+                    self.stats['waits'] += 1
+                    if now < self.blocked_until:
+                        wait = self.blocked_until-now
+                    elif self.used_weight[market]+weight > self.weight_limit[market] or (kind == 'order' and self.order_count+orders > self.order_limit):
+                        wait = (self.window+1)*60-now
+                    else:
+                        wait = 0.05
+                    self.lock.wait(max(wait,0.01))
+            finally:
+                if kind == 'order':
+                    self.orders_waiting -= 1
+                    self.lock.notify_all()
+    def _done(self,ok):
+        with self.lock:
+            if ok:
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.failures >= self.breaker_failures:
+                    self.failures = 0
+                    self._trip()
+    def backoff(self,attempt):
+        '''
+        jittered exponential backoff of attempt ( seconds )
+        '''
+        delay = min(self.max_delay,self.base_delay*(2**attempt))
+        return random.uniform(delay/2,delay)
+    def call(self,function,*args,weight=1,kind='data',market='futures',orders=1,**kwargs):
+        '''
+        call function inside the budget with retry
+            args:
+                function : client method
+                weight (int) : request weight of the endpoint
+                kind (str) : 'order' , 'data'
+                market (str) : 'futures' , 'spot'
+                orders (int) : orders sent by the call ( batch orders ) , counted in the order budget when kind is 'order'
+            return:
+                result of function
+        Notice:
+            time of every call ( with waits and retries ) is kept in METRICS as 'rest.<function name>'
+        '''
+        histogram = METRICS.histogram('rest.'+getattr(function,'__name__','call'))
+        start = time.perf_counter_ns()
+        try:
+            return self._call(function,args,kwargs,weight,kind,market,orders)
+        finally:
+            histogram.since(start)
+    def _call(self,function,args,kwargs,weight,kind,market,orders=1):
+        error = None
+        for attempt in range(self.retries+1):
+            self._acquire(weight,kind,market,orders)
+            self.stats['calls'] += 1
+            try:
+                result = function(*args,**kwargs)
+                self._done(True)
+                return result
+            except Exception as e:
+                api_error,network_errors = _errors()
+                status,headers = _status(e)
+                if isinstance(e,api_error) or status != None:
+                    error = e
+                    if status in (418,429):
+                        # rate limited : wait Retry-After , binance is up so the breaker does not count it
+                        with self.lock:
+                            self.blocked_until = max(self.blocked_until,self.clock()+self._retry_after(headers))
+                            if status == 418:
+                                self._trip(self.blocked_until)
+                        if status == 418:
+                            raise
+                    elif status < 500:
+                        self._done(True)
+                        raise
+                    else:
+                        self._done(False)
+                elif isinstance(e,network_errors):
+                    error = e
+                    self._done(False)
+                else:
+                    raise
+            if attempt < self.retries:
+                self.stats['retries'] += 1
+                self.sleep(self.backoff(attempt))
+        raise error
+    def paced(self,client):
+        '''
+        every kline page of client ( get_historical_klines , finlab crawler ) goes through call with weight KLINES_WEIGHT
+            args:
+                client (binance.Client)
+            return:
+                client
+        '''
+        raw = client._klines
+        def _klines(*args,klines_type=None,**kwargs):
+            if klines_type != None:
+                kwargs['klines_type'] = klines_type
+            market = 'spot' if getattr(klines_type,'name','SPOT') == 'SPOT' else 'futures'
+            return self.call(raw,*args,weight=KLINES_WEIGHT,market=market,**kwargs)
+        client._klines = _klines
+        return self.attach(client)
+REQUESTS = RequestScheduler()
+METRICS.source('requests',lambda:REQUESTS.stats)
+
+@METRICS.timed('symbol_data')
 def Symbol_data(symbol,timesetup):
     '''
     get binance symbol data
@@ -29,37 +288,180 @@ def Symbol_data(symbol,timesetup):
             symbol (str) 
             timesetup (str) : '1m' , '5m' , '1h' , '4h' , '1d'
         return:
-            data_dict (dict) :{'time':{'close':close , 'low':low , 'open':open , 'high':high } ....}
+            CandleData : numpy arrays (time , open , high , low , close , up)
+            also works as dict :{'time':{'close':close , 'low':low , 'open':open , 'high':high , 'rg':rg} ....}
     '''
-    check = False
-    while check == False:
-        try:
-            finlab_crypto.crawler.get_all_binance(symbol,timesetup)  
-            check =True
-        except:
-            print("Can't load symbol = ",symbol ,'time = ',timesetup)
-            time.sleep(2)
-    data_dict = {}
-    df = pd.read_csv('./history/'+symbol+'-'+timesetup+'-data.csv',usecols=['timestamp','close','low','open','high'])
-    for i in range(len(df)-1):
-        temp_time = df.timestamp[i].split('.')
-        temp_time = temp_time[0]
-        if df.close[i]>=df.open[i]:
-            rg = 'up'
+    try:
+        crawl = _finlab().crawler.get_all_binance
+        if 'client' in inspect.signature(crawl).parameters:
+            crawl(symbol,timesetup,client=_crawl_client())
         else:
-            rg = 'down'
+            REQUESTS.call(crawl,symbol,timesetup,weight=10,market='spot')
+    except Exception as e:
+        JOURNAL.error('error',source='symbol_data',symbol=symbol,timesetup=timesetup,error=str(e))
+        raise
+    return CandleData.from_csv('./history/'+symbol+'-'+timesetup+'-data.csv')
+@METRICS.timed('symbol_cache')
+def Symbol_cache(symbol,timesetup,client):
+    '''
+    get binance symbol data from the binary cache , only klines after the last stored bar are downloaded
+        args:
+            symbol (str)
+            timesetup (str) : '1m' , '5m' , '1h' , '4h' , '1d'
+            client (binance.Client)
+        return:
+            CandleCache : .candles() gives CandleData ( memory mapped )
+    '''
+    cache = CandleCache(symbol,timesetup)
+    if len(cache) == 0:
+        Symbol_data(symbol,timesetup)
+        cache.seed_from_csv()
+    try:
+        cache.update(client,scheduler=REQUESTS)
+    except Exception as e:
+        JOURNAL.error('error',source='symbol_cache',symbol=symbol,timesetup=timesetup,error=str(e))
+        raise
+    return cache
+class ExchangeSession:
+    '''
+    Long lived binance session:
+        one binance.Client ( one pooled http connection ) shared by every getbinancemethod
+        Method:
+            refresh_account : download futures account , positions and assets indexed by symbol
+            refresh_open_orders : download open orders indexed by symbol and orderId
+            exchange_info : futures exchange info , cached with ttl ( and on disk for fast start )
+            gather : run independent requests at the same time on the connection pool
+        State:
+            mark_prices , positions , assets , open_orders : kept fresh by market_state.MarketState when live is True
+        Get:
+            symbol_filter : {'quantityPrecision','pricePrecision','tickSize','stepSize','minQty','minNotional'}
+            position : position of symbol
+            asset : asset of 'BUSD' , 'USDT'
+    Notice:
+        client can be given to use a stand-in of binance.Client ( benchmark , replay )
+    '''
+    def __init__(self,apikey,apiserect,ttl=3600,cache_path='./history/exchange_info.json',pool_size=10,scheduler=None,client=None):
+        from requests.adapters import HTTPAdapter
+        if client == None:
+            import binance
+            client = binance.Client(apikey,apiserect)
+        self.client = client
+        adapter = HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+        self.client.session.mount('https://',adapter)
+        if scheduler == None:
+            scheduler = REQUESTS
+        self.scheduler = scheduler
+        scheduler.attach(self.client)
+        self.pool_size = pool_size
+        self.executor = None
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.filters = {}
+        self.filters_time = 0
+        self.account = None
+        self.positions = {}
+        self.assets = {}
+        self.mark_prices = {}
+        self.open_orders = {}
+        self.live = False
+        self._load_filters()
+    def _load_filters(self):
+        if self.cache_path == None or not os.path.exists(self.cache_path):
+            return
         try:
-            data_time =dt2.strptime(temp_time, "%Y-%m-%d %H:%M:%S")+datetime.timedelta(hours=8)
-            data_time = str(data_time)
-            data_dict[data_time]={'close':df.close[i],'low':df.low[i],'open':df.open[i],'high':df.high[i],'rg':rg}
-        except:
+            with open(self.cache_path,'r') as f:
+                saved = json.load(f)
+            self.filters = saved['filters']
+            self.filters_time = saved['time']
+        except Exception as e:
+            JOURNAL.warning('error',source='exchange_info',path=self.cache_path,error=str(e))
+    def _save_filters(self):
+        if self.cache_path == None:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.',exist_ok=True)
+        temp = self.cache_path+'.tmp'
+        with open(temp,'w') as f:
+            json.dump({'time':self.filters_time,'filters':self.filters},f)
+        os.replace(temp,self.cache_path)
+    def exchange_info(self,refresh=False):
+        '''
+        symbol filters of futures exchange info , downloaded again after ttl seconds
+            return:
+                dict : {'BTCUSDT':{'quantityPrecision':3 , ....} , ....}
+        '''
+        if refresh or self.filters == {} or time.time()-self.filters_time > self.ttl:
+            info = self.scheduler.call(self.client.futures_exchange_info,weight=1)
+            filters = {}
+            for i in info['symbols']:
+                item = {'quantityPrecision':int(i['quantityPrecision']),'pricePrecision':int(i['pricePrecision']),
+                        'tickSize':None,'stepSize':None,'minQty':None,'minNotional':None}
+                for f in i.get('filters',[]):
+                    if f['filterType'] == 'PRICE_FILTER':
+                        item['tickSize'] = float(f['tickSize'])
+                    elif f['filterType'] == 'LOT_SIZE':
+                        item['stepSize'] = float(f['stepSize'])
+                        item['minQty'] = float(f['minQty'])
+                    elif f['filterType'] == 'MIN_NOTIONAL':
+                        item['minNotional'] = float(f.get('notional',f.get('minNotional',0)))
+                filters[i['symbol']] = item
+            self.filters = filters
+            self.filters_time = time.time()
+            self._save_filters()
+        return self.filters
+    def symbol_filter(self,symbol):
+        '''
+        filters of one symbol
+            args:
+                symbol (str) : 'BTCUSDT'
+            return:
+                dict : {'quantityPrecision','pricePrecision','tickSize','stepSize','minQty','minNotional'}
+        '''
+        filters = self.exchange_info()
+        if symbol not in filters:
+            filters = self.exchange_info(refresh=True)
+        return filters[symbol]
+    def refresh_account(self):
+        '''
+        download futures account and index positions / assets
+        '''
+        self.account = self.scheduler.call(self.client.futures_account,weight=5)
+        self.positions = {i['symbol']:i for i in self.account['positions']}
+        self.assets = {i['asset']:i for i in self.account['assets']}
+        return self.account
+    def refresh_open_orders(self):
+        '''
+        download open orders of every symbol and index them by symbol / orderId ( same format as MarketState keeps )
+        '''
+        orders = self.scheduler.call(self.client.futures_get_open_orders,weight=40)
+        open_orders = {}
+        for o in orders:
+            open_orders.setdefault(o['symbol'],{})[o['orderId']] = {
+                'orderId':o['orderId'],'clientOrderId':o.get('clientOrderId'),'side':o['side'],'type':o['type'],
+                'quantity':float(o.get('origQty',0)),'stopPrice':float(o.get('stopPrice',0)),'status':o.get('status','NEW')}
+        self.open_orders = open_orders
+        return open_orders
+    def gather(self,*calls):
+        '''
+        run independent requests at the same time
+            args:
+                calls : functions without args ( functools.partial of scheduler.call )
+            return:
+                list : result or exception of every call , same order as calls
+        '''
+        if self.executor == None:
+            self.executor = ThreadPoolExecutor(self.pool_size)
+        futures = [self.executor.submit(call) for call in calls]
+        results = []
+        for future in futures:
             try:
-                data_time =dt2.strptime(df.timestamp[i], "%Y-%m-%d")
-                data_time = str(data_time)
-                data_dict[data_time]={'close':df.close[i],'low':df.low[i],'open':df.open[i],'high':df.high[i],'rg':rg}
+                results.append(future.result())
             except Exception as e:
-                print('Symbol_data error = ',e,df.timestamp[i])      
-    return data_dict
+                results.append(e)
+        return results
+    def position(self,symbol):
+        return self.positions.get(symbol)
+    def asset(self,symbol):
+        return self.assets.get(symbol)
 class getbinancemethod:
     '''
     Method of binance API:
@@ -67,6 +469,9 @@ class getbinancemethod:
             future_buy : buy symbol
             future_sell : sell symbol
             setstoploss : set up stoploss of symbol
+            prepare : refresh account / mark price before an action ( one round trip )
+            open_position : entry and stoploss in one batch order
+            close_position : close position and cancel its stoploss at the same time
         Get:
             get_total_money : get the value of symbol
             get_maxNotional : get the max position can open
@@ -76,9 +481,149 @@ class getbinancemethod:
             get_future_mark_price : get market price of symbol
             check_state : check if there is position of symbol
     '''
-    def __init__(self,apikey,apiserect):
-        self.client = binance.Client(apikey,apiserect)
-        self.future_account_data = self.client.futures_account()
+    def __init__(self,apikey,apiserect,session=None):
+        if session == None:
+            session = ExchangeSession(apikey,apiserect)
+        self.session = session
+        self.client = session.client
+        self.scheduler = session.scheduler
+        self.prepared = set()
+        if session.live:
+            self.future_account_data = session.account
+        else:
+            self.future_account_data = session.refresh_account()
+    def _order(self,function,**kwargs):
+        return functools.partial(self.scheduler.call,function,kind='order',**kwargs)
+    def _quantity(self,symbol,quantity):
+        '''
+        quantity as the text binance accepts : rounded down to stepSize , fixed point ( never '1e-05' )
+        '''
+        f = self.session.symbol_filter(symbol)
+        step = f.get('stepSize')
+        if not step:
+            return "{:0.0{}f}".format(quantity,f['quantityPrecision'])
+        digits = max(0,-decimal.Decimal(repr(step)).normalize().as_tuple().exponent)
+        steps = math.floor(round(quantity/step,9))
+        return "{:0.0{}f}".format(steps*step,digits)
+    def _cancels(self,symbol):
+        '''
+        requests to cancel the open orders of symbol
+            live : only the known order ids ( safe to send together with new orders )
+            not live : cancel all ( must be sent before new orders ) , nothing if prepare already did it
+        '''
+        if symbol in self.prepared:
+            return []
+        if self.session.live:
+            ids = list(self.session.open_orders.get(symbol,{}))
+            return [self._order(self.client.futures_cancel_orders,symbol=symbol,orderidlist=ids[n:n+10]) for n in range(0,len(ids),10)]
+        return [self._order(self.client.futures_cancel_all_open_orders,symbol=symbol)]
+    def _track(self,symbol,order):
+        self.session.open_orders.setdefault(symbol,{})[order['orderId']] = {
+            'orderId':order['orderId'],'clientOrderId':order.get('clientOrderId'),'side':order['side'],'type':order['type'],
+            'quantity':float(order.get('origQty',0)),'stopPrice':float(order.get('stopPrice',0)),'status':order.get('status','NEW')}
+    def prepare(self,symbol):
+        '''
+        before an action when session is not live : account , mark price and cancel all orders of symbol in one round trip
+            args:
+                symbol (str) : 'GMTBUSD'
+        '''
+        if self.session.live:
+            return
+        account,mark,cancel = self.session.gather(functools.partial(self.session.refresh_account),
+                                                  functools.partial(self.scheduler.call,self.client.futures_mark_price,symbol=symbol),
+                                                  self._order(self.client.futures_cancel_all_open_orders,symbol=symbol))
+        for result in (account,mark,cancel):
+            if isinstance(result,Exception):
+                JOURNAL.error('error',source='prepare',symbol=symbol,error=str(result))
+        self.future_account_data = self.session.account
+        if not isinstance(mark,Exception):
+            self.session.mark_prices[symbol] = float(mark['markPrice'])
+        if not isinstance(cancel,Exception):
+            self.prepared.add(symbol)
+    def open_position(self,position,symbol,quantity,stopprice):
+        '''
+        open position and protective stop in one batch order
+            args:
+                position (str) : 'long' , 'short'
+                symbol (str) : 'GMTBUSD'
+                quantity (float)
+                stopprice (float)
+            return:
+                Bool
+        Notice:
+            live : old orders are cancelled by id in the same round trip
+            if the entry is rejected the stop is cancelled , if the stop is rejected setstoploss sends it again
+        '''
+        if position == 'short':
+            side,stop_side = 'SELL','BUY'
+        else:
+            side,stop_side = 'BUY','SELL'
+        cancels = self._cancels(symbol)
+        self.prepared.discard(symbol)
+        if quantity == None or quantity == 0:
+            JOURNAL.error('order',method='open',position=position,symbol=symbol,quantity=quantity,error='quantity is 0')
+            return False
+        if not self.session.live:
+            for cancel in self.session.gather(*cancels):
+                if isinstance(cancel,Exception):
+                    JOURNAL.error('order',method='cancel',symbol=symbol,error=str(cancel))
+            cancels = []
+        amount = self._quantity(symbol,quantity)
+        if float(amount) == 0:
+            JOURNAL.error('order',method='open',position=position,symbol=symbol,quantity=quantity,error='quantity below stepSize')
+            return False
+        price = "{:0.0{}f}".format(stopprice,self.session.symbol_filter(symbol)['pricePrecision'])
+        batch = [{'symbol':symbol,'side':side,'type':'MARKET','quantity':amount},
+                 {'symbol':symbol,'side':stop_side,'type':'STOP_MARKET','closePosition':'true','stopPrice':price}]
+        results = self.session.gather(self._order(self.client.futures_place_batch_order,batchOrders=batch,weight=5,orders=len(batch)),*cancels)
+        orders = results[0]
+        if isinstance(orders,Exception):
+            JOURNAL.error('order',method='open',position=position,symbol=symbol,quantity=quantity,error=str(orders))
+            return False
+        entry,stop = orders
+        if 'code' in entry:
+            JOURNAL.error('order',method='open',position=position,symbol=symbol,quantity=quantity,error=entry.get('msg'))
+            if 'code' not in stop:
+                try:
+                    self.scheduler.call(self.client.futures_cancel_order,symbol=symbol,orderId=stop['orderId'],kind='order')
+                except Exception as e:
+                    JOURNAL.error('order',method='cancel',position=position,symbol=symbol,error=str(e))
+            return False
+        if 'code' in stop:
+            JOURNAL.error('order',method='stoploss',position=position,symbol=symbol,stoploss=price,error=stop.get('msg'))
+            return self.setstoploss(position,symbol,stopprice)
+        self._track(symbol,stop)
+        JOURNAL.info('order',method='open',position=position,symbol=symbol,quantity=quantity,stoploss=price,
+                     entry=entry.get('orderId'),stop=stop.get('orderId'))
+        return True
+    def close_position(self,position,symbol):
+        '''
+        close all hold of symbol and cancel its orders in the same round trip
+            args:
+                position (str) : 'long' , 'short'
+                symbol (str) : 'GMTBUSD'
+            return:
+                Bool
+        '''
+        if position == 'short':
+            side = 'BUY'
+        else:
+            side = 'SELL'
+        cancels = self._cancels(symbol)
+        self.prepared.discard(symbol)
+        quantity = abs(self.get_future_hold(symbol) or 0)
+        calls = list(cancels)
+        if quantity != 0:
+            amount = self._quantity(symbol,quantity)
+            calls.insert(0,self._order(self.client.futures_create_order,symbol=symbol,side=side,type='MARKET',quantity=amount,reduceOnly='true'))
+        results = self.session.gather(*calls)
+        for result in results:
+            if isinstance(result,Exception):
+                JOURNAL.error('order',method='close',position=position,symbol=symbol,quantity=quantity,error=str(result))
+        if quantity == 0:
+            return True
+        JOURNAL.info('order',method='close',position=position,symbol=symbol,quantity=quantity)
+        return not isinstance(results[0],Exception)
     def future_buy(self,symbol,quantity):
         '''
         BUY
@@ -90,14 +635,14 @@ class getbinancemethod:
         '''
         if quantity !=0 :
             try:
-                self.client.futures_cancel_all_open_orders(symbol=symbol)
-                self.client.futures_create_order(symbol=symbol, side='BUY', type='MARKET', quantity=quantity)
+                self.scheduler.call(self.client.futures_cancel_all_open_orders,symbol=symbol,kind='order')
+                self.scheduler.call(self.client.futures_create_order,symbol=symbol, side='BUY', type='MARKET', quantity=quantity,kind='order')
                 return True
             except Exception as e:
-                print('future buy','symbol=',symbol,'quantity=',quantity,'ERROR=',e)
+                JOURNAL.error('order',method='buy',symbol=symbol,quantity=quantity,error=str(e))
                 return False
         else:
-            print('future buy','symbol=',symbol,'quantity=',quantity,'ERROR=',e)
+            JOURNAL.error('order',method='buy',symbol=symbol,quantity=quantity,error='quantity is 0')
             return False
     def future_sell(self,symbol,quantity):
         '''
@@ -109,11 +654,11 @@ class getbinancemethod:
                 Bool
         '''
         try:
-            self.client.futures_cancel_all_open_orders(symbol=symbol)
-            self.client.futures_create_order(symbol=symbol, side='SELL', type='MARKET', quantity=quantity)
+            self.scheduler.call(self.client.futures_cancel_all_open_orders,symbol=symbol,kind='order')
+            self.scheduler.call(self.client.futures_create_order,symbol=symbol, side='SELL', type='MARKET', quantity=quantity,kind='order')
             return True
         except Exception as e:
-            print('future sell','symbol=',symbol,'quantity=',quantity,'ERROR=',e)
+            JOURNAL.error('order',method='sell',symbol=symbol,quantity=quantity,error=str(e))
             return False
     def setstoploss(self,position,symbol,stopprice):
         '''
@@ -122,19 +667,21 @@ class getbinancemethod:
                 position (str) :  'long' , 'short'
                 symbol (str) : 'GMTBUSD'
                 stopprice (float)
+            return:
+                Bool
         '''
-        check = False
-        while check == False:
-            try:
-                self.client.futures_cancel_all_open_orders(symbol=symbol)
-                if position == 'short':
-                    self.client.futures_create_order(symbol=symbol, side='BUY', type='STOP_MARKET', closePosition=True,stopprice=stopprice)
-                else:
-                    self.client.futures_create_order(symbol=symbol, side='SELL', type='STOP_MARKET', closePosition=True,stopprice=stopprice)
-                check = True
-            except Exception as e:
-                print('position = ',position,'Set stoploss fail = ',symbol,'stoploss=',stopprice ,'error=',e)
-                time.sleep(2)
+        if position == 'short':
+            side = 'BUY'
+        else:
+            side = 'SELL'
+        stopprice = "{:0.0{}f}".format(stopprice,self.session.symbol_filter(symbol)['pricePrecision'])
+        try:
+            self.scheduler.call(self.client.futures_cancel_all_open_orders,symbol=symbol,kind='order')
+            self.scheduler.call(self.client.futures_create_order,symbol=symbol, side=side, type='STOP_MARKET', closePosition=True,stopPrice=stopprice,kind='order')
+            return True
+        except Exception as e:
+            JOURNAL.error('order',method='stoploss',position=position,symbol=symbol,stoploss=stopprice,error=str(e))
+            return False
     def get_total_money(self,symbol):
         '''
         binance future asset
@@ -143,13 +690,7 @@ class getbinancemethod:
             return:
                 float
         '''
-        a = self.future_account_data
-        print(a['assets'])
-        for i in a['assets']:
-            if i['asset'] == symbol:
-                hold = i['availableBalance']
-                break
-        return float(hold)
+        return float(self.session.asset(symbol)['availableBalance'])
     def get_maxNotional(self,symbol):
         '''
         get max value to open on this symbol
@@ -158,11 +699,9 @@ class getbinancemethod:
             return:
                 float
         '''
-        a = self.future_account_data
-        for i in a['positions']:
-            if i['symbol'] == symbol:
-                maxNotion = float(i['maxNotional'])
-                return maxNotion
+        i = self.session.position(symbol)
+        if i != None:
+            return float(i['maxNotional'])
     def get_inital_price(self,symbol):
         '''
         get the average price of symbol
@@ -171,11 +710,9 @@ class getbinancemethod:
             return:
                 float
         '''
-        a = self.future_account_data
-        for i in a['positions']:
-            if i['symbol'] == symbol:
-                price = i['entryPrice']
-                return float(price)
+        i = self.session.position(symbol)
+        if i != None:
+            return float(i['entryPrice'])
     def get_future_hold(self,symbol):
         '''
         get the number of hold of symbol
@@ -184,11 +721,9 @@ class getbinancemethod:
             return:
                 float
         '''
-        a = self.future_account_data
-        for i in a['positions']:
-            if i['symbol'] == symbol:
-                hold = i['positionAmt']
-                return float(hold)
+        i = self.session.position(symbol)
+        if i != None:
+            return float(i['positionAmt'])
     def get_future_purchase_quantity(self,symbol,MoneyToBuy):
         '''
         calculate the quantity can buy
@@ -198,20 +733,9 @@ class getbinancemethod:
             return:
                 float   
         '''
-        check = False
         lstprice = self.get_future_mark_price(symbol)
         q = (MoneyToBuy*0.999) / lstprice
-        while check == False:
-            try:
-                info = self.client.futures_exchange_info()
-                check = True
-            except:
-                check = False
-                time.sleep(2)
-        for i in info['symbols']:
-            if i['symbol'] == symbol:
-                pricePrecision = i['quantityPrecision']
-                break
+        pricePrecision = self.session.symbol_filter(symbol)['quantityPrecision']
         quantityS = q
         quantityB = "{:0.0{}f}".format(quantityS, pricePrecision)
         quantityB = float(quantityB)
@@ -228,19 +752,15 @@ class getbinancemethod:
                 symbol(str):'BTCUSDT'
             return:
                 NowPrice(float):40407.11
+        Notice:
+            read from the mark price stream when session is live ( or from prepare )
         '''
-        check = False
-        while check == False:
-            try:
-                a= self.client.futures_mark_price()
-                check = True
-            except:
-                check = False
-                time.sleep(2)
-        for i in a:
-            if i['symbol']== symbol:
-                NowPrice = i['markPrice']
-                return float(NowPrice)
+        if (self.session.live or symbol in self.prepared) and symbol in self.session.mark_prices:
+            return self.session.mark_prices[symbol]
+        a = self.scheduler.call(self.client.futures_mark_price,symbol=symbol,weight=1)
+        NowPrice = float(a['markPrice'])
+        self.session.mark_prices[symbol] = NowPrice
+        return NowPrice
     def check_state(self,symbol):
         '''
         check hold of symbol
@@ -249,15 +769,14 @@ class getbinancemethod:
             return :
                 Bool
         '''
-        a = self.future_account_data
-        for i in a['positions']:
-            if i['symbol'] == symbol:
-                hold = float(i['initialMargin'])
-                if hold>0:
-                    state = True
-                else:
-                    state =False
-                return state
+        i = self.session.position(symbol)
+        if i != None:
+            hold = float(i['initialMargin'])
+            if hold>0:
+                state = True
+            else:
+                state =False
+            return state
         
 
 
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import numpy as np
+from candle_store import CandleData, TZ_OFFSET, interval_seconds
+
+
+
+RECORD = np.dtype([('time','<i8'),('close_time','<i8'),('open','<f8'),('high','<f8'),('low','<f8'),('close','<f8'),('volume','<f8')])
+VERSION = 1
+KLINE_LIMIT = 1000
+
+class CandleCache:
+    '''
+    Append only binary candle cache of one symbol / timeframe
+        files:
+            ./history/<symbol>-<tf>.bin : fixed width records (RECORD) of closed bars
+            ./history/<symbol>-<tf>.idx : {'version','symbol','interval','count','last_close_time'}
+        Method:
+            update : fetch only the klines after the last stored close time and append
+            append_klines : append raw binance klines
+            seed_from_csv : import finlab_crypto history csv when cache is empty
+        Get:
+            records : memory mapped records ( no copy )
+            candles : CandleData over the memory mapped columns
+    Notice:
+        the index is written after the records , so records after index['count']
+        (an append that did not finish) are cut off when the cache is opened
+    '''
+    def __init__(self,symbol,timesetup,path='./history'):
+        self.symbol = symbol
+        self.timesetup = timesetup
+        self.interval = interval_seconds(timesetup)
+        self.data_path = os.path.join(path,symbol+'-'+timesetup+'.bin')
+        self.index_path = os.path.join(path,symbol+'-'+timesetup+'.idx')
+        os.makedirs(path,exist_ok=True)
+        self.index = self._load_index()
+        self._records = None
+        self._candles = None
+        self._up = np.empty(0,dtype='bool')
+        self._up_count = 0
+    def _load_index(self):
+        index = {'version':VERSION,'symbol':self.symbol,'interval':self.timesetup,'count':0,'last_close_time':0}
+        if os.path.exists(self.index_path):
+            with open(self.index_path,'r') as f:
+                saved = json.load(f)
+            if saved.get('version') == VERSION:
+                index = saved
+        size = index['count']*RECORD.itemsize
+        if not os.path.exists(self.data_path):
+            open(self.data_path,'wb').close()
+            index['count'] = 0
+            index['last_close_time'] = 0
+        elif os.path.getsize(self.data_path) > size:
+            with open(self.data_path,'r+b') as f:
+                f.truncate(size)
+        elif os.path.getsize(self.data_path) < size:
+            index['count'] = os.path.getsize(self.data_path)//RECORD.itemsize
+            index['last_close_time'] = 0
+            if index['count'] > 0:
+                index['last_close_time'] = int(np.memmap(self.data_path,dtype=RECORD,mode='r',shape=(index['count'],))[-1]['close_time'])
+        return index
+    def _save_index(self):
+        temp = self.index_path+'.tmp'
+        with open(temp,'w') as f:
+            json.dump(self.index,f)
+        os.replace(temp,self.index_path)
+    def __len__(self):
+        return self.index['count']
+    @property
+    def last_close_time(self):
+        return self.index['last_close_time']
+    def records(self):
+        '''
+        memory mapped records , only the pages that are read are loaded
+            return:
+                np.memmap (RECORD)
+        '''
+        count = self.index['count']
+        if count == 0:
+            return np.empty(0,dtype=RECORD)
+        if self._records is None or len(self._records) != count:
+            self._records = np.memmap(self.data_path,dtype=RECORD,mode='r',shape=(count,))
+        return self._records
+    def candles(self,tz_offset=None):
+        '''
+        CandleData over the memory mapped columns
+            args:
+                tz_offset (int) : default 8 hours , 0 for daily bars ( same time string as Symbol_data )
+            return:
+                CandleData
+        Notice:
+            the same CandleData is returned until bars are added , the up column is kept in memory and
+            only computed for the new bars , so a call after every bar does not read the whole history
+        '''
+        if tz_offset is None:
+            if self.interval >= 86400:
+                tz_offset = 0
+            else:
+                tz_offset = TZ_OFFSET
+        count = self.index['count']
+        if self._candles is not None and len(self._candles) == count and self._candles.tz_offset == tz_offset:
+            return self._candles
+        rec = self.records()
+        self._candles = CandleData.wrap(rec['time'],rec['open'],rec['high'],rec['low'],rec['close'],tz_offset,self._up_column(rec))
+        return self._candles
+    def _up_column(self,rec):
+        '''
+        close >= open of every record , computed for the records added since the last call
+        '''
+        count = len(rec)
+        if count > len(self._up):
+            up = np.empty(max(16,count*2),dtype='bool')
+            up[:self._up_count] = self._up[:self._up_count]
+            self._up = up
+        if count > self._up_count:
+            self._up[self._up_count:count] = rec['close'][self._up_count:] >= rec['open'][self._up_count:]
+        self._up_count = count
+        return self._up[:count]
+    def append_records(self,records):
+        '''
+        append records that are newer than the last stored bar
+            args:
+                records (np.ndarray RECORD)
+            return:
+                int : number of bars added
+        '''
+        records = records[records['close_time'] > self.index['last_close_time']]
+        if len(records) == 0:
+            return 0
+        with open(self.data_path,'ab') as f:
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.index['count'] += len(records)
+        self.index['last_close_time'] = int(records['close_time'][-1])
+        self._save_index()
+        return len(records)
+    def append_klines(self,klines,now=None):
+        '''
+        append binance klines , bars not closed yet are skipped
+            args:
+                klines (list) : [[open_time , open , high , low , close , volume , close_time , ....] , ....]
+                now (int) : ms , default time.time()
+            return:
+                int : number of bars added
+        '''
+        if now is None:
+            now = int(time.time()*1000)
+        rows = [(int(k[0])//1000,int(k[6]),float(k[1]),float(k[2]),float(k[3]),float(k[4]),float(k[5])) for k in klines if int(k[6]) < now]
+        return self.append_records(np.array(rows,dtype=RECORD))
+    def seed_from_csv(self,csv_path=None):
+        '''
+        import finlab_crypto history csv ( './history/<symbol>-<tf>-data.csv' ) when cache is empty
+            return:
+                int : number of bars added
+        '''
+        if self.index['count'] > 0:
+            return 0
+        if csv_path is None:
+            csv_path = os.path.join(os.path.dirname(self.data_path),self.symbol+'-'+self.timesetup+'-data.csv')
+        if not os.path.exists(csv_path):
+            return 0
+        data = CandleData.from_csv(csv_path)
+        records = np.empty(len(data),dtype=RECORD)
+        records['time'] = data.time
+        records['close_time'] = (records['time']+self.interval)*1000-1
+        records['open'] = data.open
+        records['high'] = data.high
+        records['low'] = data.low
+        records['close'] = data.close
+        records['volume'] = np.nan
+        return self.append_records(records)
+    def update(self,client,start_time=None,scheduler=None):
+        '''
+        fetch the klines after the last stored close time
+            args:
+                client (binance.Client)
+                start_time (int) : ms , used when cache is empty , default last 1000 bars
+                scheduler (RequestScheduler) : every page goes through scheduler.call ( weight 2 ) , None calls client directly
+            return:
+                int : number of bars added
+        '''
+        if self.index['count'] > 0:
+            start = self.index['last_close_time']+1
+        elif start_time is not None:
+            start = start_time
+        else:
+            start = int(time.time()*1000)-KLINE_LIMIT*self.interval*1000
+        added = 0
+        while True:
+            if scheduler is None:
+                klines = client.get_klines(symbol=self.symbol,interval=self.timesetup,startTime=start,limit=KLINE_LIMIT)
+            else:
+                klines = scheduler.call(client.get_klines,symbol=self.symbol,interval=self.timesetup,startTime=start,limit=KLINE_LIMIT,
+                                        weight=2,market='spot')
+            if len(klines) == 0:
+                break
+            added += self.append_klines(klines)
+            if len(klines) < KLINE_LIMIT:
+                break
+            start = int(klines[-1][6])+1
+        return added
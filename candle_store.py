@@ -0,0 +1,297 @@
+import numpy as np
+from collections.abc import Mapping
+from journal import JOURNAL
+
+
+
+TZ_OFFSET = 8*3600
+UNIT_SECONDS = {'m':60,'h':3600,'d':86400,'w':604800}
+
+def interval_seconds(timesetup):
+    '''
+    length of one bar
+        args:
+            timesetup (str) : '1m' , '5m' , '1h' , '4h' , '1d'
+        return:
+            int : seconds
+    '''
+    return int(timesetup[:-1])*UNIT_SECONDS[timesetup[-1]]
+def format_times(times):
+    '''
+    format epoch seconds into the time string used as dict key
+        args:
+            times (np.ndarray int64) : epoch seconds
+        return:
+            np.ndarray (str) : ['2022-05-20 08:00:00' , ....]
+    '''
+    text = np.datetime_as_string(np.asarray(times,dtype='int64').astype('datetime64[s]'),unit='s')
+    return np.char.replace(text,'T',' ')
+def parse_time(value):
+    '''
+    parse one time string ('2022-05-20 08:00:00' or '2022-05-20') into epoch seconds
+        args:
+            value (str)
+        return:
+            int
+    '''
+    value = value.split('.')[0].replace(' ','T')
+    return int(np.datetime64(value,'s').astype('int64'))
+class CandleData(Mapping):
+    '''
+    Columnar candle store backed by numpy arrays
+        arrays:
+            time (int64) : open time of bar , utc epoch seconds
+            open , high , low , close (float64)
+            up (bool) : close >= open
+        Mapping view:
+            keys are the local time string ( utc + tz_offset ) and values are
+            {'close':close , 'low':low , 'open':open , 'high':high , 'rg':'up'/'down'}
+            so it can be used where the old Symbol_data dict was used
+        Get:
+            bar : bar dict by position
+            at : bar dict by epoch time
+            position : position of epoch time
+            label : time string of position
+    '''
+    __slots__ = ('_time','_open','_high','_low','_close','_up','_n','tz_offset','_index')
+    def __init__(self,time=None,open=None,high=None,low=None,close=None,tz_offset=TZ_OFFSET,capacity=0):
+        if time is None:
+            time = np.empty(0,dtype='int64')
+            open = high = low = close = np.empty(0,dtype='float64')
+        self._n = len(time)
+        size = max(self._n,capacity)
+        self._time = np.empty(size,dtype='int64')
+        self._open = np.empty(size,dtype='float64')
+        self._high = np.empty(size,dtype='float64')
+        self._low = np.empty(size,dtype='float64')
+        self._close = np.empty(size,dtype='float64')
+        self._up = np.empty(size,dtype='bool')
+        self._time[:self._n] = time
+        self._open[:self._n] = open
+        self._high[:self._n] = high
+        self._low[:self._n] = low
+        self._close[:self._n] = close
+        self._up[:self._n] = self._close[:self._n] >= self._open[:self._n]
+        self.tz_offset = tz_offset
+        self._index = None
+    @classmethod
+    def from_csv(cls,path,tz_offset=TZ_OFFSET,drop_last=True):
+        '''
+        load finlab_crypto history csv
+            args:
+                path (str) : './history/BNBBUSD-1h-data.csv'
+                tz_offset (int) : seconds to add to the csv time for the local time string
+                drop_last (bool) : skip last row ( bar not closed yet )
+            return:
+                CandleData
+        Notice:
+            csv with only date ('2022-05-20') is not shifted , its time string stays the date
+            rows with a time that can not be parsed are dropped , their number goes to JOURNAL as a warning
+        '''
+        import pandas as pd
+        df = pd.read_csv(path,usecols=['timestamp','close','low','open','high'])
+        if drop_last and len(df)>0:
+            df = df.iloc[:-1]
+        stamp = df.timestamp.astype(str).str.split('.').str[0]
+        try:
+            # every row parsed on its own , a date-only row does not make the rows with a time fail
+            parsed = pd.to_datetime(stamp,errors='coerce',format='mixed')
+        except (TypeError,ValueError):
+            parsed = pd.to_datetime(stamp,errors='coerce')
+        valid = parsed.notna().values
+        dropped = int((~valid).sum())
+        if dropped > 0:
+            JOURNAL.warning('error',source='candle_store',path=str(path),dropped=dropped,rows=len(df),
+                            timestamps=df.timestamp[~valid].astype(str).tolist()[:10])
+        time = parsed[valid].values.astype('datetime64[s]').astype('int64')
+        has_time = stamp[valid].str.contains(':').values
+        if not has_time.any():
+            tz_offset = 0
+        else:
+            time = time-np.where(has_time,0,tz_offset)
+        return cls(time,df.open.values[valid],df.high.values[valid],df.low.values[valid],df.close.values[valid],tz_offset)
+    @property
+    def time(self):
+        return self._time[:self._n]
+    @property
+    def open(self):
+        return self._open[:self._n]
+    @property
+    def high(self):
+        return self._high[:self._n]
+    @property
+    def low(self):
+        return self._low[:self._n]
+    @property
+    def close(self):
+        return self._close[:self._n]
+    @property
+    def up(self):
+        return self._up[:self._n]
+    def append(self,time,open,high,low,close):
+        '''
+        add one closed bar at the end , amortized O(1)
+            args:
+                time (int) : open time epoch seconds
+                open , high , low , close (float)
+        '''
+        if self._n == len(self._time):
+            self._grow(max(16,self._n*2))
+        n = self._n
+        self._time[n] = time
+        self._open[n] = open
+        self._high[n] = high
+        self._low[n] = low
+        self._close[n] = close
+        self._up[n] = close >= open
+        self._n = n+1
+        if self._index is not None:
+            self._index[int(time)] = n
+    def extend(self,time,open,high,low,close):
+        '''
+        add many closed bars at the end
+            args:
+                time (np.ndarray int64) , open , high , low , close (np.ndarray float64)
+        '''
+        count = len(time)
+        if self._n+count > len(self._time):
+            self._grow(max(16,(self._n+count)*2))
+        n = self._n
+        self._time[n:n+count] = time
+        self._open[n:n+count] = open
+        self._high[n:n+count] = high
+        self._low[n:n+count] = low
+        self._close[n:n+count] = close
+        self._up[n:n+count] = self._close[n:n+count] >= self._open[n:n+count]
+        self._n = n+count
+        if self._index is not None:
+            self._index.update(zip(self._time[n:n+count].tolist(),range(n,n+count)))
+    def _grow(self,size):
+        for name in ('_time','_open','_high','_low','_close','_up'):
+            old = getattr(self,name)
+            new = np.empty(size,dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self,name,new)
+    def position(self,time):
+        '''
+        position of bar open time , O(1)
+            args:
+                time (int) : epoch seconds
+            return:
+                int or None
+        '''
+        if self._index is None:
+            self._index = dict(zip(self.time.tolist(),range(self._n)))
+        return self._index.get(int(time))
+    def label(self,i):
+        '''
+        local time string of position i
+        '''
+        return str(format_times([self.time[i]+self.tz_offset])[0])
+    def labels(self,start=0):
+        '''
+        local time string of every bar from position start
+            return:
+                np.ndarray (str)
+        '''
+        return format_times(self.time[start:]+self.tz_offset)
+    def bar(self,i):
+        '''
+        bar dict of position i
+            return:
+                dict : {'close':close , 'low':low , 'open':open , 'high':high , 'rg':rg}
+        '''
+        if i < 0:
+            i += self._n
+        if i < 0 or i >= self._n:
+            raise IndexError(i)
+        if self._up[i]:
+            rg = 'up'
+        else:
+            rg = 'down'
+        return {'close':float(self._close[i]),'low':float(self._low[i]),'open':float(self._open[i]),'high':float(self._high[i]),'rg':rg}
+    def at(self,time):
+        '''
+        bar dict of open time
+            args:
+                time (int) : epoch seconds
+        '''
+        i = self.position(time)
+        if i is None:
+            raise KeyError(time)
+        return self.bar(i)
+    def tail(self,count):
+        '''
+        CandleData view of the last count bars , arrays are not copied
+        '''
+        start = max(0,self._n-count)
+        return CandleData.view(self,start,self._n)
+    @classmethod
+    def wrap(cls,time,open,high,low,close,tz_offset=TZ_OFFSET,up=None):
+        '''
+        CandleData over existing arrays ( memmap , shared memory ) without copying them
+            up (np.ndarray bool) : close >= open when it is kept by the caller , computed over every bar otherwise
+        '''
+        new = cls.__new__(cls)
+        new._time = time
+        new._open = open
+        new._high = high
+        new._low = low
+        new._close = close
+        if up is None:
+            up = close >= open
+        new._up = up
+        new._n = len(time)
+        new.tz_offset = tz_offset
+        new._index = None
+        return new
+    @classmethod
+    def view(cls,data,start,stop):
+        new = cls.__new__(cls)
+        for name in ('_time','_open','_high','_low','_close','_up'):
+            setattr(new,name,getattr(data,name)[start:stop])
+        new._n = stop-start
+        new.tz_offset = data.tz_offset
+        new._index = None
+        return new
+    def advance(self,stop):
+        '''
+        show the first stop bars of the arrays , O(1) , for walking a view bar by bar instead of making a view for every bar
+            args:
+                stop (int) : bars shown , at most the length of the arrays
+        Notice:
+            view = CandleData.view(data,0,len(data)) then view.advance(i+1) for every bar ,
+            the arrays are shared so do not append to a view that is not at its end
+        '''
+        if stop > len(self._time):
+            raise IndexError(stop)
+        if self._index is not None:
+            if stop < self._n:
+                self._index = None
+            else:
+                self._index.update(zip(self._time[self._n:stop].tolist(),range(self._n,stop)))
+        self._n = stop
+    def __len__(self):
+        return self._n
+    def __iter__(self):
+        for label in self.labels():
+            yield str(label)
+    def __contains__(self,key):
+        try:
+            return self.position(parse_time(key)-self.tz_offset) is not None
+        except (ValueError,TypeError):
+            return False
+    def __getitem__(self,key):
+        try:
+            time = parse_time(key)-self.tz_offset
+        except (ValueError,TypeError):
+            raise KeyError(key)
+        return self.at(time)
+    def __eq__(self,other):
+        if isinstance(other,Mapping) and len(other) != len(self):
+            return False
+        if isinstance(other,CandleData):
+            return bool(np.array_equal(self.time,other.time) and np.array_equal(self.open,other.open) and np.array_equal(self.high,other.high)
+                        and np.array_equal(self.low,other.low) and np.array_equal(self.close,other.close))
+        return Mapping.__eq__(self,other)
+    __hash__ = None
@@ -0,0 +1,239 @@
+import os
+import struct
+import zlib
+import numpy as np
+from strategy_method import TrendState, TREND_HISTORY
+from journal import JOURNAL
+
+
+
+MAGIC = b'TRCK'
+VERSION = 1
+HEADER = struct.Struct('<4sHqq')
+FIELDS = struct.Struct('<BBBBBB4d4d4dqii')
+MODES = {None:0,'uptrend':1,'downtrend':2}
+NAMES = {v:k for k,v in MODES.items()}
+TRENDS = ('uptrend','downtrend')
+LENGTH = struct.Struct('<I')
+SNAPSHOT_BARS = 1000
+
+def _float(value):
+    if value is None:
+        return float('nan')
+    return float(value)
+def _value(value):
+    if value != value:
+        return None
+    return value
+def dumps(state,candle_time,entries=None):
+    '''
+    TrendState -> bytes
+        args:
+            state (TrendState)
+            candle_time (int) : open time of the last bar processed ( state.i-1 ) , epoch seconds
+            entries (list) : trend history entries written , default the whole state.trend_list
+                             ( only the new entries for a record of the append log )
+        return:
+            bytes : header , fixed fields , trend history arrays , crc32
+    '''
+    if entries is None:
+        entries = state.trend_list
+    last = state.last or {}
+    buy = state.buy_info
+    trend = np.fromiter((TRENDS.index(t['trend']) for t in entries),dtype='int8',count=len(entries))
+    lowest = np.fromiter((_float(t['lowest']) for t in entries),dtype='float64',count=len(entries))
+    highest = np.fromiter((_float(t['highest']) for t in entries),dtype='float64',count=len(entries))
+    body = HEADER.pack(MAGIC,VERSION,int(candle_time),state.i)
+    body += FIELDS.pack(MODES[state.find_trend_mode],bool(state.revert),bool(state.success_mode),bool(state.marginstate),
+                        state.last is not None,last.get('rg') == 'up',
+                        _float(last.get('open')),_float(last.get('high')),_float(last.get('low')),_float(last.get('close')),
+                        _float(state.lowest),_float(state.highest),_float(state.newlowest),_float(state.newhighest),
+                        float(buy['margin']),float(buy['pricein']),float(buy['stoploss']),float(buy['last_buy']),
+                        int(state.num_state),state.trend_list.maxlen or 0,len(trend))
+    body += trend.tobytes()+lowest.tobytes()+highest.tobytes()
+    return body+struct.pack('<I',zlib.crc32(body))
+def loads(data,state=None):
+    '''
+    bytes -> (TrendState , candle_time)
+        args:
+            state (TrendState) : continue this state ( record of the append log ) , its fields are replaced
+                                 and the entries are added to its trend_list
+        raise:
+            ValueError : not a checkpoint , other version or damaged
+    '''
+    if len(data) < HEADER.size+FIELDS.size+4 or struct.unpack('<I',data[-4:])[0] != zlib.crc32(data[:-4]):
+        raise ValueError('damaged checkpoint')
+    magic,version,candle_time,i = HEADER.unpack_from(data,0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('checkpoint version '+str(version)+' , need '+str(VERSION))
+    f = FIELDS.unpack_from(data,HEADER.size)
+    mode,revert,success,margin,has_last,up = f[:6]
+    last = f[6:10]
+    lowest,highest,newlowest,newhighest = f[10:14]
+    buy = f[14:18]
+    num_state,history,count = f[18:21]
+    if state is None:
+        state = TrendState(history or TREND_HISTORY)
+    state.i = i
+    state.find_trend_mode = NAMES[mode]
+    state.revert = bool(revert)
+    state.success_mode = bool(success)
+    state.marginstate = bool(margin)
+    if has_last:
+        state.last = {'close':last[3],'low':last[2],'open':last[0],'high':last[1],'rg':'up' if up else 'down'}
+    state.lowest = _value(lowest)
+    state.highest = _value(highest)
+    state.newlowest = _value(newlowest)
+    state.newhighest = _value(newhighest)
+    state.buy_info = {'margin':buy[0],'pricein':buy[1],'stoploss':buy[2],'last_buy':buy[3]}
+    state.num_state = num_state
+    offset = HEADER.size+FIELDS.size
+    trend = np.frombuffer(data,dtype='int8',count=count,offset=offset)
+    lows = np.frombuffer(data,dtype='float64',count=count,offset=offset+count)
+    highs = np.frombuffer(data,dtype='float64',count=count,offset=offset+count*9)
+    state.trend_list.extend({'trend':TRENDS[t],'lowest':_value(l),'highest':_value(h)}
+                            for t,l,h in zip(trend.tolist(),lows.tolist(),highs.tolist()))
+    return state,candle_time
+def records(data):
+    '''
+    records of an append log ( length prefixed dumps ) , a record cut by a crash ends the log
+        return:
+            list : [bytes , ....]
+    '''
+    result = []
+    offset = 0
+    while offset+LENGTH.size <= len(data):
+        size = LENGTH.unpack_from(data,offset)[0]
+        offset += LENGTH.size
+        if offset+size > len(data):
+            break
+        result.append(data[offset:offset+size])
+        offset += size
+    return result
+class Checkpoint:
+    '''
+    TrendStrategy state saved after every bar for warm restarts of real mode
+        files :
+            <path>/<symbol>-<timesetup>-<name>.state : snapshot of the whole state , replaced atomically
+            <path>/<symbol>-<timesetup>-<name>.log : one record for every bar after the snapshot ,
+                                                      fields and only the trend entries added by the bar
+        Method:
+            save : save data_dict['engine'].state , tied to the open time of the last processed bar
+            resume : data_dict for strategy with the saved state , {} if there is no valid checkpoint
+    Notice:
+        save appends a small record , O(1) for each bar , a new snapshot is written every snapshot_bars bars
+        ( or when more entries were added than trend_list keeps ) and the log starts again
+        the checkpoint is used only if candles still has the same bar at the same position ,
+        otherwise the strategy runs on the whole history again
+    '''
+    def __init__(self,symbol,timesetup,name='strategy',path='./history',snapshot_bars=SNAPSHOT_BARS):
+        self.path = os.path.join(path,symbol+'-'+timesetup+'-'+name+'.state')
+        self.log_path = os.path.join(path,symbol+'-'+timesetup+'-'+name+'.log')
+        self.snapshot_bars = snapshot_bars
+        self.saved_i = None
+        self.snapshot_i = None
+        self.last_entry = None
+        self.log = None
+    def save(self,data_dict,candles):
+        '''
+        args:
+            data_dict (dict) : data_dict of strategy ( with 'engine' )
+            candles (CandleData) : short bars given to strategy
+        return:
+            Bool : False if the strategy keeps no TrendState
+        '''
+        engine = data_dict.get('engine')
+        state = getattr(engine,'state',None)
+        if not isinstance(state,TrendState) or state.i == 0 or state.i == self.saved_i:
+            return False
+        candle_time = int(candles.time[state.i-1])
+        entries = None
+        if self.snapshot_i != None and state.i-self.snapshot_i < self.snapshot_bars:
+            entries = self._new_entries(state.trend_list)
+        if entries is None:
+            self._snapshot(state,candle_time)
+        else:
+            data = dumps(state,candle_time,entries)
+            self.log.write(LENGTH.pack(len(data))+data)
+            self.log.flush()
+            os.fsync(self.log.fileno())
+        self.saved_i = state.i
+        if len(state.trend_list) > 0:
+            self.last_entry = state.trend_list[-1]
+        return True
+    def _new_entries(self,trend_list):
+        '''
+        entries added after the last saved one ( looked up from the end ) , None if it was dropped from trend_list
+        '''
+        entries = []
+        for entry in reversed(trend_list):
+            if entry is self.last_entry:
+                entries.reverse()
+                return entries
+            entries.append(entry)
+        if self.last_entry is None:
+            entries.reverse()
+            return entries
+        return None
+    def _snapshot(self,state,candle_time):
+        os.makedirs(os.path.dirname(self.path) or '.',exist_ok=True)
+        temp = self.path+'.tmp'
+        with open(temp,'wb') as f:
+            f.write(dumps(state,candle_time))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp,self.path)
+        # records left in the log are older than the snapshot , they are skipped by load if this truncate is lost
+        if self.log != None:
+            self.log.close()
+        self.log = open(self.log_path,'wb')
+        os.fsync(self.log.fileno())
+        self.snapshot_i = state.i
+    def close(self):
+        if self.log != None:
+            self.log.close()
+            self.log = None
+    def load(self):
+        '''
+        snapshot with the records of the log after it
+            return:
+                (TrendState , candle_time) or None
+        '''
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path,'rb') as f:
+                state,candle_time = loads(f.read())
+        except (OSError,ValueError,KeyError,IndexError,struct.error) as e:
+            JOURNAL.warning('error',source='checkpoint',path=self.path,error=str(e))
+            return None
+        if not os.path.exists(self.log_path):
+            return state,candle_time
+        with open(self.log_path,'rb') as f:
+            data = f.read()
+        for record in records(data):
+            try:
+                if HEADER.unpack_from(record,0)[3] <= state.i:
+                    continue
+                state,candle_time = loads(record,state)
+            except (ValueError,KeyError,IndexError,struct.error) as e:
+                # a damaged record ends the log , the state of the record before it is used
+                JOURNAL.warning('error',source='checkpoint',path=self.log_path,bars=state.i,error=str(e))
+                break
+        return state,candle_time
+    def resume(self,candles):
+        '''
+        args:
+            candles (CandleData) : short bars
+        return:
+            data_dict (dict) : {'checkpoint':TrendState} or {}
+        '''
+        saved = self.load()
+        if saved is None:
+            return {}
+        state,candle_time = saved
+        if state.i > len(candles) or int(candles.time[state.i-1]) != candle_time:
+            JOURNAL.warning('checkpoint',path=self.path,bars=state.i,error='does not match candles')
+            return {}
+        self.saved_i = state.i
+        return {'checkpoint':state}
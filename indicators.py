@@ -0,0 +1,540 @@
+import sys
+import math
+import time
+import operator
+from collections import deque
+import numpy as np
+from candle_store import CandleData
+
+
+
+NAN = float('nan')
+BATCH_BARS = 64
+_KERNELS = {}
+
+def _ema_loop(values,alpha,value,count,out):
+    for i in range(len(values)):
+        if count == 0:
+            value = values[i]
+        else:
+            value = value+alpha*(values[i]-value)
+        count += 1
+        out[i] = value
+    return value,count
+def _rma_loop(values,period,total,value,count,out):
+    for i in range(len(values)):
+        count += 1
+        if count < period:
+            total += values[i]
+            out[i] = np.nan
+        elif count == period:
+            total += values[i]
+            value = total/period
+            out[i] = value
+        else:
+            value = (value*(period-1)+values[i])/period
+            out[i] = value
+    return total,value,count
+def _kernel(function):
+    '''
+    function compiled by numba ( imported on first use , cached on disk ) , the function itself without numba
+    '''
+    name = function.__name__
+    if name not in _KERNELS:
+        try:
+            from numba import njit
+            _KERNELS[name] = njit(cache=True,nogil=True)(function)
+        except ImportError:
+            _KERNELS[name] = None
+    return _KERNELS[name]
+def _run(function,values,*args):
+    '''
+    run a loop kernel over values , returns (out , state)
+    '''
+    out = np.empty(len(values))
+    compiled = _kernel(function)
+    if compiled is not None:
+        return out,compiled(np.ascontiguousarray(values,dtype='float64'),*args,out)
+    result = [0.0]*len(values)
+    state = function(np.asarray(values,dtype='float64').tolist(),*args,result)
+    out[:] = result
+    return out,state
+def _array(values):
+    return np.asarray(values,dtype='float64')
+class Indicator:
+    '''
+    base of the incremental indicators
+        Method:
+            update : add one value , O(1) , return the indicator value ( nan while warming up )
+            extend : add many values ( vectorized / compiled ) , return an array of the values
+            bar / bars : the same for (high , low , close) , source picks the input
+        Get:
+            value : last value
+            count : number of values added
+    Notice:
+        update and extend do the same float operations in the same order , so they give exactly the same values
+    '''
+    outputs = ('value',)
+    source = 'close'
+    def bar(self,high,low,close):
+        if self.source == 'close':
+            return self.update(close)
+        return self.update(high if self.source == 'high' else low)
+    def bars(self,high,low,close):
+        if self.source == 'close':
+            return self.extend(close)
+        return self.extend(high if self.source == 'high' else low)
+class SMA(Indicator):
+    '''
+    simple moving average of period values , running sum
+    '''
+    def __init__(self,period,source='close'):
+        self.period = period
+        self.source = source
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+        self.count = 0
+        self.value = NAN
+    def update(self,x):
+        x = float(x)
+        old = self.window[0] if len(self.window) == self.period else 0.0
+        self.window.append(x)
+        self.total += x-old
+        self.count += 1
+        self.value = self.total/self.period if self.count >= self.period else NAN
+        return self.value
+    def extend(self,values):
+        values = _array(values)
+        n = len(values)
+        if n == 0:
+            return np.empty(0)
+        joined = np.concatenate((np.array(self.window,dtype='float64'),values))
+        lead = len(self.window)
+        old = np.zeros(n)
+        # value leaving the window for each new value ( 0.0 while the window is not full )
+        index = np.arange(lead,lead+n)-self.period
+        full = index >= 0
+        old[full] = joined[index[full]]
+        total = np.cumsum(np.concatenate(([self.total],values-old)))[1:]
+        count = self.count+np.arange(1,n+1)
+        out = np.where(count >= self.period,total/self.period,NAN)
+        self.window.extend(values[-self.period:].tolist())
+        self.total = float(total[-1])
+        self.count += n
+        self.value = float(out[-1])
+        return out
+class EMA(Indicator):
+    '''
+    exponential moving average , alpha = 2 / (period + 1) , starts at the first value
+    '''
+    def __init__(self,period,source='close'):
+        self.period = period
+        self.source = source
+        self.alpha = 2.0/(period+1)
+        self.count = 0
+        self.value = NAN
+    def update(self,x):
+        x = float(x)
+        if self.count == 0:
+            self.value = x
+        else:
+            self.value = self.value+self.alpha*(x-self.value)
+        self.count += 1
+        return self.value
+    def extend(self,values):
+        out,(value,count) = _run(_ema_loop,_array(values),self.alpha,self.value,self.count)
+        self.value = float(value)
+        self.count = int(count)
+        return out
+class _RMA:
+    '''
+    Wilder average , mean of the first period values , then (value * (period - 1) + x) / period
+    '''
+    def __init__(self,period):
+        self.period = period
+        self.total = 0.0
+        self.count = 0
+        self.value = NAN
+    def update(self,x):
+        self.count += 1
+        if self.count < self.period:
+            self.total += x
+            return NAN
+        if self.count == self.period:
+            self.total += x
+            self.value = self.total/self.period
+        else:
+            self.value = (self.value*(self.period-1)+x)/self.period
+        return self.value
+    def extend(self,values):
+        out,(total,value,count) = _run(_rma_loop,values,self.period,self.total,self.value,self.count)
+        self.total = float(total)
+        self.value = float(value)
+        self.count = int(count)
+        return out
+class ATR(Indicator):
+    '''
+    average true range ( Wilder ) , true range of the first bar is high - low
+    '''
+    def __init__(self,period):
+        self.period = period
+        self.rma = _RMA(period)
+        self.last_close = None
+        self.count = 0
+        self.value = NAN
+    def bar(self,high,low,close):
+        high = float(high)
+        low = float(low)
+        tr = high-low
+        if self.last_close is not None:
+            tr = max(tr,abs(high-self.last_close),abs(low-self.last_close))
+        self.last_close = float(close)
+        self.count += 1
+        self.value = self.rma.update(tr)
+        return self.value
+    def bars(self,high,low,close):
+        high = _array(high)
+        low = _array(low)
+        close = _array(close)
+        if len(close) == 0:
+            return np.empty(0)
+        tr = high-low
+        prev = np.concatenate(([NAN if self.last_close is None else self.last_close],close[:-1]))
+        has = ~np.isnan(prev)
+        tr[has] = np.maximum(np.maximum(tr[has],np.abs(high[has]-prev[has])),np.abs(low[has]-prev[has]))
+        out = self.rma.extend(tr)
+        self.last_close = float(close[-1])
+        self.count += len(close)
+        self.value = float(out[-1])
+        return out
+class RSI(Indicator):
+    '''
+    relative strength index ( Wilder ) , 100 when there is no loss , 50 when the price did not move
+    '''
+    def __init__(self,period,source='close'):
+        self.period = period
+        self.source = source
+        self.gain = _RMA(period)
+        self.loss = _RMA(period)
+        self.last = None
+        self.count = 0
+        self.value = NAN
+    @staticmethod
+    def _rsi(gain,loss):
+        if loss == 0:
+            return 100.0 if gain > 0 else 50.0
+        return 100.0-100.0/(1.0+gain/loss)
+    def update(self,x):
+        x = float(x)
+        self.count += 1
+        if self.last is None:
+            self.last = x
+            return NAN
+        change = x-self.last
+        self.last = x
+        gain = self.gain.update(max(change,0.0))
+        loss = self.loss.update(max(-change,0.0))
+        self.value = NAN if gain != gain else self._rsi(gain,loss)
+        return self.value
+    def extend(self,values):
+        values = _array(values)
+        n = len(values)
+        if n == 0:
+            return np.empty(0)
+        out = np.full(n,NAN)
+        start = 0
+        if self.last is None:
+            self.last = float(values[0])
+            start = 1
+        if start < n:
+            change = np.diff(np.concatenate(([self.last],values[start:])))
+            gain = self.gain.extend(np.maximum(change,0.0))
+            loss = self.loss.extend(np.maximum(-change,0.0))
+            with np.errstate(divide='ignore',invalid='ignore'):
+                rsi = 100.0-100.0/(1.0+gain/loss)
+            rsi = np.where(loss == 0,np.where(gain > 0,100.0,50.0),rsi)
+            out[start:] = np.where(np.isnan(gain),NAN,rsi)
+            self.last = float(values[-1])
+        self.count += n
+        self.value = float(out[-1])
+        return out
+class _Rolling(Indicator):
+    '''
+    rolling max / min of period values with a monotonic deque , O(1) amortized for each value
+        args:
+            better (function) : better(a , b) is True when a stays in front of b , operator.gt for max , operator.lt for min
+            reduce (function) : numpy reduction of the same order , np.max / np.min
+    '''
+    def __init__(self,period,source,better=operator.gt,reduce=np.max):
+        self.period = period
+        self.source = source
+        self.better = better
+        self.reduce = reduce
+        self.window = deque(maxlen=period)
+        self.queue = deque()
+        self.count = 0
+        self.value = NAN
+    def update(self,x):
+        x = float(x)
+        i = self.count
+        queue = self.queue
+        better = self.better
+        while queue and not better(queue[-1][1],x):
+            queue.pop()
+        queue.append((i,x))
+        if queue[0][0] <= i-self.period:
+            queue.popleft()
+        self.window.append(x)
+        self.count += 1
+        self.value = queue[0][1] if self.count >= self.period else NAN
+        return self.value
+    def extend(self,values):
+        values = _array(values)
+        n = len(values)
+        if n == 0:
+            return np.empty(0)
+        lead = len(self.window)
+        joined = np.concatenate((np.array(self.window,dtype='float64'),values))
+        out = np.full(n,NAN)
+        if len(joined) >= self.period:
+            windows = np.lib.stride_tricks.sliding_window_view(joined,self.period)
+            best = self.reduce(windows,axis=1)
+            # window k ends at joined[k+period-1] , the new value i is joined[lead+i]
+            first = lead-self.period+1
+            k = np.arange(n)+first
+            ok = (k >= 0) & (self.count+np.arange(1,n+1) >= self.period)
+            out[ok] = best[k[ok]]
+        start = self.count+n-min(self.period,len(joined))
+        tail = joined[-self.period:].tolist()
+        self.queue = deque()
+        for j,x in enumerate(tail):
+            while self.queue and not self.better(self.queue[-1][1],x):
+                self.queue.pop()
+            self.queue.append((start+j,x))
+        self.window.extend(tail)
+        self.count += n
+        self.value = float(out[-1])
+        return out
+class RollingMax(_Rolling):
+    '''
+    highest of the last period values ( high by default )
+    '''
+    def __init__(self,period,source='high'):
+        _Rolling.__init__(self,period,source,operator.gt,np.max)
+class RollingMin(_Rolling):
+    '''
+    lowest of the last period values ( low by default )
+    '''
+    def __init__(self,period,source='low'):
+        _Rolling.__init__(self,period,source,operator.lt,np.min)
+class Bollinger(Indicator):
+    '''
+    bollinger bands , mean and population standard deviation of period values from running sums
+        update / extend return (mid , upper , lower)
+    '''
+    outputs = ('mid','upper','lower')
+    def __init__(self,period,width=2.0,source='close'):
+        self.period = period
+        self.width = float(width)
+        self.source = source
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+        self.squares = 0.0
+        self.count = 0
+        self.value = (NAN,NAN,NAN)
+    def update(self,x):
+        x = float(x)
+        old = self.window[0] if len(self.window) == self.period else 0.0
+        self.window.append(x)
+        self.total += x-old
+        self.squares += x*x-old*old
+        self.count += 1
+        if self.count < self.period:
+            self.value = (NAN,NAN,NAN)
+            return self.value
+        mean = self.total/self.period
+        std = math.sqrt(max(self.squares/self.period-mean*mean,0.0))
+        self.value = (mean,mean+self.width*std,mean-self.width*std)
+        return self.value
+    def extend(self,values):
+        values = _array(values)
+        n = len(values)
+        if n == 0:
+            return (np.empty(0),np.empty(0),np.empty(0))
+        lead = len(self.window)
+        joined = np.concatenate((np.array(self.window,dtype='float64'),values))
+        index = np.arange(lead,lead+n)-self.period
+        old = np.zeros(n)
+        full = index >= 0
+        old[full] = joined[index[full]]
+        total = np.cumsum(np.concatenate(([self.total],values-old)))[1:]
+        squares = np.cumsum(np.concatenate(([self.squares],values*values-old*old)))[1:]
+        mean = total/self.period
+        std = np.sqrt(np.maximum(squares/self.period-mean*mean,0.0))
+        warm = self.count+np.arange(1,n+1) < self.period
+        mid = np.where(warm,NAN,mean)
+        upper = np.where(warm,NAN,mean+self.width*std)
+        lower = np.where(warm,NAN,mean-self.width*std)
+        self.window.extend(values[-self.period:].tolist())
+        self.total = float(total[-1])
+        self.squares = float(squares[-1])
+        self.count += n
+        self.value = (float(mid[-1]),float(upper[-1]),float(lower[-1]))
+        return (mid,upper,lower)
+KINDS = {'sma':SMA,'ema':EMA,'atr':ATR,'rsi':RSI,'max':RollingMax,'min':RollingMin,'bollinger':Bollinger}
+
+def sma(values,period):
+    return SMA(period).extend(values)
+def ema(values,period):
+    return EMA(period).extend(values)
+def atr(high,low,close,period):
+    return ATR(period).bars(high,low,close)
+def rsi(values,period):
+    return RSI(period).extend(values)
+def rolling_max(values,period):
+    return RollingMax(period).extend(values)
+def rolling_min(values,period):
+    return RollingMin(period).extend(values)
+def bollinger(values,period,width=2.0):
+    return Bollinger(period,width).extend(values)
+def make(spec):
+    '''
+    ('ema',20) , ['bollinger',20,2] , 'atr:14' -> indicator
+    '''
+    if isinstance(spec,str):
+        spec = spec.split(':')
+        spec = [spec[0]]+[float(v) if '.' in v else int(v) for v in spec[1:]]
+    return KINDS[spec[0]](*spec[1:])
+class Indicators:
+    '''
+    named indicators of one candle series , kept in data_dict['indicators'] between strategy calls
+        args:
+            specs (dict) : {'ema20':('ema',20) , 'atr':('atr',14) , 'bb':('bollinger',20,2)}
+            batch_bars (int) : extend when at least batch_bars bars are new , None never
+        Method:
+            update : feed the bars of candles after the last call , extend when at least batch_bars are new ,
+                     update for each bar otherwise ( live mode : O(1) for each new bar )
+            value : last value of name ( 'bb.upper' for the outputs of bollinger )
+            array : every value of name , one for each bar
+    '''
+    def __init__(self,specs,batch_bars=BATCH_BARS):
+        self.batch_bars = batch_bars
+        self.items = {name:make(spec) for name,spec in specs.items()}
+        self.i = 0
+        self.columns = {}
+        for name,item in self.items.items():
+            for key in self._keys(name,item):
+                self.columns[key] = np.empty(0)
+    def _keys(self,name,item):
+        if len(item.outputs) == 1:
+            return [name]
+        return [name+'.'+output for output in item.outputs]
+    def _store(self,key,values,start):
+        column = self.columns[key]
+        need = start+len(values)
+        if need > len(column):
+            grown = np.empty(max(16,need*2))
+            grown[:start] = column[:start]
+            self.columns[key] = column = grown
+        column[start:need] = values
+    def _put(self,key,value,i):
+        column = self.columns[key]
+        if i >= len(column):
+            self._store(key,(value,),i)
+        else:
+            column[i] = value
+    def update(self,candles):
+        '''
+        args:
+            candles (CandleData) : every closed bar , only the bars after the last call are read
+        return:
+            self
+        '''
+        start = self.i
+        stop = len(candles)
+        if stop <= start:
+            return self
+        if self.batch_bars != None and stop-start >= self.batch_bars:
+            high = candles.high[start:stop]
+            low = candles.low[start:stop]
+            close = candles.close[start:stop]
+            for name,item in self.items.items():
+                result = item.bars(high,low,close)
+                if len(item.outputs) == 1:
+                    result = (result,)
+                for key,values in zip(self._keys(name,item),result):
+                    self._store(key,values,start)
+        else:
+            for i in range(start,stop):
+                high = float(candles.high[i])
+                low = float(candles.low[i])
+                close = float(candles.close[i])
+                for name,item in self.items.items():
+                    result = item.bar(high,low,close)
+                    if len(item.outputs) == 1:
+                        self._put(name,result,i)
+                    else:
+                        for key,value in zip(self._keys(name,item),result):
+                            self._put(key,value,i)
+        self.i = stop
+        return self
+    def value(self,name):
+        if self.i == 0:
+            return NAN
+        return float(self.columns[name][self.i-1])
+    def array(self,name):
+        return self.columns[name][:self.i]
+    def __getitem__(self,name):
+        return self.value(name)
+    def __contains__(self,name):
+        return name in self.columns or name in self.items
+def _same(a,b):
+    return bool(np.array_equal(a,b,equal_nan=True))
+def verify(candles,specs=None,split=None):
+    '''
+    differential check of extend ( batch ) against update for each bar
+        args:
+            candles (CandleData)
+            specs (dict) : Indicators specs , default one of every kind
+            split (int) : extend on bars before split , then update for each bar after it ( like real mode )
+        return:
+            dict : {name:True if every value is the same ( bit for bit , nan at the same bars )}
+    '''
+    if specs is None:
+        specs = {'sma':('sma',20),'ema':('ema',20),'atr':('atr',14),'rsi':('rsi',14),'max':('max',50),'min':('min',50),
+                 'bb':('bollinger',20,2.0)}
+    batch = Indicators(specs,1).update(candles)
+    step = Indicators(specs,None)
+    if split is not None:
+        step.batch_bars = 1
+        step.update(CandleData.view(candles,0,split))
+        step.batch_bars = None
+    for stop in range(step.i+1,len(candles)+1):
+        step.update(CandleData.view(candles,0,stop))
+    return {name:_same(batch.array(name),step.array(name)) for name in batch.columns}
+def speed(candles,specs=None,bars=20000):
+    '''
+    seconds of extend on every bar , and microseconds of update for one new bar ( real mode )
+    '''
+    if specs is None:
+        specs = {'ema':('ema',20),'atr':('atr',14),'rsi':('rsi',14),'bb':('bollinger',20,2.0)}
+    Indicators(specs,1).update(CandleData.view(candles,0,100))
+    start = time.perf_counter()
+    Indicators(specs,1).update(candles)
+    batch = time.perf_counter()-start
+    step = Indicators(specs).update(CandleData.view(candles,0,len(candles)-bars))
+    start = time.perf_counter()
+    for stop in range(step.i+1,len(candles)+1):
+        step.update(CandleData.view(candles,0,stop))
+    loop = time.perf_counter()-start
+    return {'bars':len(candles),'batch':batch,'bar_us':loop/bars*1e6}
+if __name__ == '__main__':
+    '''
+    python indicators.py [history csv ....] : batch and incremental values must be the same , then speed on 1M bars
+    '''
+    from benchmark import synthetic_candles
+    sets = [('synthetic',synthetic_candles(50000,'1m',seed)) for seed in range(3)]
+    sets += [(path,CandleData.from_csv(path)) for path in sys.argv[1:]]
+    for name,candles in sets:
+        print(name,verify(candles),verify(candles,split=len(candles)//2))
+    print(speed(synthetic_candles(1000000,'1m',7)))
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug':DEBUG,'info':INFO,'warning':WARNING,'error':ERROR}
+SEGMENT_BYTES = 64*1024*1024
+BATCH = 4096
+SUFFIX = '.ndjson'
+
+def level_of(value):
+    '''
+    'info' , 'INFO' , 20 -> 20
+    '''
+    if isinstance(value,str):
+        return LEVELS[value.lower()]
+    return int(value)
+def _default(value):
+    if hasattr(value,'item'):
+        return value.item()
+    return str(value)
+class Journal:
+    '''
+    Structured event journal ( bars , trend changes , actions , orders , fills , errors )
+        write:
+            event only checks level / sampling and puts (time , kind , level , fields) on a queue ,
+            a daemon thread writes batches as NDJSON lines into append-only segments
+            <path>/<name>-<start time>-<pid>-<number>.ndjson , a new segment every segment_bytes
+        args:
+            path (str) : folder of segments , created on the first event
+            level (int or str) : events below level are dropped before the queue
+            sample (dict) : {'trend':100} keeps one of every 100 events of the kind
+            echo (int or str) : events at or above echo are also printed ( errors stay on the terminal ) , None prints nothing
+        Method:
+            event : add one event
+            debug / info / warning / error : event with that level
+            enabled : True if events of level are kept , check it before building costly fields
+            flush : wait until every queued event is written
+            close : flush and stop the writer
+        Get:
+            dropped (int) : events dropped by sampling
+    Notice:
+        nothing is opened before the first event , so importing the module does no I/O
+        the queue is not bounded , event never blocks the trading loop
+    '''
+    def __init__(self,path='./journal',name='events',level=INFO,sample=None,echo=WARNING,segment_bytes=SEGMENT_BYTES,batch=BATCH):
+        self.path = path
+        self.name = name
+        self.level = level_of(level)
+        self.sample = dict(sample or {})
+        self.echo = None if echo is None else level_of(echo)
+        self.segment_bytes = segment_bytes
+        self.batch = batch
+        self.seen = {}
+        self.dropped = 0
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.writer = None
+        self.file = None
+        self.segment = 0
+        self.size = 0
+        self.started = None
+    def configure(self,path=None,level=None,sample=None,echo=False):
+        '''
+        change path , level , sampling or echo ( path only before the first event )
+        '''
+        if path != None:
+            self.path = path
+        if level != None:
+            self.level = level_of(level)
+        if sample != None:
+            self.sample = dict(sample)
+        if echo != False:
+            self.echo = None if echo is None else level_of(echo)
+    def enabled(self,level=INFO):
+        return level >= self.level
+    def event(self,kind,level=INFO,**fields):
+        '''
+        args:
+            kind (str) : 'bar' , 'trend' , 'action' , 'order' , 'fill' , 'error' ....
+            level (int) : DEBUG , INFO , WARNING , ERROR
+            fields : json values ( numpy numbers are converted )
+        '''
+        if level < self.level:
+            return
+        every = self.sample.get(kind)
+        if every != None:
+            n = self.seen.get(kind,0)
+            self.seen[kind] = n+1
+            if n%every != 0:
+                self.dropped += 1
+                return
+        if self.writer == None:
+            self._start()
+        self.queue.put((time.time(),kind,level,fields))
+    def debug(self,kind,**fields):
+        self.event(kind,DEBUG,**fields)
+    def info(self,kind,**fields):
+        self.event(kind,INFO,**fields)
+    def warning(self,kind,**fields):
+        self.event(kind,WARNING,**fields)
+    def error(self,kind,**fields):
+        self.event(kind,ERROR,**fields)
+    def flush(self,timeout=None):
+        '''
+        wait until the writer has written every event queued before this call
+        '''
+        if self.writer == None:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+    def close(self):
+        with self.lock:
+            writer = self.writer
+            if writer == None:
+                return
+            self.queue.put(None)
+            writer.join()
+            self.writer = None
+    def _start(self):
+        with self.lock:
+            if self.writer != None:
+                return
+            self.started = time.strftime('%Y%m%d%H%M%S',time.gmtime())
+            self.writer = threading.Thread(target=self._run,name='journal',daemon=True)
+            self.writer.start()
+            atexit.register(self.close)
+    def _open(self):
+        os.makedirs(self.path,exist_ok=True)
+        self.segment += 1
+        name = self.name+'-'+self.started+'-'+str(os.getpid())+'-'+str(self.segment).zfill(4)+SUFFIX
+        self.file = open(os.path.join(self.path,name),'ab')
+        self.size = 0
+    def _run(self):
+        get = self.queue.get
+        get_nowait = self.queue.get_nowait
+        while True:
+            batch = [get()]
+            while len(batch) < self.batch:
+                try:
+                    batch.append(get_nowait())
+                except queue.Empty:
+                    break
+            if not self._write(batch):
+                return
+    def _write(self,batch):
+        '''
+        write one batch , return False when close was asked
+        '''
+        lines = []
+        signals = []
+        running = True
+        for item in batch:
+            if item is None:
+                running = False
+                continue
+            if isinstance(item,threading.Event):
+                signals.append(item)
+                continue
+            t,kind,level,fields = item
+            record = {'t':t,'kind':kind,'level':level}
+            record.update(fields)
+            try:
+                lines.append(json.dumps(record,separators=(',',':'),ensure_ascii=False,default=_default))
+            except (TypeError,ValueError) as e:
+                lines.append(json.dumps({'t':t,'kind':'journal_error','level':ERROR,'event':kind,'error':str(e)}))
+            if self.echo != None and level >= self.echo:
+                print(time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(t)),kind,fields,file=sys.stderr)
+        if lines:
+            try:
+                if self.file == None or self.size >= self.segment_bytes:
+                    if self.file != None:
+                        self.file.close()
+                    self._open()
+                data = ('\n'.join(lines)+'\n').encode()
+                self.file.write(data)
+                self.file.flush()
+                self.size += len(data)
+            except OSError as e:
+                print('journal write fail =',self.path,'error=',e,file=sys.stderr)
+        if not running and self.file != None:
+            self.file.close()
+            self.file = None
+        for signal in signals:
+            signal.set()
+        return running
+def segments(path='./journal',name='events'):
+    '''
+    segment files of path in write order
+    '''
+    if not os.path.isdir(path):
+        return []
+    files = [f for f in os.listdir(path) if f.startswith(name+'-') and f.endswith(SUFFIX)]
+    return [os.path.join(path,f) for f in sorted(files)]
+def read(path='./journal',kinds=None,level=None,since=None,until=None,name='events'):
+    '''
+    read events back in write order
+        args:
+            kinds (list) : only these kinds , lines of other kinds are skipped without json parsing
+            level (int or str) : only events at or above level
+            since , until (float) : epoch seconds
+        yield:
+            dict : {'t','kind','level',....fields}
+    '''
+    keys = None
+    if kinds != None:
+        keys = [('"kind":'+json.dumps(kind,ensure_ascii=False)+',').encode() for kind in kinds]
+    minimum = None if level == None else level_of(level)
+    for file in segments(path,name):
+        with open(file,'rb') as f:
+            for line in f:
+                if keys != None and not any(key in line for key in keys):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if minimum != None and record['level'] < minimum:
+                    continue
+                if since != None and record['t'] < since:
+                    continue
+                if until != None and record['t'] > until:
+                    continue
+                yield record
+JOURNAL = Journal()
+if __name__ == '__main__':
+    '''
+    python journal.py [path] [kind ....] : print events of the journal as json lines
+    '''
+    folder = sys.argv[1] if len(sys.argv) > 1 else './journal'
+    for record in read(folder,sys.argv[2:] or None):
+        print(json.dumps(record,ensure_ascii=False))
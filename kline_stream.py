@@ -0,0 +1,273 @@
+import json
+import time
+import asyncio
+import websockets
+from collections import deque
+from candle_store import interval_seconds
+from candle_cache import KLINE_LIMIT
+from journal import JOURNAL
+
+
+
+WS_URL = 'wss://stream.binance.com:9443'
+
+class LagStats:
+    '''
+    lag from bar close to strategy call ( seconds ) , last size calls are kept
+    '''
+    def __init__(self,size=1000):
+        self.lags = deque(maxlen=size)
+        self.count = 0
+        self.max = 0.0
+    def add(self,lag):
+        self.lags.append(lag)
+        self.count += 1
+        if lag > self.max:
+            self.max = lag
+    def summary(self):
+        '''
+        return:
+            dict : {'count','last','p50','p99','max'}
+        '''
+        if len(self.lags) == 0:
+            return {'count':0,'last':None,'p50':None,'p99':None,'max':None}
+        lags = sorted(self.lags)
+        return {'count':self.count,'last':self.lags[-1],'p50':lags[len(lags)//2],
+                'p99':lags[min(len(lags)-1,int(len(lags)*0.99))],'max':self.max}
+class KlineStream:
+    '''
+    Closed klines from binance <symbol>@kline_<tf> stream
+        store : CandleCache ( append_klines ) or CandleData ( append ) , closed bars are added to it
+        on_bar : on_bar(symbol , timesetup , kline) called for every new closed bar , function or coroutine
+        Method:
+            run : connect , backfill missing bars over REST , then consume the stream ( coroutine )
+            wait_closed : wait until the bar closed at close_time is stored ( coroutine )
+            stop
+        Get:
+            lag : LagStats of bar close -> on_bar
+    Notice:
+        kline (list) : [open_time , open , high , low , close , volume , close_time] like REST klines ( ms )
+        after every (re)connect the bars missed while disconnected are fetched with client.get_klines
+    '''
+    def __init__(self,symbol,timesetup,store,on_bar=None,client=None,ws_url=WS_URL,clock=time.time):
+        self.symbol = symbol
+        self.timesetup = timesetup
+        self.store = store
+        self.on_bar = on_bar
+        self.client = client
+        self.ws_url = ws_url
+        self.clock = clock
+        self.interval = interval_seconds(timesetup)
+        self.lag = LagStats()
+        self.running = False
+        self.ws = None
+        self.closed = None
+        self.last_close_time = self._stored_close_time()
+    def _stored_close_time(self):
+        if hasattr(self.store,'append_klines'):
+            return self.store.last_close_time
+        if len(self.store) == 0:
+            return 0
+        return (int(self.store.time[-1])+self.interval)*1000-1
+    def prepare(self):
+        self.running = True
+        if self.closed == None:
+            self.closed = asyncio.Condition()
+    async def run(self):
+        self.prepare()
+        url = self.ws_url+'/ws/'+self.symbol.lower()+'@kline_'+self.timesetup
+        wait = 1
+        while self.running:
+            try:
+                async with websockets.connect(url) as ws:
+                    self.ws = ws
+                    wait = 1
+                    await self.backfill()
+                    async for message in ws:
+                        await self.handle(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                JOURNAL.error('error',source='kline_stream',symbol=self.symbol,timesetup=self.timesetup,error=str(e))
+            self.ws = None
+            if self.running:
+                await asyncio.sleep(wait)
+                wait = min(wait*2,30)
+    async def stop(self):
+        self.running = False
+        if self.ws != None:
+            await self.ws.close()
+    async def backfill(self):
+        '''
+        fetch closed bars after the last stored close time over REST , every page inside the REQUESTS budget
+        '''
+        if self.client == None or self.last_close_time == 0:
+            return
+        from binance_api import REQUESTS, KLINES_WEIGHT
+        start = self.last_close_time+1
+        while True:
+            klines = await asyncio.get_running_loop().run_in_executor(None,lambda:REQUESTS.call(self.client.get_klines,
+                symbol=self.symbol,interval=self.timesetup,startTime=start,limit=KLINE_LIMIT,weight=KLINES_WEIGHT,market='spot'))
+            now = self.clock()*1000
+            for k in klines:
+                if int(k[6]) < now:
+                    await self._add([int(k[0]),float(k[1]),float(k[2]),float(k[3]),float(k[4]),float(k[5]),int(k[6])])
+            if len(klines) < KLINE_LIMIT:
+                break
+            start = int(klines[-1][6])+1
+    async def handle(self,message):
+        '''
+        apply one kline stream message , only closed bars ( x == true ) are used
+        '''
+        if 'stream' in message:
+            message = message['data']
+        k = message.get('k')
+        if k == None or not k['x']:
+            return
+        await self._add([int(k['t']),float(k['o']),float(k['h']),float(k['l']),float(k['c']),float(k['v']),int(k['T'])])
+    async def _add(self,kline):
+        if kline[6] <= self.last_close_time:
+            return
+        if hasattr(self.store,'append_klines'):
+            self.store.append_klines([kline],now=kline[6]+1)
+        else:
+            self.store.append(kline[0]//1000,kline[1],kline[2],kline[3],kline[4])
+        self.last_close_time = kline[6]
+        async with self.closed:
+            self.closed.notify_all()
+        if self.on_bar != None:
+            self.lag.add(self.clock()-(kline[6]+1)/1000)
+            if asyncio.iscoroutinefunction(self.on_bar):
+                await self.on_bar(self.symbol,self.timesetup,kline)
+            else:
+                self.on_bar(self.symbol,self.timesetup,kline)
+    async def wait_closed(self,close_time,timeout=10):
+        '''
+        wait until the bar closed at close_time is stored
+            args:
+                close_time (int) : epoch seconds
+            return:
+                Bool
+        '''
+        target = close_time*1000-1
+        if self.closed == None:
+            return self.last_close_time >= target
+        async with self.closed:
+            try:
+                await asyncio.wait_for(self.closed.wait_for(lambda:self.last_close_time >= target),timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.last_close_time >= target
+class KlineFeed:
+    '''
+    One combined websocket for many KlineStream ( /stream?streams=a@kline_1m/b@kline_5m )
+        Method:
+            run : connect , backfill every stream , then dispatch messages by symbol / interval ( coroutine )
+            stop
+    '''
+    def __init__(self,streams,ws_url=WS_URL):
+        self.streams = {(s.symbol,s.timesetup):s for s in streams}
+        self.ws_url = ws_url
+        self.running = False
+        self.ws = None
+    async def run(self):
+        self.running = True
+        for stream in self.streams.values():
+            stream.prepare()
+        names = '/'.join(symbol.lower()+'@kline_'+timesetup for symbol,timesetup in self.streams)
+        url = self.ws_url+'/stream?streams='+names
+        wait = 1
+        while self.running:
+            try:
+                async with websockets.connect(url) as ws:
+                    self.ws = ws
+                    wait = 1
+                    await asyncio.gather(*[stream.backfill() for stream in self.streams.values()])
+                    async for message in ws:
+                        message = json.loads(message)
+                        if 'stream' in message:
+                            message = message['data']
+                        k = message.get('k')
+                        if k == None:
+                            continue
+                        stream = self.streams.get((message['s'],k['i']))
+                        if stream != None:
+                            await stream.handle(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                JOURNAL.error('error',source='kline_feed',url=url,error=str(e))
+            self.ws = None
+            if self.running:
+                await asyncio.sleep(wait)
+                wait = min(wait*2,30)
+    async def stop(self):
+        self.running = False
+        for stream in self.streams.values():
+            stream.running = False
+        if self.ws != None:
+            await self.ws.close()
+class ReplayServer:
+    '''
+    Local kline stream for offline tests , sends recorded candles as binance kline messages
+        args:
+            candles (CandleData)
+            symbol (str) , timesetup (str)
+            delay (float) : seconds between bars
+            updates (int) : not closed ( x == false ) messages sent before each closed bar
+            drop_every (int) : close the connection after this many bars ( test reconnect / backfill )
+        Get:
+            client : get_klines over the bars already sent ( REST stand-in for backfill )
+            url : ws url for KlineStream
+    '''
+    def __init__(self,candles,symbol,timesetup,delay=0.0,updates=0,drop_every=0,host='127.0.0.1',port=8766):
+        self.candles = candles
+        self.symbol = symbol
+        self.timesetup = timesetup
+        self.interval = interval_seconds(timesetup)
+        self.delay = delay
+        self.updates = updates
+        self.drop_every = drop_every
+        self.host = host
+        self.port = port
+        self.url = 'ws://'+host+':'+str(port)
+        self.sent = 0
+        self.server = None
+        self.client = _ReplayClient(self)
+    def kline(self,i):
+        c = self.candles
+        open_time = int(c.time[i])*1000
+        return [open_time,str(c.open[i]),str(c.high[i]),str(c.low[i]),str(c.close[i]),'0',open_time+self.interval*1000-1]
+    def message(self,i,closed=True):
+        k = self.kline(i)
+        return json.dumps({'e':'kline','E':k[6]+1,'s':self.symbol,'k':{'t':k[0],'T':k[6],'s':self.symbol,'i':self.timesetup,
+                                                                    'o':k[1],'h':k[2],'l':k[3],'c':k[4],'v':k[5],'x':closed}})
+    async def _handler(self,ws,*args):
+        count = 0
+        while self.sent < len(self.candles):
+            for n in range(self.updates):
+                await ws.send(self.message(self.sent,False))
+            await ws.send(self.message(self.sent))
+            self.sent += 1
+            count += 1
+            await asyncio.sleep(self.delay)
+            if self.drop_every > 0 and count >= self.drop_every:
+                self.sent += 1
+                await ws.close()
+                return
+        await ws.wait_closed()
+    async def start(self):
+        self.server = await websockets.serve(self._handler,self.host,self.port)
+        return self
+    async def stop(self):
+        if self.server != None:
+            self.server.close()
+            await self.server.wait_closed()
+class _ReplayClient:
+    def __init__(self,server):
+        self.server = server
+    def get_klines(self,symbol,interval,startTime,limit=KLINE_LIMIT):
+        s = self.server
+        start = int(s.candles.time.searchsorted(-(-startTime//1000)))
+        stop = min(s.sent,start+limit)
+        return [s.kline(i) for i in range(start,stop)]
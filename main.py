@@ -1,8 +1,17 @@
+import sys
+import json
 import time
-import datetime
-from datetime import datetime as dt2
-from binance_api import Symbol_data, getbinancemethod
+import argparse
+import functools
+import importlib
+from binance_api import Symbol_cache, getbinancemethod, ExchangeSession
 from strategy_method import strategy 
+from backtest import collect_actions, backtest, summary
+from metrics import METRICS
+from journal import JOURNAL, DEBUG, LEVELS
+from resample import resample, ResampledCache
+from checkpoint import Checkpoint
+from market_bus import BUS
 
 
 
@@ -18,10 +27,8 @@ def ReadKeySecret():
     f = open('BNST_TEST.txt','r')
     api_secret = f.read()
     return api_key,api_secret
-
-API_KEY,API_SECRET = ReadKeySecret()
 class script:
-    def __init__(self,symbol,short_period,long_period,ratio,strategy):
+    def __init__(self,symbol,short_period,long_period,ratio,strategy,resample=True,checkpoint=True):
         '''
         腳本:
             args:
@@ -30,143 +37,356 @@ class script:
                 long_period (str) : '1h' , '4h' , '1d'
                 ratio (float) : 0.025 , 0.01
                 strategy (function) 
+                resample (bool) : build long period bars from short period bars instead of downloading them
+                checkpoint (bool) : save strategy state after every bar in real mode and resume from it on restart
         '''
         self.symbol = symbol
         self.long = long_period
         self.short = short_period
         self.ratio = ratio
         self.strategy = strategy
-    def wait_timing(self,last_time,period,longshort):
-        '''
-        last_time (str) : start time  ex: 2010-05-20 08:50:00
-        period (str) : 5d,1h,5m etc..
-        longshort (str) : long or short for time period
-        '''
-        if 'm' in period:
-            number = int(period.replace('m',''))*2
-            date_last =  dt2.strptime(last_time, "%Y-%m-%d %H:%M:%S")+datetime.timedelta(minutes=number)
-        elif 'h' in period:
-            number = int(period.replace('h',''))*2
-            date_last =  dt2.strptime(last_time, "%Y-%m-%d %H:%M:%S")+datetime.timedelta(hours=number)
-        elif 'd' in period:
-            number = int(period.replace('d',''))*2
-            date_last =  dt2.strptime(last_time, "%Y-%m-%d %H:%M:%S")+datetime.timedelta(days=number)
-        date_now = datetime.datetime.now()
-        if longshort == 'short':
-            while date_now<date_last:
-                date_now = datetime.datetime.now()
-                time.sleep(2)
-        else:
-            if date_now>date_last:
-                return True
-            else:
-                return False
+        self.resample = resample
+        self.checkpoint = checkpoint
+        self.checkpointer = None
+        self.session = None
+        self.api = None
+        self.stage = METRICS.stage('strategy')
+    def get_session(self):
+        '''
+        one ExchangeSession for the script ( client , exchange info , account )
+        '''
+        if self.session == None:
+            api_key,api_secret = ReadKeySecret()
+            self.session = ExchangeSession(api_key,api_secret)
+        return self.session
+    def get_api(self):
+        '''
+        one getbinancemethod for the script
+        '''
+        if self.api == None:
+            self.api = getbinancemethod(None,None,self.get_session())
+        return self.api
+    @METRICS.timed('make_action')
     def make_action(self,action):
         '''
             action(dict)
+        Notice:
+            size comes from cached mark price / balance , entry and stoploss are sent in one batch order
         '''
-        binance_api = getbinancemethod(API_KEY,API_SECRET)
+        binance_api = self.get_api()
+        binance_api.prepare(self.symbol)
         position = action['position']
         stoploss = action['stoploss']
         method = action['method']
         if method == 'open':
+            mark = binance_api.get_future_mark_price(self.symbol)
             if position == 'long':
-                mark = binance_api.get_future_mark_price(self.symbol)
                 lossrate = (mark-stoploss)/mark
-                margin = (binance_api.get_total_money('BUSD')*self.ratio)/(lossrate)
-                binance_api.future_buy(self.symbol,binance_api.get_future_purchase_quantity(self.symbol,margin))
-                binance_api.setstoploss(position,self.symbol,stoploss)
             else:
-                mark = binance_api.get_future_mark_price(self.symbol)
                 lossrate = (stoploss-mark)/mark
-                margin = (binance_api.get_total_money('BUSD')*self.ratio)/(lossrate)
-                binance_api.future_sell(self.symbol,binance_api.get_future_purchase_quantity(self.symbol,margin))
-                binance_api.setstoploss(position,self.symbol,stoploss)
+            margin = (binance_api.get_total_money('BUSD')*self.ratio)/(lossrate)
+            binance_api.open_position(position,self.symbol,binance_api.get_future_purchase_quantity(self.symbol,margin),stoploss)
         elif method == 'close':
-            if position == 'short':
-                binance_api.future_buy(self.symbol,binance_api.get_future_hold(self.symbol))
-            else:
-                binance_api.future_sell(self.symbol,binance_api.get_future_hold(self.symbol))
-    def histroy_mode(self):
+            binance_api.close_position(position,self.symbol)
+    def histroy_mode(self,balance=1000.0):
         '''
         history mode:
-            data_short (dict) : get data for short period
-            data_long (dict) : get data for long period
-            data_dict (dicc) : save data from strategy
+            data_short (CandleData) : get data for short period ( from BUS , scripts of the same symbol share one download )
+            data_long (CandleData) : get data for long period
+            actions (list) : every action of strategy
+            result (dict) : backtest of actions ( equity , drawdown , trades )
         '''
         if self.short != None:
-            data_short = Symbol_data(self.symbol,self.short)
+            data_short = BUS.candles(self.symbol,self.short)
         else:
             data_short = {}
-        if self.long != None:
-            data_long = Symbol_data(self.symbol,self.long)
+        if self.long != None and self.resample and len(data_short) > 0:
+            data_long = resample(data_short,self.long,self.short)
+        elif self.long != None:
+            data_long = BUS.candles(self.symbol,self.long)
         else:
             data_long = {}
-        data_dict = {}
-        self.strategy(data_short,data_long,data_dict)
-    def real_mode(self):
+        with METRICS.span('history_strategy'):
+            actions = collect_actions(self.strategy,data_short,data_long,self.short,self.long)
+        result = backtest(data_short,actions,self.ratio,balance,timesetup=self.short)
+        summary(result,balance)
+        return result
+    def real_mode(self,grace=1.0,stream=True,report=600,metrics_port=None):
         '''
         real mode:
-            data_short (dict) : get data for short period
-            data_long (dict) : get data for long period
+            data_short (CandleData) : get data for short period
+            data_long (CandleData) : get data for long period
             data_dict (dicc) : save data from strategy
+        Notice:
+            data is kept in the binary cache (./history/<symbol>-<tf>.bin)
+            stream == True : closed bars come from the kline websocket ( KlineStream ) , on_bar runs the strategy
+            stream == False : BarScheduler calls on_close grace seconds after every short bar closes
+                              and only the klines after the last stored bar are downloaded
+            mark price , positions and balances come from websockets ( MarketState )
+            latency of every stage is printed every report seconds ,
+            metrics_port (int) : also serve it as prometheus text on http://127.0.0.1:<metrics_port>/metrics
         '''
-        if self.short != None:
-            data_short = Symbol_data(self.symbol,self.short)
-        else:
-            data_short = {}
-        if self.long != None:
-            data_long = Symbol_data(self.symbol,self.long)
+        import asyncio
+        from market_state import MarketState
+        from scheduler import BarScheduler
+        METRICS.report_every(report)
+        if metrics_port != None:
+            METRICS.serve(metrics_port)
+        MarketState(self.get_session(),[self.symbol]).start()
+        self.start_live()
+        if stream:
+            asyncio.run(self.run_streams())
         else:
-            data_long = {}
+            scheduler = BarScheduler(grace)
+            scheduler.add(self.symbol,self.short,self.on_close)
+            asyncio.run(scheduler.run())
+    def replay_mode(self,short_candles,long_candles=None,warmup=1,balance=1000.0,**exchange):
+        '''
+        replay mode:
+            recorded candles go through the real mode loop ( on_close , run_strategy , make_action )
+            with a virtual clock and a simulated exchange , no key and no network needed
+            args:
+                short_candles (CandleData) : bars of short period
+                long_candles (CandleData) : bars of long period , only needed when resample is False
+                warmup (int) : bars used as history before the replay
+            return:
+                dict : {'bars','seconds','bars_per_sec','trades','final','wallet','quantity'}
+        '''
+        from replay import Replay
+        result = Replay(self,short_candles,long_candles,warmup,balance,**exchange).run()
+        print('replay bars =',result['bars'],'bars/sec =',round(result['bars_per_sec'],1),
+              'trades =',len(result['trades']),'final =',round(result['final'],4))
+        return result
+    def start_live(self,cache_of=None):
+        '''
+        load caches and run strategy on history ( only the bars after the checkpoint when there is one )
+            cache_of (function) : cache_of(symbol , timesetup) -> CandleCache , to share caches between scripts
+        '''
+        if cache_of == None:
+            client = self.get_session().client
+            cache_of = lambda symbol,timesetup:Symbol_cache(symbol,timesetup,client)
+        self.cache_short = cache_of(self.symbol,self.short)
+        self.data_long = {}
+        self.cache_long = None
+        if self.long != None and self.resample:
+            self.cache_long = ResampledCache(self.cache_short,self.long,self.short)
+            self.data_long = self.cache_long.candles()
+        elif self.long != None:
+            self.cache_long = cache_of(self.symbol,self.long)
+            self.data_long = self.cache_long.candles()
+        candles = self.cache_short.candles()
         data_dict = {}
-        data_dict = self.strategy(data_short,data_long,data_dict)
-        while True:
-            data_short_last = list(data_short.keys())[-1]
-            self.wait_timing(data_short_last,self.short,'short')
-            print('執行時間=',datetime.datetime.now())
-            '''
-            get long data
-            '''
-            if data_long != {}:
-                data_long_last = list(data_long.keys())[-1]
-                check_long = self.wait_timing(data_long_last,self.long,'long')
-                if check_long == True:
-                    newdata_long = Symbol_data(self.symbol,self.long)
-                    while len(newdata_long) <= len(data_long):
-                        newdata_long = Symbol_data(self.symbol,self.long)
-                        time.sleep(5)
-                    data_long = newdata_long
-            '''
-            get short data
-            '''
-            newdata_short = Symbol_data(self.symbol,self.short)
-            while len(newdata_short) <= len(data_short):
-                newdata_short = Symbol_data(self.symbol,self.short)
-                time.sleep(5)
-            data_short = newdata_short
-            data_dict = self.strategy(data_short,data_long,data_dict)
-            '''
-            Action after strategy
-                data_dict['action'] :
-                    stoploss (float) 
-                    position (str) : 'long' 'short'
-                    method (str) : 'close' 'open'
-            '''
-            if data_dict['action'] != {}:
-                self.make_action(data_dict['action'])
-            
-
-
-
-
-
-
-
-data = script('BNBBUSD','1d',None,0.025,strategy)
-data.histroy_mode()
-
+        self.checkpointer = None
+        if self.checkpoint:
+            name = getattr(self.strategy,'__name__',getattr(getattr(self.strategy,'func',None),'__name__','strategy'))
+            self.checkpointer = Checkpoint(self.symbol,self.short,name)
+            data_dict = self.checkpointer.resume(candles)
+        self.data_dict = self.strategy(candles,self.data_long,data_dict)
+        if self.checkpointer != None:
+            self.checkpointer.save(self.data_dict,candles)
+    def wait_bar(self,cache,close_time):
+        '''
+        update cache until the bar closed at close_time (epoch seconds) is stored
+        '''
+        session = self.get_session()
+        while cache.last_close_time < close_time*1000-1:
+            if cache.update(session.client,scheduler=session.scheduler) == 0:
+                time.sleep(0.5)
+    def on_close(self,symbol,timesetup,close_time):
+        '''
+        called by BarScheduler when a short bar closes
+            close_time (int) : epoch seconds
+        '''
+        from scheduler import next_close
+        '''
+        get short data
+        '''
+        self.wait_bar(self.cache_short,close_time)
+        '''
+        get long data
+        '''
+        if self.cache_long != None and self.resample:
+            self.cache_long.update()
+        elif self.cache_long != None and next_close(close_time-1,self.long) == close_time:
+            self.wait_bar(self.cache_long,close_time)
+            self.data_long = self.cache_long.candles()
+        self.run_strategy(close_time)
+    async def run_streams(self):
+        '''
+        kline streams of short / long period , every closed short bar calls on_bar
+        '''
+        import asyncio
+        from kline_stream import KlineStream
+        client = self.get_session().client
+        self.short_stream = KlineStream(self.symbol,self.short,self.cache_short,self.on_bar,client)
+        self.long_stream = None
+        tasks = [self.short_stream.run()]
+        if self.cache_long != None and not self.resample:
+            self.long_stream = KlineStream(self.symbol,self.long,self.cache_long,None,client)
+            tasks.append(self.long_stream.run())
+        await asyncio.gather(*tasks)
+    async def on_bar(self,symbol,timesetup,kline):
+        '''
+        called by KlineStream when a short bar closes
+            kline (list) : [open_time , open , high , low , close , volume , close_time] ( ms )
+        '''
+        import asyncio
+        from scheduler import next_close
+        close_time = (kline[6]+1)//1000
+        if self.cache_long != None and self.resample:
+            self.cache_long.update()
+        elif self.long_stream != None and next_close(close_time-1,self.long) == close_time:
+            await self.long_stream.wait_closed(close_time)
+            self.data_long = self.cache_long.candles()
+        if JOURNAL.enabled(DEBUG):
+            JOURNAL.debug('lag',symbol=symbol,**self.short_stream.lag.summary())
+        await asyncio.get_running_loop().run_in_executor(None,self.run_strategy,close_time)
+    def run_strategy(self,close_time=None):
+        '''
+        run strategy on new short bars and make action
+            close_time (int) : epoch seconds of the bar close , time from close to order is kept as 'bar_to_order'
+        '''
+        candles = self.cache_short.candles()
+        JOURNAL.info('bar',symbol=self.symbol,timesetup=self.short,close_time=close_time,bars=len(candles))
+        with self.stage:
+            self.data_dict = self.strategy(candles,self.data_long,self.data_dict)
+        if self.checkpointer != None:
+            self.checkpointer.save(self.data_dict,candles)
+        '''
+        Action after strategy
+            data_dict['action'] :
+                stoploss (float) 
+                position (str) : 'long' 'short'
+                method (str) : 'close' 'open'
+        '''
+        if self.data_dict['action'] != {}:
+            JOURNAL.info('action',symbol=self.symbol,**self.data_dict['action'])
+            self.make_action(self.data_dict['action'])
+            if close_time != None:
+                METRICS.observe('bar_to_order',time.time()-close_time)
 
-    
-    
-    
+def load_strategy(name,params=None):
+    '''
+    strategy function by name
+        args:
+            name (str) : function of strategy_method ( 'strategy' ) or 'module:function'
+            params (dict) : arguments given with functools.partial
+        return:
+            function
+    '''
+    module = 'strategy_method'
+    if ':' in name:
+        module,name = name.split(':',1)
+    function = getattr(importlib.import_module(module),name)
+    if params:
+        return functools.partial(function,**params)
+    return function
+def parse_params(items):
+    '''
+    ['verbose=false' , 'history=100'] -> {'verbose':False , 'history':100} , values are json or plain strings
+    '''
+    params = {}
+    for item in items or []:
+        key,value = item.split('=',1)
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+def _period(value):
+    if value in (None,'','none','None'):
+        return None
+    return value
+def command_history(args):
+    for name in args.strategy:
+        print('strategy =',name)
+        data = script(args.symbol,args.short,args.long,args.ratio,load_strategy(name,args.params),not args.download_long)
+        data.histroy_mode(args.balance)
+def command_backtest(args):
+    short_candles = BUS.candles(args.symbol,args.short)
+    long_candles = None
+    if args.long != None and args.download_long:
+        long_candles = BUS.candles(args.symbol,args.long)
+    for name in args.strategy:
+        print('strategy =',name)
+        data = script(args.symbol,args.short,args.long,args.ratio,load_strategy(name,args.params),not args.download_long)
+        data.replay_mode(short_candles,long_candles,args.warmup,args.balance)
+def command_live(args):
+    scripts = [script(symbol,args.short,args.long,args.ratio,load_strategy(name,args.params),not args.download_long)
+               for symbol in args.symbol for name in args.strategy]
+    if len(scripts) == 1:
+        scripts[0].real_mode(args.grace,not args.poll,args.report,args.metrics_port)
+        return
+    from orchestrator import Orchestrator
+    orchestrator = Orchestrator(ExchangeSession(*ReadKeySecret()),report=args.report,metrics_port=args.metrics_port)
+    for item in scripts:
+        orchestrator.add(item)
+    orchestrator.run()
+def command_sweep(args):
+    from sweep import run_sweep, print_table
+    strategies = [(load_strategy(name),args.params) for name in args.strategy]
+    results = run_sweep(args.symbol,args.short,[_period(p) for p in args.long],args.ratio,strategies,args.balance,args.processes)
+    print_table(results,args.top)
+def build_parser():
+    parser = argparse.ArgumentParser(prog='main.py',description='binance futures trading scripts')
+    commands = parser.add_subparsers(dest='command')
+    def common(command,many=False):
+        if many:
+            command.add_argument('symbol',nargs='*',default=['BNBBUSD'])
+        else:
+            command.add_argument('symbol',nargs='?',default='BNBBUSD')
+        command.add_argument('--short',default='1d',help="short period '1m' , '5m' , '1h' ...")
+        command.add_argument('--long',type=_period,default=None,help="long period '1h' , '4h' , '1d'")
+        command.add_argument('--ratio',type=float,default=0.025,help='money risked on each trade')
+        command.add_argument('--strategy',nargs='+',default=['strategy'],
+                             help="functions of strategy_method or 'module:function' , every strategy reads the same bars")
+        command.add_argument('--param',dest='params',action='append',help='strategy argument key=value')
+        command.add_argument('--download-long',action='store_true',help='download the long period instead of resampling')
+    history = commands.add_parser('history',help='run strategy on history and backtest the actions')
+    common(history)
+    history.add_argument('--balance',type=float,default=1000.0)
+    replay = commands.add_parser('backtest',help='replay history through the real mode loop on a simulated exchange')
+    common(replay)
+    replay.add_argument('--balance',type=float,default=1000.0)
+    replay.add_argument('--warmup',type=int,default=1,help='bars used as history before the replay')
+    live = commands.add_parser('live',help='trade on binance ( one or more symbols )')
+    common(live,many=True)
+    live.add_argument('--poll',action='store_true',help='download bars after every close instead of the kline websocket')
+    live.add_argument('--grace',type=float,default=1.0,help='seconds after bar close before polling')
+    live.add_argument('--report',type=float,default=600,help='seconds between latency summaries')
+    live.add_argument('--metrics-port',type=int,default=None,help='serve prometheus metrics on this port')
+    grid = commands.add_parser('sweep',help='backtest a grid of symbols , periods , ratios and strategies on all cores')
+    grid.add_argument('--symbol',nargs='+',default=['BNBBUSD'])
+    grid.add_argument('--short',nargs='+',default=['1d'])
+    grid.add_argument('--long',nargs='+',default=[None])
+    grid.add_argument('--ratio',nargs='+',type=float,default=[0.025])
+    grid.add_argument('--strategy',nargs='+',default=['strategy'])
+    grid.add_argument('--param',dest='params',action='append',help='strategy argument key=value')
+    grid.add_argument('--balance',type=float,default=1000.0)
+    grid.add_argument('--processes',type=int,default=None)
+    grid.add_argument('--top',type=int,default=20)
+    for command in (history,replay,live,grid):
+        command.add_argument('--journal',default=None,help='folder of the event journal ( default ./journal )')
+        command.add_argument('--journal-level',default=None,choices=sorted(LEVELS),help='lowest level written to the journal')
+        command.add_argument('--sample',action='append',help='keep one of every N events of a kind , kind=N ( trend=100 )')
+    return parser
+COMMANDS = {'history':command_history,'backtest':command_backtest,'live':command_live,'sweep':command_sweep}
+def main(argv=None):
+    '''
+    python3 main.py history BNBBUSD --short 1d
+    python3 main.py backtest BNBBUSD --short 5m --long 1h --param verbose=false
+    python3 main.py live BNBBUSD BTCBUSD --short 5m --long 1h
+    python3 main.py sweep --symbol BNBBUSD BTCBUSD --short 5m 1h --long none 1d --ratio 0.01 0.025
+    no command runs history of BNBBUSD 1d like before
+    '''
+    parser = build_parser()
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) == 0:
+        argv = ['history']
+    args = parser.parse_args(argv)
+    args.params = parse_params(args.params)
+    JOURNAL.configure(args.journal,args.journal_level,{k:int(v) for k,v in parse_params(args.sample).items()} if args.sample else None)
+    COMMANDS[args.command](args)
+if __name__ == '__main__':
+    main()
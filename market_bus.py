@@ -0,0 +1,273 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from candle_store import CandleData, interval_seconds
+from journal import JOURNAL
+
+
+
+MAX_PENDING = 1
+POLICIES = ('coalesce','block')
+MODES = ('inline','thread','async')
+COLUMNS = ('_time','_open','_high','_low','_close','_up')
+
+def readonly(data,stop=None):
+    '''
+    CandleData view of bars 0 .. stop-1 , arrays are not copied and can not be written
+    '''
+    if stop is None:
+        stop = len(data)
+    view = CandleData.view(data,0,stop)
+    for name in COLUMNS:
+        getattr(view,name).flags.writeable = False
+    return view
+class Series:
+    '''
+    one read-only candle series of (symbol , timesetup)
+        args:
+            source (CandleData or CandleCache) : CandleData is owned by the bus ( append ) ,
+                                                 CandleCache is written by its KlineStream / update
+        Method:
+            view : read-only CandleData of the first stop bars ( zero-copy )
+            kline : binance kline list of bar i , for callbacks written for KlineStream
+    '''
+    def __init__(self,symbol,timesetup,source):
+        self.symbol = symbol
+        self.timesetup = timesetup
+        self.source = source
+        self.sec = interval_seconds(timesetup)
+        self.data = None
+        self.count = None
+    def candles(self):
+        '''
+        CandleData of the source , wrapped again only when the cache has new bars ( shared by every subscriber )
+        '''
+        if isinstance(self.source,CandleData):
+            return self.source
+        count = len(self.source)
+        if count != self.count:
+            self.data = self.source.candles()
+            self.count = count
+        return self.data
+    def __len__(self):
+        return len(self.source)
+    def view(self,stop=None):
+        return readonly(self.candles(),stop)
+    def kline(self,i=-1):
+        data = self.candles()
+        t = int(data.time[i])
+        return [t*1000,float(data.open[i]),float(data.high[i]),float(data.low[i]),float(data.close[i]),0.0,(t+self.sec)*1000-1]
+class Subscription:
+    '''
+    one consumer of a Series , callback(symbol , timesetup , data) gets a read-only view of every closed bar up to the new one
+        args:
+            max_pending (int) : notifications waiting for the consumer
+            policy (str) :
+                'coalesce' : when max_pending are waiting the newest one is replaced , the consumer gets the new bars
+                             in its next call ( views hold every bar , nothing is lost but calls )
+                'block' : publish waits until the consumer takes one ( thread mode only )
+            mode (str) :
+                'inline' : callback runs inside publish
+                'thread' : callback runs in a worker thread of the subscription
+                'async' : callback is a coroutine , run by a task of the event loop of the first publish
+        Get:
+            delivered , coalesced (int) , blocked (float) : seconds publish waited
+    '''
+    def __init__(self,series,callback,max_pending=MAX_PENDING,policy='coalesce',mode=None):
+        if mode == None:
+            mode = 'async' if asyncio.iscoroutinefunction(callback) else 'thread'
+        if policy not in POLICIES or mode not in MODES:
+            raise ValueError('policy '+str(policy)+' mode '+str(mode))
+        if policy == 'block' and mode == 'async':
+            raise ValueError('block policy needs thread mode')
+        self.series = series
+        self.callback = callback
+        self.max_pending = max(1,max_pending)
+        self.policy = policy
+        self.mode = mode
+        self.pending = deque()
+        self.running = True
+        self.delivered = 0
+        self.taken = 0
+        self.coalesced = 0
+        self.blocked = 0.0
+        self.cond = threading.Condition()
+        self.worker = None
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+        if mode == 'thread':
+            self.worker = threading.Thread(target=self._run,name='bus-'+series.symbol+'-'+series.timesetup,daemon=True)
+            self.worker.start()
+    def offer(self,stop):
+        '''
+        notify that the series has stop closed bars
+        '''
+        if not self.running:
+            return
+        if self.mode == 'inline':
+            self._call(stop)
+        elif self.mode == 'thread':
+            with self.cond:
+                if len(self.pending) >= self.max_pending and self.policy == 'block':
+                    start = time.perf_counter()
+                    while len(self.pending) >= self.max_pending and self.running:
+                        self.cond.wait()
+                    self.blocked += time.perf_counter()-start
+                self._push(stop)
+                self.cond.notify_all()
+        else:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if self.loop == None and loop != None:
+                self.loop = loop
+                self.wakeup = asyncio.Event()
+                self.task = loop.create_task(self._consume())
+            if self.loop == None:
+                raise RuntimeError('async subscription needs a running event loop')
+            if loop is self.loop:
+                self._push(stop)
+                self.wakeup.set()
+            else:
+                self.loop.call_soon_threadsafe(self.offer,stop)
+    def _push(self,stop):
+        if len(self.pending) >= self.max_pending:
+            self.pending[-1] = stop
+            self.coalesced += 1
+        else:
+            self.pending.append(stop)
+    def _call(self,stop):
+        try:
+            self.callback(self.series.symbol,self.series.timesetup,self.series.view(stop))
+        except Exception as e:
+            JOURNAL.error('error',source='market_bus',symbol=self.series.symbol,timesetup=self.series.timesetup,error=repr(e))
+        self.delivered += 1
+    def _run(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0 and self.running:
+                    self.cond.wait()
+                if len(self.pending) == 0:
+                    return
+                stop = self.pending.popleft()
+                self.taken += 1
+                self.cond.notify_all()
+            self._call(stop)
+    async def _consume(self):
+        while self.running:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while len(self.pending) > 0 and self.running:
+                stop = self.pending.popleft()
+                try:
+                    await self.callback(self.series.symbol,self.series.timesetup,self.series.view(stop))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    JOURNAL.error('error',source='market_bus',symbol=self.series.symbol,timesetup=self.series.timesetup,error=repr(e))
+                self.delivered += 1
+    def drain(self,timeout=None):
+        '''
+        wait until every notification is delivered ( thread mode )
+        '''
+        deadline = None if timeout == None else time.time()+timeout
+        while len(self.pending) > 0 or self.delivered < self.taken:
+            if deadline != None and time.time() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+    def close(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.task != None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+    def stats(self):
+        return {'pending':len(self.pending),'delivered':self.delivered,'coalesced':self.coalesced,'blocked':self.blocked}
+class MarketBus:
+    '''
+    In-process market data bus , one read-only series for each (symbol , timesetup) shared by every consumer
+        Method:
+            series : Series of the key , loaded once with loader ( default Symbol_data )
+            candles : read-only CandleData of the key ( zero-copy )
+            attach : use a CandleData or CandleCache as the series of the key
+            append : add one closed bar to a series owned by the bus and publish it
+            subscribe : callback for new closed bars , with its own backpressure ( Subscription )
+            publish : tell every subscriber of the key that new bars are stored
+            stats : {'<symbol>-<timesetup>.delivered':number ....} , for METRICS.source
+    Notice:
+        scripts / backtests / metrics of the same key read the same arrays , adding a consumer adds no download and no copy
+    '''
+    def __init__(self,loader=None):
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.keys = {}
+        self.loading = {}
+        self.subscriptions = {}
+    def series(self,symbol,timesetup):
+        key = (symbol,timesetup)
+        series = self.keys.get(key)
+        if series != None:
+            return series
+        with self.lock:
+            lock = self.loading.setdefault(key,threading.Lock())
+        with lock:
+            if key not in self.keys:
+                loader = self.loader
+                if loader == None:
+                    from binance_api import Symbol_data
+                    loader = Symbol_data
+                self.attach(symbol,timesetup,loader(symbol,timesetup))
+        return self.keys[key]
+    def candles(self,symbol,timesetup):
+        return self.series(symbol,timesetup).view()
+    def attach(self,symbol,timesetup,source):
+        series = Series(symbol,timesetup,source)
+        with self.lock:
+            self.keys[(symbol,timesetup)] = series
+            self.subscriptions.setdefault((symbol,timesetup),[])
+        return series
+    def append(self,symbol,timesetup,time,open,high,low,close):
+        '''
+        add one closed bar ( series owned by the bus ) and publish it
+        '''
+        series = self.keys[(symbol,timesetup)]
+        series.source.append(time,open,high,low,close)
+        self.publish(symbol,timesetup)
+    def subscribe(self,symbol,timesetup,callback,max_pending=MAX_PENDING,policy='coalesce',mode=None):
+        '''
+        args:
+            callback (function) : callback(symbol , timesetup , data) , data is read-only CandleData , coroutine for async mode
+        return:
+            Subscription
+        '''
+        subscription = Subscription(self.series(symbol,timesetup),callback,max_pending,policy,mode)
+        with self.lock:
+            self.subscriptions[(symbol,timesetup)] = self.subscriptions[(symbol,timesetup)]+[subscription]
+        return subscription
+    def unsubscribe(self,subscription):
+        key = (subscription.series.symbol,subscription.series.timesetup)
+        with self.lock:
+            self.subscriptions[key] = [s for s in self.subscriptions[key] if s is not subscription]
+        subscription.close()
+    def publish(self,symbol,timesetup):
+        key = (symbol,timesetup)
+        stop = len(self.keys[key])
+        for subscription in self.subscriptions.get(key,()):
+            subscription.offer(stop)
+    def stats(self):
+        values = {}
+        for (symbol,timesetup),subscriptions in list(self.subscriptions.items()):
+            name = symbol+'-'+timesetup
+            values[name+'.subscribers'] = len(subscriptions)
+            for field in ('delivered','coalesced'):
+                values[name+'.'+field] = sum(getattr(s,field) for s in subscriptions)
+        return values
+    def close(self):
+        for subscriptions in list(self.subscriptions.values()):
+            for subscription in subscriptions:
+                subscription.close()
+BUS = MarketBus()
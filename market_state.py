@@ -0,0 +1,256 @@
+import json
+import time
+import asyncio
+import functools
+import threading
+import websockets
+from journal import JOURNAL
+
+
+
+WS_URL = 'wss://fstream.binance.com'
+KEEPALIVE = 30*60
+STALE = 10
+
+class MarketState:
+    '''
+    Local market / account state kept fresh by binance futures websockets
+        streams:
+            <symbol>@markPrice@1s : session.mark_prices
+            user data stream ( ACCOUNT_UPDATE , ORDER_TRADE_UPDATE ) : session.positions , session.assets , session.open_orders
+        Method:
+            start : run the streams in a background thread
+            stop : close the streams
+            handle : apply one stream message ( also used for tests and replay )
+        args:
+            stale (float) : seconds without a message , the mark price stream is opened again ,
+                            the user data stream ( silent when nothing happens ) is pinged
+    Notice:
+        ws_url can point to a local websocket server ( StreamServer.url ) to test without binance
+        after every reconnect the account and the open orders are downloaded again so nothing is missed
+        REST calls ( listen key , account , keepalive ) run in an executor , they do not stop the other streams
+        availableBalance = crossWalletBalance - initial margin of the positions of the asset , updated by ACCOUNT_UPDATE
+    '''
+    def __init__(self,session,symbols,ws_url=WS_URL,user_stream=True,stale=STALE):
+        self.session = session
+        self.symbols = [s.lower() for s in symbols]
+        self.ws_url = ws_url
+        self.user_stream = user_stream
+        self.stale = stale
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.running = False
+    def start(self,timeout=10):
+        '''
+        start streams , wait until the first snapshot is ready
+        '''
+        self.running = True
+        self.thread = threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+        self.ready.wait(timeout)
+        return self
+    def stop(self):
+        self.running = False
+        self.session.live = False
+        if self.loop != None:
+            self.loop.call_soon_threadsafe(self._cancel)
+        if self.thread != None:
+            self.thread.join(5)
+    def _cancel(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._main())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+    async def _main(self):
+        tasks = []
+        if len(self.symbols) > 0:
+            streams = '/'.join(s+'@markPrice@1s' for s in self.symbols)
+            tasks.append(self._stream(self.ws_url+'/stream?streams='+streams,None))
+        if self.user_stream:
+            tasks.append(self._user())
+        else:
+            self.session.live = True
+            self.ready.set()
+        await asyncio.gather(*tasks)
+    async def _blocking(self,function,*args,**kwargs):
+        '''
+        run a blocking REST call in the default executor
+        '''
+        return await asyncio.get_running_loop().run_in_executor(None,functools.partial(function,*args,**kwargs))
+    async def _user(self):
+        while self.running:
+            try:
+                listen_key = await self._blocking(self.session.scheduler.call,self.session.client.futures_stream_get_listen_key)
+                await self._stream(self.ws_url+'/ws/'+listen_key,listen_key,once=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                JOURNAL.error('error',source='user_stream',error=str(e))
+            self.session.live = False
+            await asyncio.sleep(1)
+    async def _stream(self,url,listen_key,once=False):
+        wait = 1
+        while self.running:
+            try:
+                async with websockets.connect(url) as ws:
+                    wait = 1
+                    if listen_key != None:
+                        # orders placed before a restart / while disconnected ( old stops ) must be known to be cancelled
+                        await self._blocking(self.session.refresh_account)
+                        await self._blocking(self.session.refresh_open_orders)
+                        self.session.live = True
+                        self.ready.set()
+                    last_keepalive = time.time()
+                    while self.running:
+                        try:
+                            message = await asyncio.wait_for(ws.recv(),self.stale)
+                        except asyncio.TimeoutError:
+                            if listen_key == None:
+                                raise ConnectionError('no message for '+str(self.stale)+' seconds')
+                            pong = await ws.ping()
+                            await asyncio.wait_for(pong,self.stale)
+                            message = None
+                        if message != None and self.handle(json.loads(message)) == 'expired':
+                            break
+                        if listen_key != None and time.time()-last_keepalive > KEEPALIVE:
+                            await self._blocking(self.session.scheduler.call,self.session.client.futures_stream_keepalive,listenKey=listen_key)
+                            last_keepalive = time.time()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                JOURNAL.error('error',source='websocket',url=url,error=str(e))
+            if once:
+                return
+            await asyncio.sleep(wait)
+            wait = min(wait*2,30)
+    def handle(self,message):
+        '''
+        apply one websocket message to session
+            args:
+                message (dict)
+        '''
+        if 'stream' in message:
+            message = message['data']
+        event = message.get('e')
+        if event == 'markPriceUpdate':
+            self.session.mark_prices[message['s']] = float(message['p'])
+        elif event == 'ACCOUNT_UPDATE':
+            self._account(message['a'])
+        elif event == 'ORDER_TRADE_UPDATE':
+            self._order(message['o'])
+        elif event == 'listenKeyExpired':
+            return 'expired'
+    def _account(self,update):
+        changed = set()
+        for p in update.get('P',[]):
+            position = self.session.positions.setdefault(p['s'],{'symbol':p['s'],'leverage':'1','maxNotional':'0'})
+            position['positionAmt'] = p['pa']
+            position['entryPrice'] = p['ep']
+            position['unrealizedProfit'] = p['up']
+            leverage = float(position.get('leverage') or 1)
+            position['initialMargin'] = str(abs(float(p['pa']))*float(p['ep'])/leverage)
+            changed.update(name for name in self.session.assets if p['s'].endswith(name))
+        for b in update.get('B',[]):
+            asset = self.session.assets.setdefault(b['a'],{'asset':b['a'],'walletBalance':'0','crossWalletBalance':'0','availableBalance':'0'})
+            asset['walletBalance'] = b['wb']
+            asset['crossWalletBalance'] = b['cw']
+            changed.add(b['a'])
+        for name in changed:
+            self._available(name)
+    def _available(self,name):
+        '''
+        free balance of asset name : cross wallet balance - initial margin of the positions margined in it
+        '''
+        asset = self.session.assets[name]
+        margin = sum(float(p.get('initialMargin') or 0) for symbol,p in self.session.positions.items() if symbol.endswith(name))
+        asset['availableBalance'] = str(float(asset['crossWalletBalance'])-margin)
+    def _order(self,order):
+        orders = self.session.open_orders.setdefault(order['s'],{})
+        if order.get('x') == 'TRADE':
+            JOURNAL.info('fill',symbol=order['s'],orderId=order['i'],side=order['S'],type=order['o'],price=float(order.get('L',0)),
+                         quantity=float(order.get('l',0)),status=order['X'])
+        if order['X'] in ('NEW','PARTIALLY_FILLED'):
+            orders[order['i']] = {'orderId':order['i'],'clientOrderId':order['c'],'side':order['S'],'type':order['o'],
+                                  'quantity':float(order['q']),'stopPrice':float(order['sp']),'status':order['X']}
+        else:
+            orders.pop(order['i'],None)
+class StreamServer:
+    '''
+    Local websocket stand-in of the binance futures streams for tests
+        Method:
+            start / stop
+            send : send message (dict) to the clients of path ( '/stream' , '/ws/<listen key>' ) , every client when path is None
+        Get:
+            url : ws_url for MarketState
+            connections : {path:number of connections opened}
+    Notice:
+        a path nothing is sent to is a silent socket , MarketState has to find it by itself
+    '''
+    def __init__(self,host='127.0.0.1',port=0):
+        self.host = host
+        self.port = port
+        self.clients = set()
+        self.connections = {}
+        self.loop = None
+        self.server = None
+        self.thread = None
+    @property
+    def url(self):
+        return 'ws://'+self.host+':'+str(self.port)
+    async def _handler(self,ws,path=None):
+        if path == None:
+            path = ws.request.path
+        path = path.split('?')[0]
+        self.connections[path] = self.connections.get(path,0)+1
+        client = (path,ws)
+        self.clients.add(client)
+        try:
+            await ws.wait_closed()
+        finally:
+            self.clients.discard(client)
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        async def open():
+            return await websockets.serve(self._handler,self.host,self.port)
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(open())
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+        self.thread = threading.Thread(target=run,daemon=True)
+        self.thread.start()
+        ready.wait(5)
+        return self
+    async def _send(self,path,text):
+        sent = 0
+        for client,ws in list(self.clients):
+            if path == None or client == path:
+                await ws.send(text)
+                sent += 1
+        return sent
+    def send(self,message,path=None):
+        '''
+        return:
+            int : clients the message was sent to
+        '''
+        return asyncio.run_coroutine_threadsafe(self._send(path,json.dumps(message)),self.loop).result(5)
+    def stop(self):
+        async def close():
+            self.server.close()
+            try:
+                await asyncio.wait_for(self.server.wait_closed(),2)
+            except asyncio.TimeoutError:
+                pass
+        if self.loop != None:
+            asyncio.run_coroutine_threadsafe(close(),self.loop).result(5)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(5)
@@ -0,0 +1,271 @@
+import time
+import threading
+import numpy as np
+from journal import JOURNAL
+
+
+
+SUB_BITS = 5
+SUB = 1<<SUB_BITS
+BUCKETS = 64*SUB
+FOLD = 4096
+QUANTILES = (0.5,0.9,0.99)
+PREFIX = 'binance_trading'
+_now = time.perf_counter_ns
+
+def bucket_index(value):
+    '''
+    log-linear bucket of value ( HDR style , relative error below 1/32 )
+        args:
+            value (int) : nanoseconds
+        return:
+            int
+    '''
+    shift = value.bit_length()-SUB_BITS-1
+    if shift <= 0:
+        return value
+    return (shift<<SUB_BITS)+(value>>shift)
+def bucket_value(index):
+    '''
+    highest value of bucket index
+    '''
+    shift = (index>>SUB_BITS)-1
+    if shift <= 0:
+        return index
+    return ((index-(shift<<SUB_BITS)+1)<<shift)-1
+class Histogram:
+    '''
+    latency histogram in nanoseconds , fixed log-linear buckets
+        Method:
+            record : add one value ( only a list append , values are folded into buckets every FOLD values )
+            since : record perf_counter_ns() - start
+            percentile : value at percentile ( 0.99 ) , error below 1/32
+            summary : {'count','mean','p50','p90','p99','max'} in seconds
+        Notice:
+            writers never take the lock , fold reads the first n pending values and deletes only those n
+            ( list append / slice delete are atomic ) , values added while folding stay for the next fold
+    '''
+    __slots__ = ('pending','counts','count','total','max','lock')
+    def __init__(self):
+        self.pending = []
+        self.counts = np.zeros(BUCKETS,dtype='int64')
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+    def record(self,value):
+        pending = self.pending
+        pending.append(value)
+        if len(pending) >= FOLD:
+            self.fold()
+    def since(self,start):
+        pending = self.pending
+        pending.append(_now()-start)
+        if len(pending) >= FOLD:
+            self.fold()
+    def fold(self):
+        '''
+        move pending values into the buckets ( vectorized bucket_index )
+        '''
+        with self.lock:
+            pending = self.pending
+            n = len(pending)
+            if n == 0:
+                return
+            values = np.maximum(np.asarray(pending[:n],dtype='int64'),0)
+            del pending[:n]
+            shift = np.maximum(np.frexp(values)[1]-SUB_BITS-1,0)
+            index = np.minimum((shift<<SUB_BITS)+(values>>shift),BUCKETS-1)
+            self.counts += np.bincount(index,minlength=BUCKETS)
+            self.count += len(values)
+            self.total += int(values.sum())
+            self.max = max(self.max,int(values.max()))
+    def percentile(self,q):
+        self.fold()
+        if self.count == 0:
+            return 0
+        target = max(1,int(q*self.count+0.5))
+        index = int(np.searchsorted(np.cumsum(self.counts),target))
+        return min(bucket_value(index),self.max)
+    def summary(self):
+        self.fold()
+        if self.count == 0:
+            return {'count':0,'mean':None,'p50':None,'p90':None,'p99':None,'max':None}
+        result = {'count':self.count,'mean':self.total/self.count/1e9}
+        for q in QUANTILES:
+            result['p'+str(int(q*100))] = self.percentile(q)/1e9
+        result['max'] = self.max/1e9
+        return result
+class Span:
+    '''
+    with METRICS.span('strategy'): .... , records the time of the block
+    '''
+    __slots__ = ('histogram','start')
+    def __init__(self,histogram):
+        self.histogram = histogram
+    def __enter__(self):
+        self.start = _now()
+        return self
+    def __exit__(self,*args):
+        self.histogram.since(self.start)
+class Stage:
+    '''
+    reusable timer of one stage , made once ( stage = METRICS.stage('strategy') ) then with stage: .... for every call
+    Notice:
+        start is kept on the object , use one Stage for each thread ( or object ) , it is not reentrant
+    '''
+    __slots__ = ('histogram','pending','start')
+    def __init__(self,histogram):
+        self.histogram = histogram
+        self.pending = histogram.pending
+        self.start = 0
+    def __enter__(self):
+        self.start = _now()
+        return self
+    def __exit__(self,*args):
+        pending = self.pending
+        pending.append(_now()-self.start)
+        if len(pending) >= FOLD:
+            self.histogram.fold()
+class Metrics:
+    '''
+    Latency histograms and counters of the trading loop
+        Method:
+            stage : reusable context manager timing one stage , bind it once in hot paths
+            span : context manager timing one stage ( looked up and made on every call )
+            timed : decorator timing every call of a function
+            histogram : Histogram of a stage , h.since(start) after start = time.perf_counter_ns() in the hottest loops
+            observe : add one duration ( seconds ) , for latencies measured elsewhere ( bar close -> order )
+            count : add to a counter
+            source : function returning {name:number} read at report time ( RequestScheduler.stats )
+            summary / print_summary : p50 , p99 , max of every stage
+            report_every : print summary every seconds in a background thread
+            prometheus : prometheus text format
+            serve : http endpoint /metrics with prometheus text
+    Notice:
+        a timed call or a bound stage costs two perf_counter_ns calls and one list append ( below 1 us ) , keep it on in production
+    '''
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.sources = {}
+        self.lock = threading.Lock()
+        self.reporter = None
+        self.server = None
+    def histogram(self,name):
+        histogram = self.histograms.get(name)
+        if histogram == None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name,Histogram())
+        return histogram
+    def stages(self):
+        with self.lock:
+            return sorted(self.histograms.items())
+    def span(self,name):
+        return Span(self.histogram(name))
+    def stage(self,name):
+        return Stage(self.histogram(name))
+    def timed(self,name):
+        def decorator(function):
+            histogram = self.histogram(name)
+            def wrapper(*args,**kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return function(*args,**kwargs)
+                finally:
+                    histogram.since(start)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            wrapper.__wrapped__ = function
+            return wrapper
+        return decorator
+    def observe(self,name,seconds):
+        self.histogram(name).record(int(seconds*1e9))
+    def count(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0)+n
+    def source(self,name,function):
+        self.sources[name] = function
+    def values(self):
+        '''
+        counters and source values
+            return:
+                dict : {'name':number , 'requests.retries':number ....}
+        '''
+        values = dict(self.counters)
+        for name,function in list(self.sources.items()):
+            try:
+                for key,value in function().items():
+                    values[name+'.'+key] = value
+            except Exception as e:
+                JOURNAL.error('error',source='metrics',name=name,error=str(e))
+        return values
+    def summary(self):
+        '''
+        return:
+            dict : {'latency':{stage:{'count','mean','p50','p90','p99','max'}} , 'counters':{name:number}}
+        '''
+        return {'latency':{name:h.summary() for name,h in self.stages()},'counters':self.values()}
+    def print_summary(self):
+        result = self.summary()
+        print('stage','count','p50(ms)','p99(ms)','max(ms)')
+        for name,s in result['latency'].items():
+            if s['count'] > 0:
+                print(name,s['count'],round(s['p50']*1000,3),round(s['p99']*1000,3),round(s['max']*1000,3))
+        for name,value in sorted(result['counters'].items()):
+            print(name,value)
+    def report_every(self,seconds=60,output=None):
+        '''
+        call output ( default print_summary ) every seconds in a daemon thread
+        '''
+        if output == None:
+            output = self.print_summary
+        def loop():
+            while True:
+                time.sleep(seconds)
+                output()
+        self.reporter = threading.Thread(target=loop,daemon=True)
+        self.reporter.start()
+        return self.reporter
+    def prometheus(self):
+        '''
+        prometheus text format , latencies as summaries in seconds , counters as totals
+        '''
+        lines = ['# TYPE '+PREFIX+'_latency_seconds summary']
+        for name,h in self.stages():
+            label = 'stage="'+name+'"'
+            for q in QUANTILES:
+                lines.append(PREFIX+'_latency_seconds{'+label+',quantile="'+str(q)+'"} '+repr(h.percentile(q)/1e9))
+            lines.append(PREFIX+'_latency_seconds_sum{'+label+'} '+repr(h.total/1e9))
+            lines.append(PREFIX+'_latency_seconds_count{'+label+'} '+str(h.count))
+        for name,value in sorted(self.values().items()):
+            metric = PREFIX+'_'+name.replace('.','_').replace('-','_')+'_total'
+            lines.append('# TYPE '+metric+' counter')
+            lines.append(metric+' '+str(value))
+        return '\n'.join(lines)+'\n'
+    def serve(self,port=9108,host='127.0.0.1'):
+        '''
+        serve prometheus text on http://host:port/metrics in a daemon thread
+        '''
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type','text/plain; version=0.0.4')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self,*args):
+                pass
+        self.server = ThreadingHTTPServer((host,port),Handler)
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+        return self.server
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+METRICS = Metrics()
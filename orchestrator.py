@@ -0,0 +1,110 @@
+import asyncio
+from binance_api import Symbol_cache
+from market_state import MarketState
+from kline_stream import KlineStream, KlineFeed
+from metrics import METRICS
+from market_bus import MarketBus
+
+
+
+class Orchestrator:
+    '''
+    Run many scripts ( symbol , timeframes , strategy , ratio ) in one process
+        shared:
+            session (ExchangeSession) : one client , exchange info , account and request budget
+            MarketState : one mark price / user data stream for every symbol
+            KlineFeed : one combined kline websocket , one CandleCache for each (symbol , timesetup)
+            MarketBus : closed bars of every cache fan out to the scripts , each script has its own queue ,
+                        a slow strategy gets the new bars in one call and does not hold the feed or other scripts
+        isolated:
+            every script keeps its own data_dict , data_long and actions
+        Method:
+            add : add a script
+            run : start everything and serve until stop
+            stop
+    Notice:
+        scripts of the same (symbol , short) share one KlineStream and one bus series , every closed bar is sent to each of them
+        usage:
+            orchestrator = Orchestrator(ExchangeSession(*ReadKeySecret()))
+            orchestrator.add(script('BNBBUSD','5m',None,0.025,strategy))
+            orchestrator.add(script('BTCBUSD','1h','1d',0.01,strategy))
+            orchestrator.run()
+    '''
+    def __init__(self,session,ws_url=None,market_ws_url=None,report=600,metrics_port=None):
+        self.session = session
+        self.report = report
+        self.metrics_port = metrics_port
+        self.ws_url = ws_url
+        self.market_ws_url = market_ws_url
+        self.scripts = []
+        self.caches = {}
+        self.streams = {}
+        self.bus = MarketBus()
+        self.feed = None
+        self.market = None
+        self.loop = None
+    def add(self,script):
+        script.session = self.session
+        self.scripts.append(script)
+        return script
+    def cache_of(self,symbol,timesetup):
+        '''
+        one CandleCache for each (symbol , timesetup)
+        '''
+        key = (symbol,timesetup)
+        if key not in self.caches:
+            self.caches[key] = Symbol_cache(symbol,timesetup,self.session.client)
+        return self.caches[key]
+    def stream_of(self,symbol,timesetup):
+        '''
+        one KlineStream for each (symbol , timesetup) , bars are published on the bus
+        '''
+        key = (symbol,timesetup)
+        if key not in self.streams:
+            self.bus.attach(symbol,timesetup,self.cache_of(symbol,timesetup))
+            async def on_bar(symbol,timesetup,kline):
+                self.bus.publish(symbol,timesetup)
+            kwargs = {}
+            if self.ws_url != None:
+                kwargs['ws_url'] = self.ws_url
+            self.streams[key] = KlineStream(symbol,timesetup,self.cache_of(symbol,timesetup),on_bar,self.session.client,**kwargs)
+        return self.streams[key]
+    def prepare(self):
+        '''
+        load history , run strategies once and connect every script to the shared streams
+        '''
+        for script in self.scripts:
+            script.start_live(self.cache_of)
+            script.short_stream = self.stream_of(script.symbol,script.short)
+            series = self.bus.series(script.symbol,script.short)
+            async def on_bar(symbol,timesetup,data,script=script,series=series):
+                await script.on_bar(symbol,timesetup,series.kline(len(data)-1))
+            self.bus.subscribe(script.symbol,script.short,on_bar)
+            script.long_stream = None
+            if script.long != None and not script.resample:
+                script.long_stream = self.stream_of(script.symbol,script.long)
+        kwargs = {}
+        if self.ws_url != None:
+            kwargs['ws_url'] = self.ws_url
+        self.feed = KlineFeed(list(self.streams.values()),**kwargs)
+    def run(self):
+        symbols = sorted(set(script.symbol for script in self.scripts))
+        METRICS.source('bus',self.bus.stats)
+        METRICS.report_every(self.report)
+        if self.metrics_port != None:
+            METRICS.serve(self.metrics_port)
+        kwargs = {}
+        if self.market_ws_url != None:
+            kwargs['ws_url'] = self.market_ws_url
+        self.market = MarketState(self.session,symbols,**kwargs).start()
+        self.prepare()
+        asyncio.run(self._main())
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        await self.feed.run()
+    def stop(self):
+        self.bus.close()
+        if self.market != None:
+            self.market.stop()
+        if self.loop != None:
+            asyncio.run_coroutine_threadsafe(self.feed.stop(),self.loop)
@@ -0,0 +1,335 @@
+import time
+import asyncio
+from candle_store import CandleData, TZ_OFFSET, interval_seconds
+from candle_cache import KLINE_LIMIT
+from backtest import FEE
+from scheduler import BarScheduler
+from journal import JOURNAL
+
+
+
+# one 'bar' event of every BAR_SAMPLE bars goes to the journal , a year of 1m bars is 525600 events otherwise
+BAR_SAMPLE = 1000
+
+class VirtualClock:
+    '''
+    replay time , sleep yields to the event loop once and then jumps forward
+        Method:
+            time : now ( epoch seconds ) , used as clock of BarScheduler / RequestScheduler
+            sleep : coroutine , used as sleep of BarScheduler
+    Notice:
+        the yield lets the bar callbacks started before the sleep finish before time moves on
+    '''
+    def __init__(self,now=0.0):
+        self.now = float(now)
+    def time(self):
+        return self.now
+    async def sleep(self,seconds):
+        await asyncio.sleep(0)
+        self.now += seconds
+class SimExchange:
+    '''
+    Simulated futures account with the methods of getbinancemethod
+        fills:
+            MARKET orders fill at the mark price ( close of the last closed bar ) with fee
+            STOP_MARKET closePosition orders trigger on the next bars low / high , fill at stop ( or open if it gapped )
+        rules:
+            quantity / price are rounded to quantity_precision / price_precision
+            a stop that would trigger at once is rejected like binance ( -2021 )
+        Method:
+            advance : process bars closed up to close_time ( stops , mark price )
+            equity : wallet + unrealized profit
+        Get:
+            trades , fills : history of closed trades / every fill
+    '''
+    def __init__(self,candles,symbol,timesetup,balance=1000.0,fee=FEE,quantity_precision=3,price_precision=2,leverage=20,
+                 max_notional=1000000.0,asset='BUSD'):
+        self.candles = candles
+        self.symbol = symbol
+        self.wallet = float(balance)
+        self.fee = fee
+        self.quantity_precision = quantity_precision
+        self.price_precision = price_precision
+        self.leverage = leverage
+        self.max_notional = max_notional
+        self.asset = asset
+        self.cursor = -1
+        self.mark = None
+        self.quantity = 0.0
+        self.entry = 0.0
+        self.entry_time = None
+        self.stops = {}
+        self.order_id = 0
+        self.fills = []
+        self.trades = []
+        self.close_seconds = interval_seconds(timesetup)
+    def advance(self,close_time):
+        '''
+        process the bars closed up to close_time
+            args:
+                close_time (int) : epoch seconds
+            return:
+                int : number of bars processed
+        '''
+        c = self.candles
+        start = self.cursor+1
+        stop = int(c.time.searchsorted(close_time-self.close_seconds,side='right'))
+        if stop <= start:
+            return 0
+        for i in range(start,stop):
+            self.cursor = i
+            for order_id,order in list(self.stops.items()):
+                if order['side'] == 'SELL' and c.low[i] <= order['stopPrice']:
+                    self._trigger(order_id,min(float(c.open[i]),order['stopPrice']),i)
+                elif order['side'] == 'BUY' and c.high[i] >= order['stopPrice']:
+                    self._trigger(order_id,max(float(c.open[i]),order['stopPrice']),i)
+        self.mark = float(c.close[stop-1])
+        return stop-start
+    def _trigger(self,order_id,price,i):
+        stop = self.stops.pop(order_id)
+        if self.quantity > 0 and stop['side'] == 'SELL' or self.quantity < 0 and stop['side'] == 'BUY':
+            self._fill(-self.quantity,price,'stoploss',i)
+    def _fill(self,delta,price,reason,i=None):
+        if i == None:
+            i = self.cursor
+        time = int(self.candles.time[i])+self.close_seconds
+        fee = abs(delta)*price*self.fee
+        self.wallet -= fee
+        self.fills.append({'time':time,'quantity':delta,'price':price,'fee':fee,'reason':reason})
+        JOURNAL.info('fill',symbol=self.symbol,**self.fills[-1])
+        if self.quantity == 0 or (self.quantity > 0) == (delta > 0):
+            total = self.quantity+delta
+            self.entry = (self.entry*self.quantity+price*delta)/total
+            if self.quantity == 0:
+                self.entry_time = time
+            self.quantity = total
+            return
+        closed = min(abs(delta),abs(self.quantity))
+        sign = 1 if self.quantity > 0 else -1
+        pnl = sign*closed*(price-self.entry)
+        self.wallet += pnl
+        self.trades.append({'position':'long' if sign == 1 else 'short','entry_time':self.entry_time,'exit_time':time,
+                            'entry':self.entry,'exit':price,'quantity':closed,'pnl':pnl,'reason':reason})
+        rest = self.quantity+delta
+        if abs(rest) < 10**-(self.quantity_precision+1):
+            self.quantity = 0.0
+            self.entry = 0.0
+            self.entry_time = None
+        elif (rest > 0) == (self.quantity > 0):
+            self.quantity = rest
+        else:
+            self.quantity = rest
+            self.entry = price
+            self.entry_time = time
+    def equity(self):
+        if self.mark == None:
+            return self.wallet
+        return self.wallet+self.quantity*(self.mark-self.entry)
+    def _round(self,quantity):
+        return float("{:0.0{}f}".format(abs(quantity),self.quantity_precision))
+    def future_buy(self,symbol,quantity):
+        self.stops = {}
+        quantity = self._round(quantity)
+        if quantity == 0:
+            JOURNAL.error('order',method='buy',symbol=symbol,quantity=quantity,error='quantity is 0')
+            return False
+        self._fill(quantity,self.mark,'market')
+        return True
+    def future_sell(self,symbol,quantity):
+        self.stops = {}
+        quantity = self._round(quantity)
+        if quantity == 0:
+            JOURNAL.error('order',method='sell',symbol=symbol,quantity=quantity,error='quantity is 0')
+            return False
+        self._fill(-quantity,self.mark,'market')
+        return True
+    def setstoploss(self,position,symbol,stopprice):
+        self.stops = {}
+        return self._stop(position,stopprice)
+    def _stop(self,position,stopprice):
+        price = round(float(stopprice),self.price_precision)
+        if position == 'short':
+            side = 'BUY'
+            now = price <= self.mark
+        else:
+            side = 'SELL'
+            now = price >= self.mark
+        if now:
+            JOURNAL.error('order',method='stoploss',position=position,symbol=self.symbol,stoploss=price,error='order would immediately trigger')
+            return False
+        self.order_id += 1
+        self.stops[self.order_id] = {'side':side,'stopPrice':price}
+        return True
+    def prepare(self,symbol):
+        return
+    def open_position(self,position,symbol,quantity,stopprice):
+        self.stops = {}
+        quantity = self._round(quantity or 0)
+        if quantity == 0:
+            JOURNAL.error('order',method='open',position=position,symbol=symbol,quantity=quantity,error='quantity is 0')
+            return False
+        if position == 'short':
+            self._fill(-quantity,self.mark,'market')
+        else:
+            self._fill(quantity,self.mark,'market')
+        return self._stop(position,stopprice)
+    def close_position(self,position,symbol):
+        self.stops = {}
+        if self.quantity != 0:
+            self._fill(-self.quantity,self.mark,'market')
+        return True
+    def get_total_money(self,symbol):
+        return self.equity()-abs(self.quantity)*(self.mark or 0)/self.leverage
+    def get_maxNotional(self,symbol):
+        return self.max_notional
+    def get_inital_price(self,symbol):
+        return self.entry
+    def get_future_hold(self,symbol):
+        return self.quantity
+    def get_future_purchase_quantity(self,symbol,MoneyToBuy):
+        q = (MoneyToBuy*0.999)/self.mark
+        quantity = float("{:0.0{}f}".format(q,self.quantity_precision))
+        if q < 10**-self.quantity_precision:
+            quantity = 0
+        return quantity
+    def get_future_mark_price(self,symbol):
+        return self.mark
+    def check_state(self,symbol):
+        return self.quantity != 0
+class SimClient:
+    '''
+    binance.Client stand-in for replay , get_klines only returns bars closed before the virtual clock
+        args:
+            candles (dict) : {'5m':CandleData , '1d':CandleData}
+    '''
+    def __init__(self,candles,clock):
+        import requests
+        self.session = requests.Session()
+        self.candles = candles
+        self.clock = clock
+    def get_klines(self,symbol,interval,startTime=None,limit=1000,**kwargs):
+        c = self.candles[interval]
+        sec = interval_seconds(interval)
+        start = 0
+        if startTime != None:
+            start = int(c.time.searchsorted(-(-startTime//1000)))
+        stop = int(c.time.searchsorted(int(self.clock.time())-sec,side='right'))
+        stop = min(stop,start+limit)
+        return [[int(c.time[i])*1000,c.open[i],c.high[i],c.low[i],c.close[i],0.0,(int(c.time[i])+sec)*1000-1]
+                for i in range(start,stop)]
+class MemoryCache:
+    '''
+    CandleCache in memory for replay ( update , candles , last_close_time , append_klines ) , nothing is written to disk
+    '''
+    def __init__(self,symbol,timesetup):
+        self.symbol = symbol
+        self.timesetup = timesetup
+        self.interval = interval_seconds(timesetup)
+        tz_offset = TZ_OFFSET
+        if self.interval >= 86400:
+            tz_offset = 0
+        self.data = CandleData(tz_offset=tz_offset)
+        self.last_close_time = 0
+    def __len__(self):
+        return len(self.data)
+    def candles(self,tz_offset=None):
+        return self.data
+    def append_klines(self,klines,now=None):
+        added = 0
+        for k in klines:
+            if int(k[6]) > self.last_close_time:
+                self.data.append(int(k[0])//1000,float(k[1]),float(k[2]),float(k[3]),float(k[4]))
+                self.last_close_time = int(k[6])
+                added += 1
+        return added
+    def update(self,client,start_time=None,scheduler=None):
+        start = self.last_close_time+1
+        if len(self.data) == 0 and start_time != None:
+            start = start_time
+        added = 0
+        while True:
+            if scheduler == None:
+                klines = client.get_klines(symbol=self.symbol,interval=self.timesetup,startTime=start,limit=KLINE_LIMIT)
+            else:
+                klines = scheduler.call(client.get_klines,symbol=self.symbol,interval=self.timesetup,startTime=start,limit=KLINE_LIMIT,
+                                        weight=2,market='spot')
+            added += self.append_klines(klines)
+            if len(klines) < KLINE_LIMIT:
+                return added
+            start = int(klines[-1][6])+1
+class Replay:
+    '''
+    Run script through the real mode loop ( BarScheduler -> on_close -> wait_bar -> run_strategy -> make_action )
+    on recorded candles with a virtual clock and a SimExchange
+        args:
+            script (main.script)
+            short_candles (CandleData) : bars of script.short
+            long_candles (CandleData) : bars of script.long , only needed when script.resample is False
+            warmup (int) : bars loaded as history before the replay starts
+            balance (float)
+            sample (dict) : JOURNAL sampling during the run , default keeps one of every BAR_SAMPLE 'bar' events
+        Method:
+            run : replay every bar , return report
+    Notice:
+        bars missing in the recording ( exchange down ) are skipped like the bar never closed
+        bars are kept in MemoryCache instead of the disk CandleCache , the rest of the loop is the real mode code
+    '''
+    def __init__(self,script,short_candles,long_candles=None,warmup=1,balance=1000.0,sample=None,**exchange):
+        from binance_api import ExchangeSession, RequestScheduler
+        if len(short_candles) < max(1,warmup):
+            raise ValueError('replay needs more than warmup ('+str(warmup)+') short bars , got '+str(len(short_candles)))
+        if script.long != None and not script.resample and long_candles is None:
+            raise ValueError('script.long is '+script.long+' and resample is False , long_candles is needed')
+        self.script = script
+        self.short_candles = short_candles
+        self.long_candles = long_candles
+        self.warmup = max(1,warmup)
+        self.sec = interval_seconds(script.short)
+        self.clock = VirtualClock(int(short_candles.time[self.warmup-1])+self.sec)
+        self.exchange = SimExchange(short_candles,script.symbol,script.short,balance,**exchange)
+        candles = {script.short:short_candles}
+        if script.long != None and long_candles is not None:
+            candles[script.long] = long_candles
+        self.client = SimClient(candles,self.clock)
+        self.session = ExchangeSession('','',cache_path=None,scheduler=RequestScheduler(clock=self.clock.time),client=self.client)
+        self.session.live = True
+        self.closes = set((short_candles.time+self.sec).tolist())
+        self.last_close = int(short_candles.time[-1])+self.sec
+        self.sample = {'bar':BAR_SAMPLE} if sample == None else sample
+        self.bars = 0
+    def run(self):
+        '''
+        return:
+            dict : {'bars','seconds','bars_per_sec','trades','final','wallet','quantity'}
+        '''
+        script = self.script
+        def cache_of(symbol,timesetup):
+            cache = MemoryCache(symbol,timesetup)
+            cache.update(self.client,start_time=int(self.client.candles[timesetup].time[0])*1000)
+            return cache
+        script.session = self.session
+        script.api = self.exchange
+        script.checkpoint = False
+        self.exchange.advance(int(self.clock.time()))
+        sample = JOURNAL.sample
+        JOURNAL.sample = dict(sample,**self.sample)
+        start = time.perf_counter()
+        try:
+            script.start_live(cache_of)
+            self.scheduler = BarScheduler(0,clock=self.clock.time,sleep=self.clock.sleep)
+            self.scheduler.add(script.symbol,script.short,self.on_close)
+            asyncio.run(self.scheduler.run())
+        finally:
+            JOURNAL.sample = sample
+        seconds = time.perf_counter()-start
+        return {'bars':self.bars,'seconds':seconds,'bars_per_sec':self.bars/max(seconds,1e-9),'trades':self.exchange.trades,
+                'final':self.exchange.equity(),'wallet':self.exchange.wallet,'quantity':self.exchange.quantity}
+    async def on_close(self,symbol,timesetup,close_time):
+        if close_time > self.last_close:
+            self.scheduler.stop()
+            return
+        if close_time not in self.closes:
+            return
+        self.exchange.advance(close_time)
+        self.script.on_close(symbol,timesetup,close_time)
+        self.bars += 1
@@ -0,0 +1,262 @@
+import sys
+import json
+import numpy as np
+from candle_store import CandleData, TZ_OFFSET, interval_seconds
+from scheduler import WEEK_OFFSET
+
+
+
+def _offset(timesetup):
+    if timesetup[-1] == 'w':
+        return WEEK_OFFSET
+    return 0
+def _tz_offset(timesetup,tz_offset):
+    if interval_seconds(timesetup) >= 86400:
+        return 0
+    return tz_offset
+def bucket_start(time,timesetup):
+    '''
+    open time of the timesetup bar that contains time ( utc epoch aligned like binance , weeks start monday )
+        args:
+            time (int or np.ndarray) : epoch seconds
+            timesetup (str) : '1h' , '4h' , '1d' , '1w'
+    '''
+    sec = interval_seconds(timesetup)
+    offset = _offset(timesetup)
+    return (time-offset)//sec*sec+offset
+def resample(candles,timesetup,short):
+    '''
+    build higher timeframe bars from short bars ( vectorized )
+        args:
+            candles (CandleData) : short bars
+            timesetup (str) : target '1h' , '4h' , '1d' , '1w'
+            short (str) : period of candles '1m' , '5m' ....
+        return:
+            CandleData : only closed bars , the last bar is dropped while its last short bar is not closed ,
+                         the first bar is dropped when candles start after its open time
+    '''
+    tz_offset = _tz_offset(timesetup,candles.tz_offset)
+    if len(candles) == 0:
+        return CandleData(tz_offset=tz_offset)
+    sec = interval_seconds(timesetup)
+    time = candles.time
+    bucket = bucket_start(time,timesetup)
+    starts = np.flatnonzero(np.r_[True,bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:]-1,len(time)-1]
+    if time[-1]+interval_seconds(short) < bucket[-1]+sec:
+        starts = starts[:-1]
+        ends = ends[:-1]
+    if len(starts) > 0 and time[starts[0]] != bucket[starts[0]]:
+        # short bars start inside the first bar , its open / high / low are not known
+        starts = starts[1:]
+        ends = ends[1:]
+    if len(starts) == 0:
+        return CandleData(tz_offset=tz_offset)
+    stop = ends[-1]+1
+    return CandleData(bucket[starts],candles.open[starts],np.maximum.reduceat(candles.high[:stop],starts),
+                      np.minimum.reduceat(candles.low[:stop],starts),candles.close[ends],tz_offset)
+class Resampler:
+    '''
+    build higher timeframe bars from short bars one by one , O(1) for each bar
+        Method:
+            add : add one closed short bar , return number of closed higher bars
+            from_history : start from a short history ( vectorized ) and keep the open bar
+        Get:
+            data (CandleData) : closed higher bars
+    Notice:
+        a bar closes when the short bar ending at its boundary arrives ,
+        or when a short bar of a later bar arrives ( short bars missing at the end )
+        when the first short bar is not at the open of its bar , that bar is skipped like resample does
+    '''
+    def __init__(self,timesetup,short,tz_offset=TZ_OFFSET,data=None):
+        self.timesetup = timesetup
+        self.sec = interval_seconds(timesetup)
+        self.offset = _offset(timesetup)
+        self.short_sec = interval_seconds(short)
+        if data is None:
+            data = CandleData(tz_offset=_tz_offset(timesetup,tz_offset))
+        self.data = data
+        self.bucket = None
+        self.open = self.high = self.low = self.close = None
+        self.seen = len(data) > 0
+        self.skip = None
+    @classmethod
+    def from_history(cls,candles,timesetup,short):
+        '''
+        args:
+            candles (CandleData) : short bars
+        return:
+            Resampler : data holds the closed bars of candles , the open bar is kept inside
+        '''
+        data = resample(candles,timesetup,short)
+        resampler = cls(timesetup,short,candles.tz_offset,data)
+        start = int(np.searchsorted(candles.time,data.time[-1]+resampler.sec)) if len(data) > 0 else 0
+        for i in range(start,len(candles)):
+            resampler.add(int(candles.time[i]),candles.open[i],candles.high[i],candles.low[i],candles.close[i])
+        return resampler
+    def add(self,time,open,high,low,close):
+        '''
+        args:
+            time (int) : open time of short bar , epoch seconds
+            open , high , low , close (float)
+        return:
+            int : number of higher bars closed by this bar ( 0 , 1 or 2 )
+        '''
+        bucket = (time-self.offset)//self.sec*self.sec+self.offset
+        if not self.seen:
+            self.seen = True
+            if time != bucket:
+                self.skip = bucket
+        if bucket == self.skip:
+            return 0
+        closed = 0
+        if self.bucket is not None and bucket != self.bucket:
+            self._flush()
+            closed += 1
+        if self.bucket is None:
+            self.bucket = bucket
+            self.open = open
+            self.high = high
+            self.low = low
+        else:
+            if high > self.high:
+                self.high = high
+            if low < self.low:
+                self.low = low
+        self.close = close
+        if time+self.short_sec == bucket+self.sec:
+            self._flush()
+            closed += 1
+        return closed
+    def _flush(self):
+        self.data.append(self.bucket,self.open,self.high,self.low,self.close)
+        self.bucket = None
+class ResampledCache:
+    '''
+    long period cache built from the short period cache , used by script instead of downloading the long period
+        Method:
+            update : read the new short bars of source , return number of closed long bars
+            candles : CandleData of closed long bars
+        Get:
+            last_close_time (int) : ms , like CandleCache
+    '''
+    def __init__(self,source,timesetup,short):
+        self.source = source
+        self.timesetup = timesetup
+        data = source.candles()
+        self.resampler = Resampler.from_history(data,timesetup,short)
+        self.count = len(data)
+    def __len__(self):
+        return len(self.resampler.data)
+    @property
+    def last_close_time(self):
+        data = self.resampler.data
+        if len(data) == 0:
+            return 0
+        return (int(data.time[-1])+self.resampler.sec)*1000-1
+    def candles(self,tz_offset=None):
+        return self.resampler.data
+    def update(self,client=None):
+        data = self.source.candles()
+        added = 0
+        for i in range(self.count,len(data)):
+            added += self.resampler.add(int(data.time[i]),data.open[i],data.high[i],data.low[i],data.close[i])
+        self.count = len(data)
+        return added
+def from_klines(klines,timesetup,tz_offset=TZ_OFFSET):
+    '''
+    CandleData of raw binance klines
+        args:
+            klines (list) : [[open_time , open , high , low , close , ....] , ....] , ms and prices as strings or numbers
+            timesetup (str) : period of klines
+    '''
+    tz_offset = _tz_offset(timesetup,tz_offset)
+    if len(klines) == 0:
+        return CandleData(tz_offset=tz_offset)
+    time = np.array([int(k[0])//1000 for k in klines],dtype='int64')
+    prices = np.array([[float(k[1]),float(k[2]),float(k[3]),float(k[4])] for k in klines],dtype='float64')
+    return CandleData(time,prices[:,0],prices[:,1],prices[:,2],prices[:,3],tz_offset)
+def verify(resampled,exchange,rtol=1e-9):
+    '''
+    compare resampled bars with klines of the exchange on the common open times
+        args:
+            resampled (CandleData)
+            exchange (CandleData) : same period downloaded from binance
+            rtol (float) : 0 for exact equality
+        return:
+            dict : {'bars' , 'mismatch' , 'missing' , 'extra' , 'first'} , first is the time of the first different bar ,
+                   missing / extra are bars only the exchange / only resampled has
+    '''
+    common,a,b = np.intersect1d(resampled.time,exchange.time,return_indices=True)
+    same = np.ones(len(common),dtype=bool)
+    for name in ('open','high','low','close'):
+        same &= np.isclose(getattr(resampled,name)[a],getattr(exchange,name)[b],rtol=rtol,atol=0)
+    first = None
+    if not same.all():
+        first = int(common[~same][0])
+    return {'bars':len(common),'mismatch':int((~same).sum()),'missing':len(exchange)-len(common),'extra':len(resampled)-len(common),
+            'first':first}
+def record(path,symbol,short,longs,start,end,client=None):
+    '''
+    save binance klines of short and every long period as a json fixture for verify_fixture
+        args:
+            path (str) : json file
+            symbol (str) : 'BNBUSDT'
+            short (str) : '1m'
+            longs (list) : ['1h' , '4h' , '1d']
+            start , end (str) : utc '2023-01-02' , klines opened in [start , end) , use day boundaries so every long bar is complete
+            client (binance.Client) : default binance.Client() ( spot klines , no key needed )
+        return:
+            dict : {'symbol','start','end','klines':{timesetup:[[open_time , open , high , low , close] , ....]}}
+    '''
+    from candle_store import parse_time
+    from candle_cache import KLINE_LIMIT
+    from binance_api import REQUESTS, KLINES_WEIGHT
+    if client == None:
+        import binance
+        client = binance.Client()
+    start_ms = parse_time(start)*1000
+    end_ms = parse_time(end)*1000
+    fixture = {'symbol':symbol,'start':start,'end':end,'klines':{}}
+    for timesetup in [short]+list(longs):
+        klines = []
+        cursor = start_ms
+        while cursor < end_ms:
+            page = REQUESTS.call(client.get_klines,symbol=symbol,interval=timesetup,startTime=cursor,endTime=end_ms-1,limit=KLINE_LIMIT,
+                                 weight=KLINES_WEIGHT,market='spot')
+            if len(page) == 0:
+                break
+            klines += [list(k[:5]) for k in page]
+            cursor = int(page[-1][6])+1
+        fixture['klines'][timesetup] = klines
+    with open(path,'w') as f:
+        json.dump(fixture,f,separators=(',',':'))
+    return fixture
+def verify_fixture(path,short='1m'):
+    '''
+    resample the short klines of a fixture ( record ) to every other period of it and compare with the exchange bars exactly
+        return:
+            dict : {timesetup:{'bars' , 'mismatch' , 'missing' , 'extra' , 'first'}}
+    '''
+    with open(path) as f:
+        klines = json.load(f)['klines']
+    candles = from_klines(klines[short],short)
+    return {timesetup:verify(resample(candles,timesetup,short),from_klines(rows,timesetup),rtol=0)
+            for timesetup,rows in klines.items() if timesetup != short}
+if __name__ == '__main__':
+    '''
+    python resample.py BNBBUSD 1h 1d : resample 1h history to 1d and compare with the 1d history of binance
+    python resample.py record tests/fixtures/klines-BNBUSDT.json BNBUSDT 1m 1h,4h,1d 2023-03-06 2023-03-08 : record a fixture
+    python resample.py fixture tests/fixtures/klines-BNBUSDT.json : exact check of a recorded fixture , offline
+    '''
+    if sys.argv[1] == 'record':
+        path,symbol,short,longs,start,end = sys.argv[2:8]
+        fixture = record(path,symbol,short,longs.split(','),start,end)
+        print(path,{timesetup:len(rows) for timesetup,rows in fixture['klines'].items()})
+    elif sys.argv[1] == 'fixture':
+        print(verify_fixture(sys.argv[2]))
+    else:
+        from binance_api import Symbol_data
+        symbol,short,long = sys.argv[1:4]
+        result = verify(resample(Symbol_data(symbol,short),long,short),Symbol_data(symbol,long))
+        print(symbol,short,'->',long,result)
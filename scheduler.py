@@ -0,0 +1,89 @@
+import time
+import heapq
+import asyncio
+from candle_store import interval_seconds
+from journal import JOURNAL
+
+
+
+WEEK_OFFSET = 4*86400
+GRACE = 1.0
+
+def next_close(now,timesetup):
+    '''
+    next kline close boundary after now ( binance bars are aligned to utc epoch , weeks start monday )
+        args:
+            now (float) : epoch seconds
+            timesetup (str) : '1m' , '5m' , '1h' , '4h' , '1d' , '1w'
+        return:
+            int : epoch seconds
+    '''
+    sec = interval_seconds(timesetup)
+    offset = 0
+    if timesetup[-1] == 'w':
+        offset = WEEK_OFFSET
+    return (int(now-offset)//sec+1)*sec+offset
+class BarScheduler:
+    '''
+    Wake callbacks when klines close , many symbols / timeframes on one event loop
+        Method:
+            add : callback(symbol , timesetup , close_time) after every close + grace seconds
+            run : serve until stop ( coroutine )
+            stop : stop run
+        Notice:
+            coroutine callbacks run as tasks , normal functions run in the default executor ,
+            so a slow callback does not delay the others
+            clock / sleep can be replaced ( virtual clock for replay )
+    '''
+    def __init__(self,grace=GRACE,clock=time.time,sleep=asyncio.sleep):
+        self.grace = grace
+        self.clock = clock
+        self.sleep = sleep
+        self.jobs = []
+        self.count = 0
+        self.running = False
+        self.tasks = set()
+    def add(self,symbol,timesetup,callback,grace=None):
+        '''
+        args:
+            symbol (str)
+            timesetup (str) : '1m' ... '1d'
+            callback (function) : callback(symbol , timesetup , close_time)
+            grace (float) : seconds after close , default scheduler grace
+        '''
+        if grace == None:
+            grace = self.grace
+        mode = 'async' if asyncio.iscoroutinefunction(callback) else 'thread'
+        job = {'symbol':symbol,'timesetup':timesetup,'callback':callback,'grace':grace,'mode':mode}
+        close_time = next_close(self.clock(),timesetup)
+        heapq.heappush(self.jobs,(close_time+grace,self.count,close_time,job))
+        self.count += 1
+        return job
+    def stop(self):
+        self.running = False
+    async def run(self):
+        self.running = True
+        loop = asyncio.get_running_loop()
+        while self.running and len(self.jobs) > 0:
+            wake = self.jobs[0][0]
+            wait = wake-self.clock()
+            if wait > 0:
+                await self.sleep(wait)
+                continue
+            wake,n,close_time,job = heapq.heappop(self.jobs)
+            callback = job['callback']
+            if job['mode'] == 'async':
+                task = asyncio.ensure_future(callback(job['symbol'],job['timesetup'],close_time))
+            else:
+                task = loop.run_in_executor(None,callback,job['symbol'],job['timesetup'],close_time)
+            self.tasks.add(task)
+            task.add_done_callback(self._done)
+            close_time = next_close(close_time,job['timesetup'])
+            heapq.heappush(self.jobs,(close_time+job['grace'],self.count,close_time,job))
+            self.count += 1
+        if len(self.tasks) > 0:
+            await asyncio.gather(*self.tasks,return_exceptions=True)
+    def _done(self,task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() != None:
+            JOURNAL.error('error',source='scheduler',error=repr(task.exception()))
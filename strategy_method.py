@@ -1,144 +1,221 @@
-def strategy(shortdata,longdata,data_dict):
+from collections import deque
+from journal import JOURNAL
+
+
+
+TREND_HISTORY = 5000
+BATCH_BARS = 100000
+
+class TrendState:
+    '''
+    state of TrendStrategy
+        last (dict) : first bar
+        find_trend_mode (str) : None , 'uptrend' , 'downtrend'
+        lowest , highest , newlowest , newhighest (float)
+        revert (bool)
+        trend_list (deque) : last trend data , at most history ( TREND_HISTORY ) entries
+                             the old strategy kept every entry in a list , the first entries are dropped now ,
+                             history=None keeps all of them for callers that index or slice deep history
+        i (int) : number of bars processed
+    '''
+    __slots__ = ('last','find_trend_mode','lowest','highest','newlowest','newhighest','revert','trend_list',
+                 'success_mode','marginstate','buy_info','num_state','i')
+    def __init__(self,history=TREND_HISTORY):
+        self.last = None
+        self.find_trend_mode = None
+        self.lowest = None
+        self.highest = None
+        self.newlowest = None
+        self.newhighest = None
+        self.revert = False
+        self.trend_list = deque(maxlen=history)
+        self.success_mode = False
+        self.marginstate = False
+        self.buy_info = {'margin':0,'pricein':0,'stoploss':0,'last_buy':0}
+        self.num_state = 0
+        self.i = 0
+    def state_dict(self):
+        '''
+        state in the old data_dict['state'] format
+        '''
+        return {'lowest':self.lowest,'highest':self.highest,'newlowest':self.newlowest,'revert':self.revert,'newhighest':self.newhighest}
+class TrendStrategy:
+    '''
+    策略 ( streaming ) :
+        on_bar is called once for every closed bar , O(1) for each bar
+        Method:
+            on_bar : update trend with new bar , return action
+            run : call on_bar for every bar of shortdata not processed yet
+                  ( trend_kernel.trend_batch when not verbose and at least BATCH_BARS bars are new )
+        Notice:
+            action (dict) : {} or {'stoploss':float , 'position':'long'/'short' , 'method':'close'/'open'}
+            verbose : every bar goes to JOURNAL as a 'trend' event , changes of trend as 'trend_change'
+    '''
+    def __init__(self,history=TREND_HISTORY,verbose=True):
+        self.state = TrendState(history)
+        self.verbose = verbose
+    def on_bar(self,bar,itemtime=None):
+        '''
+        args:
+            bar (dict) : {'close':close , 'low':low , 'open':open , 'high':high , 'rg':rg}
+            itemtime (str) : time of bar
+        return:
+            action (dict)
+        '''
+        s = self.state
+        action = {}
+        mode = s.find_trend_mode
+        C_price = bar['close']
+        O_price = bar['open']
+        rg = bar['rg']
+        if s.last == None:
+            s.last = {'close':C_price,'low':bar['low'],'open':O_price,'high':bar['high'],'rg':rg}
+        else:
+            last_rg = s.last['rg']
+            if s.find_trend_mode == None:
+                if last_rg == 'up':
+                    s.find_trend_mode = 'uptrend'
+                    s.lowest = O_price
+                    s.highest = C_price
+                elif last_rg == 'down':
+                    s.find_trend_mode = 'downtrend'
+                    s.lowest = C_price
+                    s.highest = O_price
+                s.newlowest = None
+                s.newhighest = None
+                s.revert = False
+            if s.find_trend_mode == 'uptrend':
+                if rg == 'up':
+                    if C_price > s.highest:
+                        s.highest = C_price
+                        if s.revert == True:
+                            s.lowest = s.newlowest
+                            s.revert = False
+                            s.newlowest = None
+                            s.success_mode = True
+                elif rg == 'down':
+                    if C_price < s.lowest:
+                        s.find_trend_mode = 'downtrend'
+                        s.revert = False
+                        s.newlowest = None
+                        s.newhighest = None
+                        s.success_mode = False
+                    else:
+                        if s.newlowest == None or C_price < s.newlowest:
+                            s.newlowest = C_price
+                        s.revert = True
+                        if O_price > s.highest:
+                            s.highest = O_price
+                if s.success_mode == True:
+                    data = {'trend':'uptrend','lowest':s.lowest,'highest':s.highest}
+                    s.trend_list.append(data)
+            elif s.find_trend_mode == 'downtrend':
+                if rg == 'down':
+                    if C_price < s.lowest:
+                        s.lowest = C_price
+                        if s.revert == True:
+                            s.highest = s.newhighest
+                            s.revert = False
+                            s.newhighest = None
+                            s.success_mode = True
+                elif rg == 'up':
+                    if C_price > s.highest:
+                        s.find_trend_mode = 'uptrend'
+                        s.revert = False
+                        s.newlowest = None
+                        s.newhighest = None
+                        s.success_mode = False
+                    else:
+                        if s.newhighest == None or C_price > s.newhighest:
+                            s.newhighest = C_price
+                        s.revert = True
+                        if O_price < s.lowest:
+                            s.lowest = O_price
+                if s.success_mode == True:
+                    data = {'trend':'downtrend','lowest':s.lowest,'highest':s.highest}
+                    s.trend_list.append(data)
+            if s.find_trend_mode == 'downtrend':
+                data = {'trend':'downtrend','lowest':s.lowest,'highest':s.highest}
+            else:
+                data = {'trend':'uptrend','lowest':s.lowest,'highest':s.highest}
+            s.trend_list.append(data)
+            if self.verbose:
+                JOURNAL.event('trend',time=itemtime,success=s.success_mode,**data)
+                if s.find_trend_mode != mode and mode != None:
+                    JOURNAL.event('trend_change',time=itemtime,before=mode,**data)
+        s.i += 1
+        return action
+    def run(self,shortdata):
+        '''
+        call on_bar for the bars of shortdata after state.i
+            args:
+                shortdata (CandleData or dict)
+            return:
+                action (dict) : action of the last bar
+        '''
+        start = self.state.i
+        action = {}
+        if start >= len(shortdata):
+            return action
+        if hasattr(shortdata,'bar'):
+            if not self.verbose and len(shortdata)-start >= BATCH_BARS:
+                from trend_kernel import trend_batch
+                trend_batch(shortdata.open,shortdata.high,shortdata.low,shortdata.close,self.state)
+            elif self.verbose:
+                itemtimes = shortdata.labels(start)
+                for n in range(len(itemtimes)):
+                    action = self.on_bar(shortdata.bar(start+n),str(itemtimes[n]))
+            else:
+                for n in range(start,len(shortdata)):
+                    action = self.on_bar(shortdata.bar(n))
+        else:
+            itemtimes = list(shortdata.keys())[start:]
+            for itemtime in itemtimes:
+                action = self.on_bar(shortdata[itemtime],itemtime)
+        return action
+def strategy(shortdata,longdata,data_dict,indicators=None,**params):
     '''
     策略
         args:
             shortdata : short period data
             longdata : long period data
+            indicators (dict) : {'atr':('atr',14) , 'ema20':('ema',20)} , kept up to date in data_dict['indicators']
+                                ( indicators.Indicators , O(1) for each new bar in real mode )
+            params : arguments of TrendStrategy ( history , verbose ) , use functools.partial to set them
         return:
             data_dict (dict) :
             if want to sell or buy :
                 data_dict['action'] :
-                stoploss (float) 
+                stoploss (float)
                 position (str) : 'long' 'short'
                 method (str) : 'close' 'open'
     Notice:
         if run real mode data_dict need to store new data from this turn
         so that the data can be sent to next turn for using
+        data_dict['engine'] keeps the TrendStrategy , only new bars are processed
+        data_dict['checkpoint'] ( TrendState from checkpoint.Checkpoint.resume ) starts the engine from a saved state
+        data_dict['trend_list'] is a deque of the last history entries ( not the whole list any more ) , history=None keeps all
     '''
-    action = {}
-    if data_dict == {}:
-        last = None
-        find_trend_mode = None
-        state = {'lowest':None,'highest':None,'newlowest':None,'revert':False,'newhighest':None}
-        trend_list = []
-        success_mode = False
-        marginstate = False
-        buy_info = {'margin':0,'pricein':0,'stoploss':0,'last_buy':0}
-        num_state= 0
-        i = 0
-    else:
-        last = data_dict['last']
-        find_trend_mode = data_dict['find_trend_mode']
-        state = data_dict['state']
-        trend_list = data_dict['trend_list']
-        success_mode = data_dict['success_mode']
-        marginstate = data_dict['marginstate']
-        buy_info = data_dict['buy_info']
-        num_state= data_dict['num_state']
-        i = data_dict['i']
-    while i <len(shortdata):
-        itemtime = list(shortdata.keys())[i]
-        C_price = shortdata[itemtime]['close']
-        O_price = shortdata[itemtime]['open']
-        H_price = shortdata[itemtime]['high']
-        L_price = shortdata[itemtime]['low']
-        rg = shortdata[itemtime]['rg']
-        # print('time = ',itemtime)
-        if last == None:
-            last = {'close':C_price,'low':L_price,'open':O_price,'high':H_price,'rg':rg}
-        else:
-            last_rg = last['rg']
-            if find_trend_mode == None:
-                if last_rg == 'up':
-                    find_trend_mode = 'uptrend'
-                    state = {'lowest':O_price,'highest':C_price,'newlowest':None,'revert':False,'newhighest':None}
-                elif last_rg == 'down':
-                    find_trend_mode = 'downtrend'
-                    state = {'lowest':C_price,'highest':O_price,'newlowest':None,'revert':False,'newhighest':None}
-            if find_trend_mode == 'uptrend':
-                if rg == 'up':
-                    if C_price > state['highest']:
-                        state['highest'] = C_price
-                        if state['revert'] == True:
-                            state['lowest'] = state['newlowest']
-                            state['revert'] = False
-                            state['newlowest'] = None
-                            success_mode = True
-                elif rg == 'down':
-                    if C_price < state['lowest']:
-                        find_trend_mode = 'downtrend'
-                        state['revert'] = False
-                        state['newlowest'] = None
-                        state['newhighest'] = None
-                        success_mode = False
-                    else:
-                        if state['newlowest'] == None:
-                            state['newlowest'] = C_price
-                        else:
-                            if C_price<state['newlowest']:
-                                state['newlowest'] = C_price
-                        state['revert'] = True       
-                        if O_price > state['highest']:
-                            state['highest'] = O_price
-                if success_mode == True:
-                    data = {'trend':'uptrend','lowest':state['lowest'],'highest':state['highest']}
-                    trend_list.append(data)
-                    print('時間',itemtime,data)      
-            elif find_trend_mode == 'downtrend':
-                if rg == 'down':
-                    if C_price < state['lowest']:
-                        state['lowest'] = C_price
-                        if state['revert'] == True:
-                            state['highest'] = state['newhighest']
-                            state['revert'] = False
-                            state['newhighest'] = None
-                            success_mode = True
-                elif rg == 'up':
-                    if C_price > state['highest']:
-                        find_trend_mode = 'uptrend'
-                        state['revert'] = False
-                        state['newlowest'] = None
-                        state['newhighest'] = None
-                        success_mode = False
-                    else:
-                        if state['newhighest'] == None:
-                            state['newhighest'] = C_price
-                        else:
-                            if C_price>state['newhighest']:
-                                state['newhighest'] = C_price
-                        state['revert'] = True
-                        if O_price < state['lowest']:
-                            state['lowest'] = O_price
-                if success_mode == True:
-                    data = {'trend':'downtrend','lowest':state['lowest'],'highest':state['highest']}
-                    trend_list.append(data)
-                    # print('時間',itemtime,data)
-            # if len(trend_list)>0:
-            #     print('時間',itemtime,trend_list[-1])
-            if find_trend_mode == 'downtrend':
-                data = {'trend':'downtrend','lowest':state['lowest'],'highest':state['highest']}
-                trend_list.append(data)
-                print('時間',itemtime,trend_list[-1])
-            else:
-                data = {'trend':'uptrend','lowest':state['lowest'],'highest':state['highest']}
-                trend_list.append(data)
-                print('時間',itemtime,trend_list[-1])
-        i+=1
-    data_dict['last']= last 
-    data_dict['find_trend_mode'] = find_trend_mode
-    data_dict['state'] = state
-    data_dict['trend_list'] = trend_list 
-    data_dict['success_mode'] = success_mode
-    data_dict['marginstate'] = marginstate
-    data_dict['buy_info'] = buy_info
-    data_dict['num_state'] = num_state
-    data_dict['i'] = i
+    if 'engine' not in data_dict:
+        data_dict['engine'] = TrendStrategy(**params)
+        if 'checkpoint' in data_dict:
+            data_dict['engine'].state = data_dict.pop('checkpoint')
+    engine = data_dict['engine']
+    if indicators and hasattr(shortdata,'close'):
+        if 'indicators' not in data_dict:
+            from indicators import Indicators
+            data_dict['indicators'] = Indicators(indicators)
+        data_dict['indicators'].update(shortdata)
+    action = engine.run(shortdata)
+    s = engine.state
+    data_dict['last']= s.last
+    data_dict['find_trend_mode'] = s.find_trend_mode
+    data_dict['state'] = s.state_dict()
+    data_dict['trend_list'] = s.trend_list
+    data_dict['success_mode'] = s.success_mode
+    data_dict['marginstate'] = s.marginstate
+    data_dict['buy_info'] = s.buy_info
+    data_dict['num_state'] = s.num_state
+    data_dict['i'] = s.i
     data_dict['action'] = action
     return data_dict
-
-
-
-
-
-
-
@@ -0,0 +1,108 @@
+import os
+import itertools
+import functools
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from candle_store import CandleData
+from backtest import collect_actions, backtest
+
+
+
+_candles = {}
+_blocks = []
+
+def share_candles(data):
+    '''
+    copy CandleData into one shared memory block
+        args:
+            data (CandleData)
+        return:
+            shm (SharedMemory) , layout (tuple) : (name , bars , tz_offset)
+    '''
+    n = len(data)
+    shm = shared_memory.SharedMemory(create=True,size=max(1,n*8*5))
+    columns = _columns(shm,n)
+    columns[0][:] = data.time
+    columns[1][:] = data.open
+    columns[2][:] = data.high
+    columns[3][:] = data.low
+    columns[4][:] = data.close
+    return shm,(shm.name,n,data.tz_offset)
+def _columns(shm,n):
+    time = np.ndarray((n,),dtype='int64',buffer=shm.buf,offset=0)
+    ohlc = [np.ndarray((n,),dtype='float64',buffer=shm.buf,offset=n*8*k) for k in range(1,5)]
+    return [time]+ohlc
+def _attach(layouts):
+    '''
+    worker initializer : map every shared block as CandleData , nothing is copied
+    '''
+    for key,(name,n,tz_offset) in layouts.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _blocks.append(shm)
+        time,open,high,low,close = _columns(shm,n)
+        _candles[key] = CandleData.wrap(time,open,high,low,close,tz_offset)
+def _run(task):
+    symbol,short,long,ratio,strategy,params,balance = task
+    data_short = _candles[(symbol,short)]
+    if long != None:
+        data_long = _candles[(symbol,long)]
+    else:
+        data_long = {}
+    actions = collect_actions(functools.partial(strategy,**params),data_short,data_long,short,long)
+    result = backtest(data_short,actions,ratio,balance,timesetup=short)
+    trades = result['trades']
+    return {'symbol':symbol,'short':short,'long':long,'ratio':ratio,'strategy':strategy.__name__,'params':params,
+            'trades':len(trades),'win':len([t for t in trades if t['pnl'] > 0]),'final':result['final'],
+            'return':result['final']/balance-1,'max_drawdown':result['max_drawdown']}
+def run_sweep(symbols,shorts,longs,ratios,strategies,balance=1000.0,processes=None,loader=None):
+    '''
+    backtest every configuration of the grid on a process pool
+        args:
+            symbols (list) : ['BNBBUSD','BTCBUSD']
+            shorts (list) : ['5m','1h']
+            longs (list) : [None,'1d']
+            ratios (list) : [0.01,0.025]
+            strategies (list) : [(strategy , {'verbose':False}) , ....] , strategy must be a module level function
+            balance (float) : start money
+            processes (int) : default all cores
+            loader (function) : loader(symbol,timesetup) -> CandleData , default Symbol_data
+        return:
+            results (list) : rows sorted by final money , best first
+    Notice:
+        candles are loaded once and put in shared memory , workers only receive the block names
+    '''
+    if loader is None:
+        from binance_api import Symbol_data
+        loader = Symbol_data
+    keys = set()
+    for symbol in symbols:
+        for period in list(shorts)+list(longs):
+            if period != None:
+                keys.add((symbol,period))
+    blocks = []
+    layouts = {}
+    try:
+        for key in sorted(keys):
+            shm,layout = share_candles(loader(*key))
+            blocks.append(shm)
+            layouts[key] = layout
+        tasks = [(symbol,short,long,ratio,strategy,params,balance)
+                 for symbol,short,long,ratio,(strategy,params) in itertools.product(symbols,shorts,longs,ratios,strategies)]
+        if processes is None:
+            processes = os.cpu_count()
+        with Pool(processes,initializer=_attach,initargs=(layouts,)) as pool:
+            results = list(pool.imap_unordered(_run,tasks))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    results.sort(key=lambda row:row['final'],reverse=True)
+    return results
+def print_table(results,top=20):
+    '''
+    print ranked results of run_sweep
+    '''
+    print('rank','symbol','short','long','ratio','strategy','params','trades','win','final','return','max drawdown')
+    for rank,row in enumerate(results[:top]):
+        print(rank+1,row['symbol'],row['short'],row['long'],row['ratio'],row['strategy'],row['params'],row['trades'],row['win'],
+              round(row['final'],4),round(row['return'],4),round(row['max_drawdown'],4))
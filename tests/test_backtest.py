@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from candle_store import CandleData
+from backtest import backtest, funding_count, FUNDING_INTERVAL
+
+
+
+DAY = 86400
+
+def _candles(bars,start=0,step=3600):
+    # bars : [(open , high , low , close) , ....]
+    bars = np.array(bars,dtype='float64')
+    time = start+step*np.arange(len(bars),dtype='int64')
+    return CandleData(time,bars[:,0],bars[:,1],bars[:,2],bars[:,3])
+def _long(stoploss=95.0):
+    return {'method':'open','position':'long','stoploss':stoploss}
+def _short(stoploss=105.0):
+    return {'method':'open','position':'short','stoploss':stoploss}
+def test_long_stopped_at_stoploss():
+    candles = _candles([(100,100,100,100),(99,101,94,96),(96,97,90,91)])
+    result = backtest(candles,[(0,_long())],0.025,1000.0,fee=0.0)
+    # risk 25 over a 5 % stop : quantity 500*0.999/100
+    trade, = result['trades']
+    assert trade['reason'] == 'stoploss' and trade['exit'] == 95.0
+    assert trade['quantity'] == pytest.approx(4.995)
+    assert trade['pnl'] == pytest.approx(-24.975)
+    assert result['final'] == pytest.approx(975.025)
+    assert result['equity'][0] == 1000.0 and result['equity'][1] == pytest.approx(975.025)
+def test_stop_fills_at_open_when_bar_gaps_over_it():
+    candles = _candles([(100,100,100,100),(93,94,90,92)])
+    trade, = backtest(candles,[(0,_long())],0.025,1000.0,fee=0.0)['trades']
+    assert trade['exit'] == 93.0
+    assert trade['pnl'] == pytest.approx(4.995*-7)
+    candles = _candles([(100,100,100,100),(108,110,107,109)])
+    trade, = backtest(candles,[(0,_short())],0.025,1000.0,fee=0.0)['trades']
+    assert trade['exit'] == 108.0
+    assert trade['pnl'] == pytest.approx(-4.995*8)
+def test_close_and_flip():
+    candles = _candles([(100,100,100,100),(100,104,99,103),(103,111,102,110),(110,110,104,105),(105,106,100,101)])
+    actions = [(0,_long()),(2,_short(115.0)),(3,{'method':'close','position':'short'}),(4,{'method':'close','position':None})]
+    result = backtest(candles,actions,0.025,1000.0,fee=0.0)
+    first,second = result['trades']
+    # the short opens on the bar the long is closed , at the same close
+    assert (first['position'],first['reason'],first['exit']) == ('long','close',110.0)
+    assert first['pnl'] == pytest.approx(4.995*10)
+    cash = 1000.0+first['pnl']
+    quantity = (cash*0.025/(5/110))*0.999/110
+    assert (second['position'],second['entry'],second['exit'],second['reason']) == ('short',110.0,105.0,'close')
+    assert second['quantity'] == pytest.approx(quantity)
+    assert second['pnl'] == pytest.approx(quantity*5)
+    assert len(result['trades']) == 2
+    assert result['final'] == pytest.approx(cash+quantity*5)
+def test_position_left_open_is_closed_at_the_end():
+    candles = _candles([(100,100,100,100),(100,103,99,102)])
+    trade, = backtest(candles,[(0,_long())],0.025,1000.0,fee=0.0)['trades']
+    assert trade['reason'] == 'end' and trade['exit'] == 102.0
+def test_fee_on_both_sides():
+    candles = _candles([(100,100,100,100),(99,101,94,96)])
+    trade, = backtest(candles,[(0,_long())],0.025,1000.0,fee=0.001)['trades']
+    assert trade['fee'] == pytest.approx(4.995*100*0.001+4.995*95*0.001)
+    assert trade['pnl'] == pytest.approx(-24.975-trade['fee'])
+def test_funding_count():
+    hour = np.arange(0,DAY,3600,dtype='int64')
+    assert funding_count(hour,3600).tolist() == [1 if h%8 == 0 else 0 for h in range(24)]
+    assert funding_count(hour+1800,3600).tolist() == [1 if h%8 == 7 else 0 for h in range(24)]
+    assert funding_count(np.arange(0,5*DAY,DAY,dtype='int64'),DAY).tolist() == [3]*5
+    assert funding_count(np.array([DAY+3600],dtype='int64'),DAY).tolist() == [3]
+    assert funding_count(np.arange(0,DAY,4*3600,dtype='int64')+7200,4*3600).tolist() == [0,1,0,1,0,1]
+    assert funding_count(np.array([FUNDING_INTERVAL-60],dtype='int64'),60).tolist() == [0]
+def test_funding_on_daily_and_unaligned_bars():
+    flat = [(100,100,100,100)]*4
+    # 1d bars : three funding times in each of the 3 bars after the entry
+    trade, = backtest(_candles(flat,0,DAY),[(0,_long(50.0))],0.025,1000.0,fee=0.0,funding_rate=0.0001,timesetup='1d')['trades']
+    assert trade['funding'] == pytest.approx(9*0.0001*trade['quantity']*100)
+    assert trade['pnl'] == pytest.approx(-trade['funding'])
+    # the interval is taken from the bars when timesetup is not given
+    inferred, = backtest(_candles(flat,0,DAY),[(0,_long(50.0))],0.025,1000.0,fee=0.0,funding_rate=0.0001)['trades']
+    assert inferred['funding'] == trade['funding']
+    # 1h bars from 06:30 : only the 07:30 bar holds 08:00 , the short receives it
+    trade, = backtest(_candles(flat,6*3600+1800),[(0,_short(200.0))],0.025,1000.0,fee=0.0,funding_rate=0.0001,timesetup='1h')['trades']
+    assert trade['funding'] == pytest.approx(-0.0001*trade['quantity']*100)
+    assert trade['pnl'] == pytest.approx(-trade['funding'])
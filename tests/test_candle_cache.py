@@ -0,0 +1,30 @@
+import numpy as np
+from benchmark import synthetic_candles
+from candle_cache import CandleCache, RECORD
+
+
+
+def _records(candles,start,stop):
+    records = np.zeros(stop-start,dtype=RECORD)
+    records['time'] = candles.time[start:stop]
+    records['close_time'] = (candles.time[start:stop]+60)*1000-1
+    for name in ('open','high','low','close'):
+        records[name] = getattr(candles,name)[start:stop]
+    return records
+def test_candles_after_every_bar(tmp_path):
+    candles = synthetic_candles(600,'1m',1)
+    cache = CandleCache('X','1m',path=str(tmp_path))
+    cache.append_records(_records(candles,0,500))
+    data = cache.candles()
+    assert data is cache.candles()
+    up = cache._up
+    for stop in range(501,601):
+        cache.append_records(_records(candles,stop-1,stop))
+        data = cache.candles()
+        assert len(data) == stop
+        assert data.bar(-1) == candles.bar(stop-1)
+    # the up column grew in place , only the new bars were computed
+    assert cache._up is up
+    assert np.array_equal(data.up,candles.up)
+    assert data == candles
+    assert CandleCache('X','1m',path=str(tmp_path)).candles() == candles
@@ -0,0 +1,62 @@
+import os
+import functools
+from benchmark import synthetic_candles
+from candle_store import CandleData
+from checkpoint import Checkpoint, records
+from strategy_method import strategy, TrendState
+
+
+
+def _same(a,b):
+    for name in TrendState.__slots__:
+        if name == 'trend_list':
+            assert list(a.trend_list) == list(b.trend_list)
+        else:
+            assert getattr(a,name) == getattr(b,name),name
+def _walk(checkpoint,candles,start,stop,data_dict=None):
+    '''
+    real mode : strategy and save after every bar from start to stop
+    '''
+    quiet = functools.partial(strategy,verbose=False,history=200)
+    data_dict = data_dict or {}
+    for n in range(start,stop+1):
+        view = CandleData.view(candles,0,n)
+        data_dict = quiet(view,{},data_dict)
+        checkpoint.save(data_dict,view)
+    return data_dict
+def test_log_restores_state(tmp_path):
+    candles = synthetic_candles(1500,'5m',2,volatility=0.01)
+    checkpoint = Checkpoint('X','5m',path=str(tmp_path),snapshot_bars=400)
+    data_dict = _walk(checkpoint,candles,300,1337)
+    log = open(checkpoint.log_path,'rb').read()
+    # snapshots at 300 , 700 , 1100 , one record for every later bar
+    assert len(records(log)) == 1337-1100
+    assert len(log) < 200*len(records(log))
+    state,candle_time = Checkpoint('X','5m',path=str(tmp_path)).load()
+    assert candle_time == int(candles.time[1336])
+    _same(state,data_dict['engine'].state)
+    checkpoint.close()
+def test_torn_record_keeps_previous_bar(tmp_path):
+    candles = synthetic_candles(800,'5m',3,volatility=0.01)
+    checkpoint = Checkpoint('X','5m',path=str(tmp_path),snapshot_bars=1000)
+    _walk(checkpoint,candles,300,500)
+    checkpoint.close()
+    expected = _walk(Checkpoint('Y','5m',path=str(tmp_path)),candles,300,499)['engine'].state
+    with open(checkpoint.log_path,'r+b') as f:
+        f.truncate(os.path.getsize(checkpoint.log_path)-3)
+    state,candle_time = Checkpoint('X','5m',path=str(tmp_path)).load()
+    assert state.i == 499
+    _same(state,expected)
+def test_resume_continues_like_full_run(tmp_path):
+    candles = synthetic_candles(1200,'5m',4,volatility=0.01)
+    checkpoint = Checkpoint('X','5m',path=str(tmp_path),snapshot_bars=250)
+    _walk(checkpoint,candles,300,900)
+    checkpoint.close()
+    restart = Checkpoint('X','5m',path=str(tmp_path),snapshot_bars=250)
+    data_dict = restart.resume(CandleData.view(candles,0,900))
+    assert data_dict['checkpoint'].i == 900
+    resumed = _walk(restart,candles,901,1200,data_dict)['engine'].state
+    restart.close()
+    full = _walk(Checkpoint('Z','5m',path=str(tmp_path)),candles,300,1200)['engine'].state
+    _same(resumed,full)
+    _same(Checkpoint('X','5m',path=str(tmp_path)).load()[0],full)
@@ -0,0 +1,37 @@
+import operator
+import numpy as np
+import pytest
+from benchmark import synthetic_candles
+from indicators import verify, make, _Rolling, RollingMin
+
+
+
+SPECS = {'sma':('sma',20),'ema':('ema',20),'atr':('atr',14),'rsi':('rsi',14),'max':('max',50),'min':('min',50),
+         'bb':('bollinger',20,2.0)}
+
+@pytest.mark.parametrize('split',[None,1234])
+@pytest.mark.parametrize('seed',[0,1])
+def test_batch_matches_update(seed,split):
+    candles = synthetic_candles(4000,'1m',seed,gap_rate=0.01)
+    result = verify(candles,SPECS,split)
+    assert set(result) >= {'sma','ema','atr','rsi','max','min','bb.mid','bb.upper','bb.lower'}
+    assert all(result.values()),result
+@pytest.mark.parametrize('kind',['sma','ema','rsi','max','min'])
+def test_extend_in_chunks_matches_update(kind):
+    values = synthetic_candles(3000,'1m',5).close
+    step = make((kind,30))
+    expect = np.array([step.update(x) for x in values])
+    chunks = make((kind,30))
+    got = np.concatenate([chunks.extend(values[a:a+b]) for a,b in ((0,7),(7,400),(407,1),(408,2592))])
+    assert np.array_equal(expect,got,equal_nan=True)
+    assert chunks.value == step.value or (np.isnan(chunks.value) and np.isnan(step.value))
+def test_rolling_order_is_a_constructor_argument():
+    values = synthetic_candles(500,'1m',6).low
+    low = _Rolling(25,'low',operator.lt,np.min)
+    expect = RollingMin(25)
+    for x in values:
+        assert low.update(x) == expect.update(x) or np.isnan(expect.value)
+    # default order is the rolling max
+    high = _Rolling(25,'high')
+    got = [high.update(x) for x in values]
+    assert got[-1] == values[-25:].max()
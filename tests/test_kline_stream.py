@@ -0,0 +1,41 @@
+import asyncio
+import numpy as np
+from benchmark import synthetic_candles
+from candle_store import CandleData
+from kline_stream import KlineStream, ReplayServer
+
+
+
+def test_reconnect_backfills_the_dropped_bars():
+    candles = synthetic_candles(15,'1m',4)
+    # the server closes the connection after every 4 bars and skips the next one , only backfill can add it
+    replay = ReplayServer(candles,'BNBBUSD','1m',drop_every=4,port=8767)
+    replay.sent = 3
+    data = CandleData(candles.time[:3],candles.open[:3],candles.high[:3],candles.low[:3],candles.close[:3],candles.tz_offset)
+    calls = []
+    backfilled = []
+    get_klines = replay.client.get_klines
+    def record(**kwargs):
+        klines = get_klines(**kwargs)
+        backfilled.extend(k[0] for k in klines)
+        return klines
+    replay.client.get_klines = record
+    stream = KlineStream('BNBBUSD','1m',data,lambda symbol,timesetup,kline:calls.append(kline[0]),
+                         client=replay.client,ws_url=replay.url)
+    async def run():
+        await replay.start()
+        stream.prepare()
+        task = asyncio.create_task(stream.run())
+        try:
+            stored = await stream.wait_closed(int(candles.time[-1])+60,timeout=15)
+        finally:
+            await stream.stop()
+            task.cancel()
+            await replay.stop()
+        return stored
+    assert asyncio.run(run())
+    # bar 7 and bar 12 were never sent on the stream , bars both backfilled and streamed are stored once
+    assert {int(candles.time[7])*1000,int(candles.time[12])*1000} <= set(backfilled)
+    assert data == candles
+    assert (np.diff(data.time) == 60).all()
+    assert calls == (candles.time[3:]*1000).tolist()
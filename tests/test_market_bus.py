@@ -0,0 +1,55 @@
+import time
+import threading
+from benchmark import synthetic_candles
+from candle_store import CandleData
+from market_bus import MarketBus
+
+
+
+SYMBOLS = ('BNBBUSD','BTCBUSD')
+
+def _bus(bars):
+    bus = MarketBus()
+    for n,symbol in enumerate(SYMBOLS):
+        bus.attach(symbol,'1m',CandleData(tz_offset=0,capacity=bars))
+    return bus,{symbol:synthetic_candles(bars,'1m',n) for n,symbol in enumerate(SYMBOLS)}
+def _append(bus,candles,i):
+    for symbol in SYMBOLS:
+        c = candles[symbol]
+        bus.append(symbol,'1m',int(c.time[i]),c.open[i],c.high[i],c.low[i],c.close[i])
+def test_coalesce_keeps_the_latest_bar_per_symbol():
+    bus,candles = _bus(10)
+    gate = threading.Event()
+    calls = {symbol:[] for symbol in SYMBOLS}
+    busy = {symbol:threading.Event() for symbol in SYMBOLS}
+    def slow(symbol,timesetup,data):
+        calls[symbol].append((len(data),int(data.time[-1])))
+        busy[symbol].set()
+        gate.wait(5)
+    subscriptions = [bus.subscribe(symbol,'1m',slow,policy='coalesce',mode='thread') for symbol in SYMBOLS]
+    _append(bus,candles,0)
+    assert all(busy[symbol].wait(5) for symbol in SYMBOLS)
+    # the consumers are stuck on bar 0 , bars 1 .. 9 replace each other in the one pending slot
+    for i in range(1,10):
+        _append(bus,candles,i)
+    gate.set()
+    assert all(s.drain(5) for s in subscriptions)
+    for symbol,s in zip(SYMBOLS,subscriptions):
+        last = int(candles[symbol].time[-1])
+        assert calls[symbol] == [(1,int(candles[symbol].time[0])),(10,last)]
+        assert s.stats()['coalesced'] == 8 and s.stats()['delivered'] == 2
+    assert bus.stats()['BNBBUSD-1m.coalesced'] == 8
+    bus.close()
+def test_block_never_drops_a_bar():
+    bus,candles = _bus(10)
+    calls = []
+    def slow(symbol,timesetup,data):
+        time.sleep(0.01)
+        calls.append(int(data.time[-1]))
+    subscription = bus.subscribe('BNBBUSD','1m',slow,policy='block',mode='thread')
+    for i in range(10):
+        _append(bus,candles,i)
+    assert subscription.drain(5)
+    assert calls == candles['BNBBUSD'].time.tolist()
+    assert subscription.coalesced == 0 and subscription.blocked > 0
+    bus.close()
@@ -0,0 +1,89 @@
+import time
+import pytest
+from benchmark import MockClient
+from binance_api import ExchangeSession, RequestScheduler, getbinancemethod
+from market_state import MarketState, StreamServer
+
+
+
+def _session(latency=0.0):
+    return ExchangeSession(None,None,cache_path=None,scheduler=RequestScheduler(),client=MockClient(latency=latency))
+def _until(check,timeout=5):
+    deadline = time.time()+timeout
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.01)
+    return False
+def _mark(symbol,price):
+    return {'stream':symbol.lower()+'@markPrice@1s','data':{'e':'markPriceUpdate','s':symbol,'p':str(price)}}
+def _account_update(amount,entry,cross_wallet):
+    return {'e':'ACCOUNT_UPDATE','a':{'B':[{'a':'BUSD','wb':str(cross_wallet),'cw':str(cross_wallet)}],
+                                     'P':[{'s':'BNBBUSD','pa':str(amount),'ep':str(entry),'up':'0'}]}}
+@pytest.fixture
+def server():
+    server = StreamServer().start()
+    yield server
+    server.stop()
+def test_available_balance_subtracts_initial_margin():
+    session = _session()
+    session.refresh_account()
+    session.positions['BNBBUSD']['leverage'] = '10'
+    state = MarketState(session,['BNBBUSD'])
+    state.handle(_account_update(2,300,999.5))
+    assert float(session.asset('BUSD')['availableBalance']) == pytest.approx(999.5-60)
+    state.handle({'e':'ACCOUNT_UPDATE','a':{'B':[],'P':[{'s':'BNBBUSD','pa':'0','ep':'0','up':'0'}]}})
+    assert float(session.asset('BUSD')['availableBalance']) == pytest.approx(999.5)
+def test_streams_from_stand_in(server):
+    session = _session()
+    state = MarketState(session,['BNBBUSD'],ws_url=server.url,stale=5).start()
+    try:
+        assert session.live
+        assert _until(lambda:server.connections.get('/stream',0) == 1)
+        assert _until(lambda:server.send(_mark('BNBBUSD',301.5),'/stream') == 1)
+        assert _until(lambda:session.mark_prices.get('BNBBUSD') == 301.5)
+        server.send(_account_update(1,300,1000),'/ws/listenkey')
+        assert _until(lambda:session.position('BNBBUSD')['positionAmt'] == '1')
+    finally:
+        state.stop()
+def test_account_download_does_not_stall_mark_prices(server):
+    session = _session(latency=1.5)
+    state = MarketState(session,['BNBBUSD'],ws_url=server.url,stale=5).start(timeout=0)
+    try:
+        assert _until(lambda:server.connections.get('/stream',0) == 1)
+        sent = time.time()
+        server.send(_mark('BNBBUSD',302.0),'/stream')
+        assert _until(lambda:session.mark_prices.get('BNBBUSD') == 302.0,timeout=1)
+        assert time.time()-sent < 1
+        assert not session.live
+    finally:
+        state.stop()
+def test_silent_mark_price_stream_reconnects(server):
+    session = _session()
+    state = MarketState(session,['BNBBUSD'],ws_url=server.url,user_stream=False,stale=0.3).start()
+    try:
+        assert _until(lambda:server.connections.get('/stream',0) >= 2,timeout=5)
+    finally:
+        state.stop()
+def test_reconnect_reloads_open_orders_to_cancel(server):
+    client = MockClient()
+    cancelled = []
+    client.futures_cancel_orders = lambda symbol,orderidlist:cancelled.append(list(orderidlist)) or []
+    # closePosition stop left on the book before the restart
+    client.open_orders = [{'symbol':'BNBBUSD','orderId':77,'clientOrderId':'old','side':'SELL','type':'STOP_MARKET',
+                           'origQty':'0','stopPrice':'280','status':'NEW'}]
+    session = ExchangeSession(None,None,cache_path=None,scheduler=RequestScheduler(),client=client)
+    state = MarketState(session,[],ws_url=server.url,stale=5).start()
+    try:
+        assert session.live
+        assert list(session.open_orders['BNBBUSD']) == [77]
+        # stop placed while the user stream was down , found by the download after the reconnect
+        client.open_orders.append(dict(client.open_orders[0],orderId=88))
+        server.send({'e':'listenKeyExpired'},'/ws/listenkey')
+        assert _until(lambda:server.connections.get('/ws/listenkey',0) == 2 and session.live)
+        assert _until(lambda:list(session.open_orders.get('BNBBUSD',{})) == [77,88])
+        api = getbinancemethod(None,None,session)
+        assert api.open_position('long','BNBBUSD',1.0,290.0)
+        assert cancelled == [[77,88]]
+    finally:
+        state.stop()
@@ -0,0 +1,45 @@
+import sys
+import threading
+import metrics
+from metrics import Metrics, Histogram
+
+
+
+def test_fold_keeps_values_written_by_other_threads(monkeypatch):
+    monkeypatch.setattr(metrics,'FOLD',64)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    histogram = Histogram()
+    threads = 8
+    each = 20000
+    def write():
+        for n in range(each):
+            histogram.record(1000)
+    workers = [threading.Thread(target=write) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for n in range(200):
+        histogram.fold()
+    for worker in workers:
+        worker.join()
+    sys.setswitchinterval(interval)
+    histogram.fold()
+    assert histogram.count == threads*each
+    assert histogram.total == threads*each*1000
+def test_stage_is_reusable():
+    m = Metrics()
+    stage = m.stage('strategy')
+    for n in range(10):
+        with stage:
+            pass
+    with m.span('strategy'):
+        pass
+    assert m.histogram('strategy').summary()['count'] == 11
+def test_source_errors_go_to_journal(monkeypatch):
+    events = []
+    monkeypatch.setattr(metrics.JOURNAL,'error',lambda kind,**fields:events.append((kind,fields)))
+    m = Metrics()
+    m.source('broken',lambda:1/0)
+    m.count('ok')
+    assert m.values() == {'ok':1}
+    assert events[0][0] == 'error' and events[0][1]['name'] == 'broken'
@@ -0,0 +1,59 @@
+import asyncio
+from benchmark import MockClient, synthetic_candles
+from binance_api import ExchangeSession, RequestScheduler
+from candle_cache import CandleCache
+from candle_store import CandleData
+from kline_stream import ReplayServer
+from main import script
+from orchestrator import Orchestrator
+
+
+
+WARM = 30
+
+def test_one_close_gives_one_strategy_call_and_one_order(tmp_path):
+    candles = synthetic_candles(WARM+1,'1m',7)
+    replay = ReplayServer(candles,'BNBBUSD','1m',port=8768)
+    # the cache holds the history , only the last bar comes from the stream
+    replay.sent = WARM
+    cache = CandleCache('BNBBUSD','1m',str(tmp_path))
+    cache.append_klines([replay.kline(i) for i in range(WARM)])
+    client = MockClient(CandleData.view(candles,0,WARM))
+    batches = []
+    place = client.futures_place_batch_order
+    def batch_order(batchOrders):
+        batches.append(batchOrders)
+        return place(batchOrders)
+    client.futures_place_batch_order = batch_order
+    session = ExchangeSession(None,None,cache_path=None,scheduler=RequestScheduler(),client=client)
+    calls = []
+    def strategy(shortdata,longdata,data_dict):
+        calls.append(len(shortdata))
+        action = {}
+        if len(shortdata) == WARM+1:
+            action = {'method':'open','position':'long','stoploss':float(shortdata.close[-1])*0.9}
+        return {'action':action}
+    orchestrator = Orchestrator(session,ws_url=replay.url)
+    orchestrator.caches[('BNBBUSD','1m')] = cache
+    orchestrator.add(script('BNBBUSD','1m',None,0.025,strategy,resample=False,checkpoint=False))
+    async def run():
+        await replay.start()
+        orchestrator.prepare()
+        task = asyncio.create_task(orchestrator._main())
+        try:
+            for n in range(500):
+                if len(calls) > 1 and len(batches) > 0:
+                    break
+                await asyncio.sleep(0.01)
+            # nothing more arrives after the one close
+            await asyncio.sleep(0.2)
+        finally:
+            orchestrator.bus.close()
+            await orchestrator.feed.stop()
+            task.cancel()
+            await replay.stop()
+    asyncio.run(run())
+    assert calls == [WARM,WARM+1]
+    assert len(batches) == 1
+    assert [order['type'] for order in batches[0]] == ['MARKET','STOP_MARKET']
+    assert len(cache) == WARM+1
@@ -0,0 +1,40 @@
+from benchmark import MockClient
+from binance_api import ExchangeSession, RequestScheduler, getbinancemethod
+
+
+
+class BatchClient(MockClient):
+    def __init__(self,**kwargs):
+        MockClient.__init__(self,**kwargs)
+        self.batches = []
+    def futures_place_batch_order(self,batchOrders):
+        self.batches.append(batchOrders)
+        return MockClient.futures_place_batch_order(self,batchOrders)
+def _api():
+    client = BatchClient()
+    session = ExchangeSession(None,None,cache_path=None,scheduler=RequestScheduler(),client=client)
+    return getbinancemethod(None,None,session),client
+def test_batch_quantity_is_fixed_point_at_step_size():
+    api,client = _api()
+    assert api.open_position('long','BNBBUSD',0.1+0.2,290.0)
+    assert api.open_position('short','BNBBUSD',2.0000000001,310.0)
+    quantities = [batch[0]['quantity'] for batch in client.batches]
+    assert quantities == ['0.30','2.00']
+def test_quantity_below_step_size_is_not_sent():
+    api,client = _api()
+    assert not api.open_position('long','BNBBUSD',1e-05,290.0)
+    assert client.batches == []
+def test_batch_counts_every_order():
+    api,client = _api()
+    before = api.scheduler.order_count
+    api.open_position('long','BNBBUSD',1.0,290.0)
+    cancels = 1
+    assert api.scheduler.order_count-before == len(client.batches[0])+cancels
+def test_close_quantity_is_fixed_point_at_step_size():
+    api,client = _api()
+    sent = []
+    create = client.futures_create_order
+    client.futures_create_order = lambda **params:sent.append(params) or create(**params)
+    api.session.positions['BNBBUSD']['positionAmt'] = str(0.1+0.2)
+    assert api.close_position('long','BNBBUSD')
+    assert [(p['side'],p['quantity'],p['reduceOnly']) for p in sent] == [('SELL','0.30','true')]
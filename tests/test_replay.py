@@ -0,0 +1,64 @@
+import functools
+import pytest
+from candle_store import CandleData
+from benchmark import synthetic_candles
+from backtest import collect_actions
+from strategy_method import strategy
+from journal import JOURNAL
+from main import script
+from replay import Replay
+
+
+
+@pytest.fixture
+def events(monkeypatch):
+    '''
+    journal events of the test , nothing is written to disk
+    '''
+    events = []
+    monkeypatch.setattr(JOURNAL,'event',lambda kind,level=20,**fields:events.append(kind))
+    return events
+def _script(long_period='1h',resample=True):
+    return script('BNBBUSD','5m',long_period,0.025,functools.partial(strategy,verbose=False),resample,False)
+def test_advance_matches_view():
+    candles = synthetic_candles(300,'5m',3)
+    walk = CandleData.view(candles,0,len(candles))
+    walk.advance(10)
+    assert walk.position(int(candles.time[5])) == 5
+    for stop in (11,150,300):
+        walk.advance(stop)
+        assert walk == CandleData.view(candles,0,stop)
+        assert walk.position(int(candles.time[stop-1])) == stop-1
+    walk.advance(20)
+    assert walk.position(int(candles.time[100])) == None
+    with pytest.raises(IndexError):
+        walk.advance(301)
+def _seen(shortdata,longdata,data_dict):
+    '''
+    strategy whose action is what it was shown ( bars , last close of both periods )
+    '''
+    last = float(longdata.close[-1]) if len(longdata) > 0 else None
+    return {'action':{'bars':len(shortdata),'close':float(shortdata.close[-1]),'long_bars':len(longdata),'long_close':last}}
+def test_collect_actions_matches_view_per_bar():
+    short = synthetic_candles(3000,'5m',1)
+    long = synthetic_candles(260,'1h',1)
+    long_close = long.time+3600
+    expected = []
+    for i in range(len(short)):
+        count = int(long_close.searchsorted(short.time[i]+300,side='right'))
+        expected.append((i,_seen(CandleData.view(short,0,i+1),CandleData.view(long,0,count),{})['action']))
+    assert collect_actions(_seen,short,long,'5m','1h') == expected
+    assert len(set(action['long_bars'] for i,action in expected)) > 200
+def test_replay_needs_long_candles_without_resample(events):
+    candles = synthetic_candles(200,'5m',2)
+    with pytest.raises(ValueError,match='long_candles'):
+        Replay(_script(resample=False),candles,None,100)
+    with pytest.raises(ValueError,match='warmup'):
+        Replay(_script(),candles,None,500)
+def test_replay_runs_every_bar(events,capsys):
+    candles = synthetic_candles(1200,'5m',4,volatility=0.01)
+    sample = dict(JOURNAL.sample)
+    result = Replay(_script(),candles,None,200).run()
+    capsys.readouterr()
+    assert result['bars'] == 1000
+    assert JOURNAL.sample == sample
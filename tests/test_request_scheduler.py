@@ -0,0 +1,82 @@
+import pytest
+import requests
+from binance_api import RequestScheduler, CircuitOpenError
+from backfill import Backfill, HttpKlines, KlineServer
+from benchmark import synthetic_candles
+
+
+
+def _http_error(status,retry_after='0.05'):
+    response = requests.Response()
+    response.status_code = status
+    response.headers['Retry-After'] = retry_after
+    return requests.HTTPError(str(status)+' error',response=response)
+class Flaky:
+    def __init__(self,errors):
+        self.errors = list(errors)
+        self.calls = 0
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+def _scheduler(**kwargs):
+    return RequestScheduler(base_delay=0.01,max_delay=0.02,breaker_failures=3,**kwargs)
+def test_http_429_waits_retry_after_and_does_not_trip_breaker():
+    scheduler = _scheduler()
+    function = Flaky([_http_error(429)]*5)
+    assert scheduler.call(function) == 'ok'
+    assert function.calls == 6
+    assert scheduler.failures == 0
+    assert scheduler.stats['breaker_trips'] == 0
+    assert scheduler.blocked_until > 0
+def test_http_418_trips_breaker():
+    scheduler = _scheduler()
+    with pytest.raises(requests.HTTPError):
+        scheduler.call(Flaky([_http_error(418,'30')]))
+    with pytest.raises(CircuitOpenError):
+        scheduler.call(Flaky([]))
+def test_http_4xx_is_raised_at_once():
+    scheduler = _scheduler()
+    function = Flaky([_http_error(400)])
+    with pytest.raises(requests.HTTPError):
+        scheduler.call(function)
+    assert function.calls == 1
+def test_server_errors_open_the_breaker():
+    scheduler = _scheduler(retries=0)
+    for n in range(3):
+        with pytest.raises(requests.HTTPError):
+            scheduler.call(Flaky([_http_error(503)]))
+    with pytest.raises(CircuitOpenError):
+        scheduler.call(Flaky([]))
+def test_backfill_through_rate_limited_stand_in(tmp_path):
+    candles = synthetic_candles(12000,'1m',4,gap_rate=0)
+    server = KlineServer({('BNBBUSD','1m'):candles},weight_limit=8,window=1).start()
+    try:
+        scheduler = RequestScheduler(base_delay=0.05,max_delay=0.2)
+        fetch = HttpKlines(server.url,scheduler=scheduler,pool_size=4)
+        result = Backfill(fetch,workers=4,path=str(tmp_path)).run(['BNBBUSD'],['1m'],int(candles.time[0])*1000,
+                                                                   now=(int(candles.time[-1])+60)*1000)
+    finally:
+        server.stop()
+    assert result['BNBBUSD-1m']['error'] is None
+    assert result['BNBBUSD-1m']['bars'] == len(candles)
+    assert scheduler.stats['rate_limited'] > 0
+    assert scheduler.stats['breaker_trips'] == 0
+def test_paced_client_charges_every_page():
+    class Client:
+        def __init__(self):
+            self.session = requests.Session()
+            self.pages = 0
+        def _klines(self,klines_type=None,**kwargs):
+            self.pages += 1
+            return []
+        def get_historical_klines(self,symbol,interval,pages=3):
+            for n in range(pages):
+                self._klines(symbol=symbol,interval=interval)
+    scheduler = RequestScheduler()
+    client = scheduler.paced(Client())
+    client.get_historical_klines('BNBBUSD','1m')
+    assert client.pages == 3
+    assert scheduler.stats['calls'] == 3
+    assert scheduler.used_weight['spot'] == 6
@@ -0,0 +1,39 @@
+import os
+import glob
+import pytest
+from benchmark import synthetic_candles, START
+from candle_store import CandleData
+from resample import Resampler, resample, verify_fixture
+
+
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__),'fixtures','klines-*.json')))
+
+def test_fixtures_exist():
+    assert len(FIXTURES) > 0
+@pytest.mark.parametrize('path',FIXTURES,ids=os.path.basename)
+def test_fixture_resamples_exactly(path):
+    result = verify_fixture(path)
+    assert set(result) == {'1h','4h','1d'}
+    for timesetup,r in result.items():
+        assert r['bars'] > 0,timesetup
+        assert r['mismatch'] == 0 and r['missing'] == 0 and r['extra'] == 0,(timesetup,r)
+def _add_all(resampler,candles):
+    for i in range(len(candles)):
+        resampler.add(int(candles.time[i]),candles.open[i],candles.high[i],candles.low[i],candles.close[i])
+    return resampler
+def test_partial_first_bar_is_dropped():
+    candles = synthetic_candles(600,'5m',9)
+    # 5m bars from 00:35 , the 00:00 bar is not complete
+    late = CandleData.view(candles,7,len(candles))
+    hours = resample(late,'1h','5m')
+    assert int(hours.time[0]) == START+3600
+    assert hours == CandleData.view(resample(candles,'1h','5m'),1,1+len(hours))
+    assert _add_all(Resampler('1h','5m',late.tz_offset),late).data == hours
+    assert Resampler.from_history(CandleData.view(late,0,3),'1h','5m').data == CandleData(tz_offset=late.tz_offset)
+    assert _add_all(Resampler.from_history(CandleData.view(late,0,3),'1h','5m'),CandleData.view(late,3,len(late))).data == hours
+def test_resampler_matches_resample():
+    candles = synthetic_candles(3000,'1m',8,gap_rate=0.01)
+    for timesetup in ('1h','4h','1d'):
+        step = _add_all(Resampler(timesetup,'1m',candles.tz_offset),candles)
+        assert step.data == resample(candles,timesetup,'1m')
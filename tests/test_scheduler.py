@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from replay import VirtualClock
+from scheduler import BarScheduler, next_close
+
+
+
+MONDAY = 1704067200
+
+@pytest.mark.parametrize('timesetup,now,close',[
+    ('1m',MONDAY,MONDAY+60),('1m',MONDAY+30,MONDAY+60),('1m',MONDAY+59.999,MONDAY+60),('1m',MONDAY+60,MONDAY+120),
+    ('1h',MONDAY,MONDAY+3600),('1h',MONDAY+3599,MONDAY+3600),('1h',MONDAY+3600,MONDAY+7200),
+    ('4h',MONDAY,MONDAY+14400),('4h',MONDAY+3*3600,MONDAY+14400),('4h',MONDAY+14399.5,MONDAY+14400),('4h',MONDAY+14400,MONDAY+28800),
+    ('1d',MONDAY,MONDAY+86400),('1d',MONDAY+12*3600,MONDAY+86400),('1d',MONDAY+86399.5,MONDAY+86400),('1d',MONDAY-1,MONDAY),
+    ('1w',MONDAY,MONDAY+7*86400),('1w',MONDAY-1,MONDAY),('1w',MONDAY+3*86400,MONDAY+7*86400),
+])
+def test_next_close(timesetup,now,close):
+    # a time exactly on a boundary is the open of the next bar , its close is one bar later
+    assert next_close(now,timesetup) == close
+def test_bar_scheduler_wakes_after_every_close():
+    clock = VirtualClock(MONDAY+30.5)
+    sleeps = []
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        await clock.sleep(seconds)
+    scheduler = BarScheduler(1.0,clock=clock.time,sleep=sleep)
+    minutes = []
+    hours = []
+    async def on_minute(symbol,timesetup,close_time):
+        minutes.append((close_time,clock.time()))
+        if len(minutes) == 150:
+            scheduler.stop()
+    def on_hour(symbol,timesetup,close_time):
+        hours.append((symbol,timesetup,close_time))
+    scheduler.add('BNBBUSD','1m',on_minute)
+    scheduler.add('BTCBUSD','1h',on_hour,grace=2.0)
+    asyncio.run(scheduler.run())
+    # the first wait is to the next close plus grace
+    assert sleeps[0] == pytest.approx(30.5)
+    assert [t for t,now in minutes] == [MONDAY+60*(n+1) for n in range(150)]
+    assert all(now == pytest.approx(t+1.0) for t,now in minutes)
+    assert hours == [('BTCBUSD','1h',MONDAY+3600),('BTCBUSD','1h',MONDAY+7200)]
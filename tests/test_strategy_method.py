@@ -0,0 +1,53 @@
+import functools
+import pytest
+from candle_store import CandleData
+from benchmark import synthetic_candles
+from strategy_method import strategy, TrendStrategy
+from legacy_strategy import strategy as legacy_strategy
+
+
+
+def _as_dict(candles):
+    '''
+    old Symbol_data format : {'2022-05-20 08:00:00':{'close','low','open','high','rg'} ....}
+    '''
+    return {label:candles.bar(i) for i,label in enumerate(candles.labels())}
+def _run(candles,steps,function,data):
+    '''
+    call the strategy like real mode : all bars up to stop , for every stop in steps
+    '''
+    data_dict = {}
+    actions = []
+    for stop in steps:
+        data_dict = function(data(candles,stop),{},data_dict)
+        actions.append(dict(data_dict['action']))
+    return data_dict,actions
+@pytest.mark.parametrize('seed',[0,1,2])
+def test_on_bar_matches_legacy_strategy(seed,capsys):
+    candles = synthetic_candles(1500,'5m',seed,volatility=0.01)
+    bars = _as_dict(candles)
+    keys = list(bars)
+    steps = [300]+list(range(301,len(candles)+1,7))+[len(candles)]
+    old,old_actions = _run(candles,steps,legacy_strategy,lambda c,stop:{k:bars[k] for k in keys[:stop]})
+    quiet = functools.partial(strategy,verbose=False,history=None)
+    new,new_actions = _run(candles,steps,quiet,lambda c,stop:CandleData.view(c,0,stop))
+    capsys.readouterr()
+    assert new_actions == old_actions
+    for key in ('last','find_trend_mode','state','success_mode','marginstate','buy_info','num_state','i'):
+        assert new[key] == old[key],key
+    assert list(new['trend_list']) == old['trend_list']
+def test_dict_input_matches_candle_data(capsys):
+    candles = synthetic_candles(800,'1h',5,volatility=0.01)
+    old = legacy_strategy(_as_dict(candles),{},{})
+    new = strategy(_as_dict(candles),{},{},verbose=False,history=None)
+    capsys.readouterr()
+    assert list(new['trend_list']) == old['trend_list']
+    assert new['state'] == old['state']
+def test_trend_list_keeps_last_history_entries(capsys):
+    candles = synthetic_candles(1000,'5m',3,volatility=0.01)
+    old = legacy_strategy(_as_dict(candles),{},{})
+    capsys.readouterr()
+    engine = TrendStrategy(history=50,verbose=False)
+    engine.run(candles)
+    assert len(old['trend_list']) > 50
+    assert list(engine.state.trend_list) == old['trend_list'][-50:]
@@ -0,0 +1,36 @@
+import pytest
+import strategy_method
+from benchmark import synthetic_candles
+from candle_store import CandleData
+from strategy_method import TrendStrategy, TrendState
+from trend_kernel import verify, run_bars, trend_batch
+
+
+
+def _state(s):
+    return (s.last,s.find_trend_mode,s.lowest,s.highest,s.newlowest,s.newhighest,s.revert,s.success_mode,s.i,list(s.trend_list))
+@pytest.mark.parametrize('use_numba',[True,False])
+@pytest.mark.parametrize('seed',[0,1])
+def test_trend_batch_matches_on_bar(seed,use_numba):
+    candles = synthetic_candles(20000,'1m',seed,volatility=0.004,gap_rate=0.01)
+    for split in (None,7777):
+        result = verify(candles,use_numba,split)
+        assert result['mismatch'] == 0 and result['state'],(split,result)
+def test_run_dispatch_matches_on_bar(monkeypatch):
+    # TrendStrategy.run hands long histories to trend_batch , the result must be the one of on_bar
+    monkeypatch.setattr(strategy_method,'BATCH_BARS',1000)
+    candles = synthetic_candles(12000,'1m',2,volatility=0.004)
+    engine = TrendStrategy(verbose=False)
+    engine.run(candles)
+    reference = TrendState()
+    run_bars(candles,reference)
+    assert _state(engine.state) == _state(reference)
+def test_trend_batch_continues_on_bar_state():
+    candles = synthetic_candles(6000,'1m',3,volatility=0.004)
+    reference = TrendState()
+    expect = run_bars(candles,reference)
+    state = TrendState()
+    run_bars(CandleData.view(candles,0,2500),state)
+    got = trend_batch(candles.open,candles.high,candles.low,candles.close,state)
+    assert (got[0] == expect[0][2500:]).all()
+    assert _state(state) == _state(reference)
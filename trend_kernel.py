@@ -0,0 +1,274 @@
+import sys
+import time
+import numpy as np
+from strategy_method import TrendState, TrendStrategy
+
+
+
+NONE = 0
+UPTREND = 1
+DOWNTREND = 2
+TRENDS = {UPTREND:'uptrend',DOWNTREND:'downtrend'}
+MODES = {None:NONE,'uptrend':UPTREND,'downtrend':DOWNTREND}
+_KERNEL = []
+
+def _trend(open,close,start,stop,mode,lowest,highest,newlowest,newhighest,revert,success,first,
+           out_trend,out_lowest,out_highest,out_success,offset):
+    '''
+    TrendStrategy.on_bar on bars start .. stop-1 , state in scalars , nan is None
+        first : rg of the first bar ( 1 up , 0 down , -1 no bar yet )
+        out_* [i-offset] : trend / lowest / highest after bar i , success is True when on_bar appended the trend twice
+    '''
+    for i in range(start,stop):
+        o = open[i]
+        c = close[i]
+        up = c >= o
+        j = i-offset
+        if first == -1:
+            first = 1 if up else 0
+            out_trend[j] = NONE
+            out_lowest[j] = np.nan
+            out_highest[j] = np.nan
+            out_success[j] = False
+            continue
+        if mode == NONE:
+            if first == 1:
+                mode = UPTREND
+                lowest = o
+                highest = c
+            else:
+                mode = DOWNTREND
+                lowest = c
+                highest = o
+            newlowest = np.nan
+            newhighest = np.nan
+            revert = False
+        if mode == UPTREND:
+            if up:
+                if c > highest:
+                    highest = c
+                    if revert:
+                        lowest = newlowest
+                        revert = False
+                        newlowest = np.nan
+                        success = True
+            else:
+                if c < lowest:
+                    mode = DOWNTREND
+                    revert = False
+                    newlowest = np.nan
+                    newhighest = np.nan
+                    success = False
+                else:
+                    if newlowest != newlowest or c < newlowest:
+                        newlowest = c
+                    revert = True
+                    if o > highest:
+                        highest = o
+        else:
+            if not up:
+                if c < lowest:
+                    lowest = c
+                    if revert:
+                        highest = newhighest
+                        revert = False
+                        newhighest = np.nan
+                        success = True
+            else:
+                if c > highest:
+                    mode = UPTREND
+                    revert = False
+                    newlowest = np.nan
+                    newhighest = np.nan
+                    success = False
+                else:
+                    if newhighest != newhighest or c > newhighest:
+                        newhighest = c
+                    revert = True
+                    if o < lowest:
+                        lowest = o
+        out_trend[j] = mode
+        out_lowest[j] = lowest
+        out_highest[j] = highest
+        out_success[j] = success
+    return mode,lowest,highest,newlowest,newhighest,revert,success,first
+def kernel():
+    '''
+    _trend compiled by numba ( imported on first use , cached on disk ) , or None without numba
+    '''
+    if len(_KERNEL) == 0:
+        try:
+            from numba import njit
+            _KERNEL.append(njit(cache=True,nogil=True)(_trend))
+        except ImportError:
+            _KERNEL.append(None)
+    return _KERNEL[0]
+def _float(value):
+    if value is None:
+        return np.nan
+    return float(value)
+def _value(value):
+    if value != value:
+        return None
+    return float(value)
+def trend_batch(open,high,low,close,state=None,out=None,use_numba=True):
+    '''
+    batch mode of TrendStrategy.on_bar over numpy arrays , no python object for each bar
+        args:
+            open , high , low , close (np.ndarray float64) : all bars , bars before state.i are already in state
+            state (TrendState) : continued and updated in place ( i , trend_list , ... ) , default a new one
+            out (tuple) : preallocated (trend int8 , lowest float64 , highest float64 , success bool) of len(open)-state.i
+            use_numba (bool) : False runs the same kernel in python ( fallback without numba )
+        return:
+            (trend , lowest , highest , success) : after each new bar , trend 1 uptrend 2 downtrend 0 first bar ,
+                                                   success True where on_bar appended the trend twice
+    Notice:
+        state after trend_batch is the same as after on_bar for every bar , trend_list keeps its last maxlen entries
+    '''
+    if state is None:
+        state = TrendState()
+    start = state.i
+    stop = len(open)
+    n = stop-start
+    if out is None:
+        out = (np.empty(n,dtype='int8'),np.empty(n,dtype='float64'),np.empty(n,dtype='float64'),np.empty(n,dtype=bool))
+    first = -1
+    if state.last is not None:
+        first = 1 if state.last['rg'] == 'up' else 0
+    args = (MODES[state.find_trend_mode],_float(state.lowest),_float(state.highest),_float(state.newlowest),_float(state.newhighest),
+            bool(state.revert),bool(state.success_mode),first)
+    function = kernel() if use_numba else None
+    if function is not None:
+        result = function(np.ascontiguousarray(open,dtype='float64'),np.ascontiguousarray(close,dtype='float64'),start,stop,*args,*out,start)
+    else:
+        lists = ([0]*n,[0.0]*n,[0.0]*n,[False]*n)
+        result = _trend(np.asarray(open,dtype='float64').tolist(),np.asarray(close,dtype='float64').tolist(),start,stop,*args,*lists,start)
+        for array,values in zip(out,lists):
+            array[:] = values
+    mode,lowest,highest,newlowest,newhighest,revert,success,first = result
+    if state.last is None and n > 0:
+        state.last = {'close':float(close[start]),'low':float(low[start]),'open':float(open[start]),'high':float(high[start]),
+                      'rg':'up' if first == 1 else 'down'}
+    state.find_trend_mode = TRENDS.get(int(mode))
+    state.lowest = _value(lowest)
+    state.highest = _value(highest)
+    state.newlowest = _value(newlowest)
+    state.newhighest = _value(newhighest)
+    state.revert = bool(revert)
+    state.success_mode = bool(success)
+    _extend(state.trend_list,out)
+    state.i = stop
+    return out
+def _extend(trend_list,out):
+    '''
+    append the entries on_bar would append , only the ones kept by the deque are built
+    '''
+    trend,lowest,highest,success = out
+    keep = trend_list.maxlen
+    size = len(trend)
+    if keep is not None:
+        start = size
+        count = 0
+        while start > 0 and count < keep:
+            start -= 1
+            if trend[start] != NONE:
+                count += 1+bool(success[start])
+    else:
+        start = 0
+    for t,l,h,s in zip(trend[start:].tolist(),lowest[start:].tolist(),highest[start:].tolist(),success[start:].tolist()):
+        if t == NONE:
+            continue
+        data = {'trend':TRENDS[t],'lowest':l,'highest':h}
+        if s:
+            trend_list.append(data)
+            data = dict(data)
+        trend_list.append(data)
+def run_bars(candles,state=None):
+    '''
+    TrendStrategy.on_bar for every bar of candles ( the reference for trend_batch )
+        return:
+            (trend , lowest , highest , success) , same format as trend_batch
+    '''
+    engine = TrendStrategy(None,verbose=False)
+    if state is not None:
+        engine.state = state
+    start = engine.state.i
+    n = len(candles)-start
+    out = (np.empty(n,dtype='int8'),np.empty(n,dtype='float64'),np.empty(n,dtype='float64'),np.empty(n,dtype=bool))
+    s = engine.state
+    trend_list = s.trend_list
+    for i in range(start,len(candles)):
+        # last entry before the bar , the length does not grow once the deque is full
+        before = trend_list[-1] if len(trend_list) > 0 else None
+        engine.on_bar(candles.bar(i))
+        j = i-start
+        if s.find_trend_mode == None:
+            out[0][j] = NONE
+            out[1][j] = out[2][j] = np.nan
+            out[3][j] = False
+            continue
+        out[0][j] = MODES[s.find_trend_mode]
+        out[1][j] = _float(s.lowest)
+        out[2][j] = _float(s.highest)
+        out[3][j] = len(trend_list) >= 2 and trend_list[-2] is not before
+    return out
+def verify(candles,use_numba=True,split=None):
+    '''
+    differential check of trend_batch against on_bar
+        args:
+            candles (CandleData)
+            split (int) : run trend_batch on bars before split , then continue from the state ( like real mode )
+        return:
+            dict : {'bars' , 'mismatch' , 'first' , 'state'} , state is True when both TrendState are the same
+    '''
+    # reference is on_bar bar by bar , TrendStrategy.run would dispatch to trend_batch itself
+    r = TrendState()
+    expect = run_bars(candles,r)
+    state = TrendState()
+    if split is None:
+        got = trend_batch(candles.open,candles.high,candles.low,candles.close,state,use_numba=use_numba)
+    else:
+        head = trend_batch(candles.open[:split],candles.high[:split],candles.low[:split],candles.close[:split],state,use_numba=use_numba)
+        tail = trend_batch(candles.open,candles.high,candles.low,candles.close,state,use_numba=use_numba)
+        got = tuple(np.concatenate(pair) for pair in zip(head,tail))
+    same = np.ones(len(candles),dtype=bool)
+    for a,b in zip(expect,got):
+        same &= (a == b) | (np.isnan(a) & np.isnan(b) if a.dtype.kind == 'f' else False)
+    state_same = (r.last,r.find_trend_mode,r.lowest,r.highest,r.newlowest,r.newhighest,r.revert,r.success_mode,r.i,list(r.trend_list)) == \
+                 (state.last,state.find_trend_mode,state.lowest,state.highest,state.newlowest,state.newhighest,state.revert,state.success_mode,
+                  state.i,list(state.trend_list))
+    first = None
+    if not same.all():
+        first = int(np.flatnonzero(~same)[0])
+    return {'bars':len(candles),'mismatch':int((~same).sum()),'first':first,'state':state_same}
+def speed(candles,use_numba=True):
+    '''
+    seconds of on_bar ( called for every bar ) and trend_batch on candles
+    Notice:
+        both are run once before they are timed , so compile time of numba and cold caches are not included
+    '''
+    warm = TrendStrategy(verbose=False)
+    for n in range(min(len(candles),10000)):
+        warm.on_bar(candles.bar(n))
+    engine = TrendStrategy(verbose=False)
+    start = time.perf_counter()
+    for n in range(len(candles)):
+        engine.on_bar(candles.bar(n))
+    loop = time.perf_counter()-start
+    trend_batch(candles.open,candles.high,candles.low,candles.close,use_numba=use_numba)
+    start = time.perf_counter()
+    trend_batch(candles.open,candles.high,candles.low,candles.close,use_numba=use_numba)
+    batch = time.perf_counter()-start
+    return {'bars':len(candles),'on_bar':loop,'batch':batch,'speedup':loop/batch}
+if __name__ == '__main__':
+    '''
+    python trend_kernel.py [history csv ....] : differential check on synthetic bars and recorded history , then speed on 1M bars
+    '''
+    from candle_store import CandleData
+    from benchmark import synthetic_candles
+    sets = [('synthetic',synthetic_candles(200000,'1m',seed)) for seed in range(3)]
+    sets += [(path,CandleData.from_csv(path)) for path in sys.argv[1:]]
+    for name,candles in sets:
+        for use_numba in (True,False):
+            print(name,'numba' if use_numba else 'python',verify(candles,use_numba),verify(candles,use_numba,len(candles)//2))
+    print(speed(synthetic_candles(1000000,'1m',7)))